@@ -186,3 +186,52 @@ CACHES = {
     }
 }
 
+
+# ML Engine Configuration
+ML_INDEX_DIR = BASE_DIR / 'var' / 'ml_index'
+INTENT_INDEX_DIR = ML_INDEX_DIR / 'intent'  # Published snapshots, see TFIDFIndex
+INTENT_INDEX_KEEP_SNAPSHOTS = 3
+INTENT_INDEX_CHECK_SECONDS = 5  # How often a worker checks its intent index for staleness
+INTENT_INDEX_FEATURES = 2 ** 18  # Hashed feature space of the intent index
+INTENT_INDEX_COMPACT_ROWS = 5000  # Refit once this many rows were updated incrementally
+INTENT_INDEX_COMPACT_SECONDS = 6 * 60 * 60  # ...or once a base fit with updates on top is this old
+INTENT_BATCH_MAX_QUERIES = 50
+INTENT_SEARCH_RANKER = 'tfidf'  # Default intent ranking: 'tfidf' (cosine) or 'bm25'
+INTENT_BM25_K1 = 1.2
+INTENT_BM25_B = 0.75
+INTENT_CACHE_SECONDS = 10 * 60  # Cached intent search results, keyed by index version
+INTENT_CACHE_NEGATIVE_SECONDS = 60  # Cached empty results
+INTENT_CACHE_LRU_SIZE = 2048  # In-process fallback when Redis is unreachable
+INTENT_SPELLING_MAX_DISTANCE = 2  # Edits a misspelled query word may be from a catalog word
+INTENT_SPELLING_INLINE_ROWS = 20000  # Larger catalogs build the spelling dictionary in the background
+SUGGEST_REBUILD_SECONDS = 5 * 60  # How often a worker rebuilds its autocomplete index in the background
+SUGGEST_QUERY_DAYS = 30  # Search log window for popular query suggestions
+SUGGEST_MIN_QUERY_COUNT = 2  # One-off searches are never suggested
+SUGGEST_MAX_QUERIES = 10000
+SUGGEST_MAX_RESULTS = 10
+VISUAL_INDEX_CHECK_SECONDS = 5  # How often a worker checks its visual feature matrix for staleness
+VISUAL_FEATURE_DTYPE = 'float32'  # Storage of ImageFeatures vectors: 'float32', 'float16' or 'int8'
+VISUAL_SEARCH_BACKEND = 'exact'  # 'exact' scores every vector, 'ivf' uses the index from build_visual_index
+VISUAL_ANN_DIR = ML_INDEX_DIR / 'visual_ivf'
+VISUAL_IVF_LISTS = None  # Inverted lists of the IVF index, None for sqrt(catalog size)
+VISUAL_IVF_PROBES = 8  # Lists scanned per query: higher is slower with better recall
+VISUAL_FILTER_EXACT_ROWS = 50000  # Filtered IVF searches passing at most this many products score them exactly
+VISUAL_NEIGHBOURS_K = 20  # Similar products stored per product by precompute_visual_neighbours
+IMAGE_FETCH_TIMEOUT = 10  # Seconds per product image download
+IMAGE_FETCH_RETRIES = 3  # Retries with backoff on connection errors and 429/5xx
+IMAGE_FETCH_WORKERS = 16  # Concurrent downloads of index_images
+IMAGE_INDEX_CHECKPOINT = ML_INDEX_DIR / 'index_images.checkpoint'  # Last product id indexed, for --resume
+PRICE_FORECAST_CHECKPOINT = ML_INDEX_DIR / 'predict_prices.checkpoint'  # Product id ranges forecast today, for --resume
+PRICE_TREND_DAYS = 60  # Window of the running PriceTrend sums, as PricePredictor.days_history
+PRICE_PREDICTION_RETENTION_DAYS = 30  # Older non-current forecasts are compacted into PredictionAccuracy
+IMAGE_CACHE_DIR = BASE_DIR / 'var' / 'image_cache'  # Downloaded product images by sha256, revalidated with conditional GETs
+VISUAL_EXTRACTION_PROCESSES = 2  # Per web worker; 0 extracts in the request thread
+VISUAL_EXTRACTION_MAX_PENDING = 8  # Uploads queued or in extraction before visual search answers 503
+VISUAL_EXTRACTION_TIMEOUT = 10  # Seconds
+VISUAL_RETRY_AFTER_SECONDS = 2
+VISUAL_MAX_IMAGE_PIXELS = 24_000_000  # After reduced-resolution decoding; larger uploads get 413
+VISUAL_DECODE_SIZE = 224  # JPEG uploads are decoded at the smallest scale covering this size
+VISUAL_CACHE_SECONDS = 30 * 60  # Cached visual search results, keyed by visual index version
+VISUAL_CACHE_NEGATIVE_SECONDS = 60  # Cached empty results
+VISUAL_CACHE_LRU_SIZE = 1024  # In-process fallback when Redis is unreachable
+VISUAL_CACHE_MAX_DISTANCE = 3  # Perceptual hash bits an upload may differ by to reuse cached results
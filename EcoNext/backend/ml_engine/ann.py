@@ -0,0 +1,179 @@
+"""
+Approximate nearest-neighbour search for visual search (IVF, NumPy only)
+Finds the closest of 1M+ image vectors without scoring every one of them
+
+Vectors are clustered with spherical k-means; each cluster's vectors are
+stored contiguously as an inverted list. A query scores the centroids and
+then only the vectors of the n_probe closest lists, so n_probe trades recall
+for latency. `manage.py build_visual_index` trains and publishes the index,
+workers memory-map the newest one (see current_path).
+"""
+
+from pathlib import Path
+import numpy as np
+import scipy.sparse as sp
+import json
+import os
+import shutil
+import time
+
+# Bump when the saved layout changes so old indexes are rebuilt
+ANN_FORMAT = 1
+
+ANN_ARRAYS = ['centroids', 'offsets', 'product_ids', 'vectors']
+
+# Rows scored per block when assigning vectors to centroids
+ASSIGN_BLOCK = 65536
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Closest centroid (by dot product) of every vector, computed in blocks to bound memory"""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BLOCK):
+        labels[start:start + ASSIGN_BLOCK] = np.argmax(vectors[start:start + ASSIGN_BLOCK] @ centroids.T, axis=1)
+    return labels
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 15, seed: int = 0) -> np.ndarray:
+    """Unit-length centroids of L2-normalized vectors, by Lloyd iterations on cosine similarity"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    
+    for _ in range(iterations):
+        labels = assign(vectors, centroids)
+        # Per-cluster sums as one sparse (clusters x vectors) membership product
+        membership = sp.csr_matrix(
+            (np.ones(len(vectors), dtype=np.float32), (labels, np.arange(len(vectors)))),
+            shape=(n_clusters, len(vectors))
+        )
+        sums = np.asarray(membership @ vectors)
+        sizes = np.bincount(labels, minlength=n_clusters)
+        
+        # Restart empty clusters on random vectors
+        empty = np.flatnonzero(sizes == 0)
+        sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = (sums / np.where(norms > 0, norms, 1)).astype(np.float32)
+    
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index over L2-normalized vectors
+    
+    List i holds rows offsets[i]:offsets[i + 1] of `vectors` and `product_ids`,
+    the vectors closest to centroids[i].
+    """
+    
+    def __init__(self, centroids, offsets, product_ids, vectors, version: str = '', built_at: float = None, path=None):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.product_ids = product_ids
+        self.vectors = vectors
+        self.version = version
+        self.built_at = built_at or time.time()
+        self.path = path  # Directory it was loaded from
+    
+    def __len__(self):
+        return len(self.product_ids)
+    
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+    
+    @classmethod
+    def train(cls, vectors: np.ndarray, product_ids: np.ndarray, n_lists: int = None, sample_size: int = None,
+              iterations: int = 15, seed: int = 0, version: str = ''):
+        """Cluster a sample of the vectors and file every vector under its closest centroid
+        
+        n_lists defaults to sqrt(len(vectors)); k-means runs on up to
+        sample_size vectors (64 per list by default) since centroids settle
+        long before every vector has been seen.
+        """
+        n_lists = min(n_lists or max(1, int(np.sqrt(len(vectors)))), len(vectors))
+        sample_size = min(sample_size or 64 * n_lists, len(vectors))
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = spherical_kmeans(sample, n_lists, iterations, seed)
+        
+        labels = assign(vectors, centroids)
+        order = np.argsort(labels, kind='stable')
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=n_lists), out=offsets[1:])
+        
+        return cls(
+            centroids, offsets, np.ascontiguousarray(product_ids[order]),
+            np.ascontiguousarray(vectors[order], dtype=np.float32), version,
+        )
+    
+    def search(self, query: np.ndarray, k: int, n_probe: int) -> tuple:
+        """Product ids and similarities of the k best vectors in the n_probe lists closest to query"""
+        n_probe = min(n_probe, self.n_lists)
+        centroid_scores = self.centroids @ query
+        if n_probe < self.n_lists:
+            lists = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        else:
+            lists = np.arange(self.n_lists)
+        
+        rows = [np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists]
+        scores = [self.vectors[self.offsets[i]:self.offsets[i + 1]] @ query for i in lists]
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+        
+        if len(scores) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return self.product_ids[rows[order]], scores[order]
+    
+    def save(self, directory):
+        """Write the arrays as .npy plus meta.json"""
+        directory = Path(directory)
+        tmp_directory = directory.with_name(f'{directory.name}.{os.getpid()}.tmp')
+        tmp_directory.mkdir(parents=True)
+        for name in ANN_ARRAYS:
+            np.save(tmp_directory / f'{name}.npy', np.ascontiguousarray(getattr(self, name)))
+        (tmp_directory / 'meta.json').write_text(json.dumps({
+            'format': ANN_FORMAT,
+            'version': self.version,
+            'built_at': self.built_at,
+        }))
+        os.replace(tmp_directory, directory)
+    
+    @classmethod
+    def load(cls, directory):
+        """Memory-map a saved index, or None if it is missing, unreadable or of an old format"""
+        directory = Path(directory)
+        try:
+            meta = json.loads((directory / 'meta.json').read_text())
+            if meta['format'] != ANN_FORMAT:
+                return None
+            arrays = {name: np.load(directory / f'{name}.npy', mmap_mode='r') for name in ANN_ARRAYS}
+        except (OSError, ValueError, KeyError):
+            return None
+        return cls(**arrays, version=meta['version'], built_at=meta['built_at'], path=directory)
+
+
+def publish(index: IVFIndex, root, keep: int = 2) -> Path:
+    """Save the index under root and point root/CURRENT at it, keeping a few older ones for running workers"""
+    root = Path(root)
+    directory = root / f'{index.version}-{int(index.built_at)}'
+    index.save(directory)
+    
+    pointer = root / f'CURRENT.{os.getpid()}.tmp'
+    pointer.write_text(directory.name)
+    os.replace(pointer, root / 'CURRENT')
+    
+    published = sorted((path for path in root.iterdir() if path.is_dir()), key=lambda path: path.stat().st_mtime)
+    for old in published[:-keep]:
+        if old != directory:
+            shutil.rmtree(old, ignore_errors=True)
+    return directory
+
+
+def current_path(root):
+    """Directory of the published index, or None"""
+    try:
+        return Path(root) / (Path(root) / 'CURRENT').read_text().strip()
+    except OSError:
+        return None
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class MlEngineConfig(AppConfig):
     name = 'ml_engine'
+
+    def ready(self):
+        from ml_engine import signals  # noqa: F401
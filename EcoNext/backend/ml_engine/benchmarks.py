@@ -0,0 +1,90 @@
+"""
+Helpers shared by the ml_engine benchmark commands
+Synthetic catalogs and latency percentiles, no database needed
+"""
+
+import numpy as np
+import time
+
+# Product vocabulary the synthetic words are mixed with, so queries look like real searches
+BASE_WORDS = [
+    'yoga', 'mat', 'gym', 'shoes', 'running', 'bottle', 'water', 'steel', 'bamboo', 'cotton',
+    'organic', 'kitchen', 'knife', 'pan', 'spoon', 'board', 'desk', 'chair', 'lamp', 'solar',
+    'charger', 'phone', 'laptop', 'speaker', 'bluetooth', 'wireless', 'headphones', 'watch', 'bag', 'backpack',
+    'travel', 'pillow', 'blanket', 'garden', 'plant', 'pot', 'soap', 'shampoo', 'towel', 'brush',
+    'eco', 'recycled', 'natural', 'leather', 'wooden', 'glass', 'ceramic', 'fitness', 'dumbbells', 'fashion',
+]
+
+
+def synthetic_catalog(size: int, vocabulary_size: int = 20000, seed: int = 0):
+    """Product ids and documents with Zipf-distributed words, like a real catalog's long tail"""
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(BASE_WORDS + [f'term{i}' for i in range(vocabulary_size - len(BASE_WORDS))])
+    
+    # Rank r is drawn with probability ~ 1/r
+    weights = 1.0 / np.arange(1, len(vocabulary) + 1)
+    weights /= weights.sum()
+    
+    lengths = rng.integers(6, 16, size=size)
+    words = vocabulary[rng.choice(len(vocabulary), size=lengths.sum(), p=weights)]
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    documents = [' '.join(words[bounds[i]:bounds[i + 1]]) for i in range(size)]
+    
+    return np.arange(1, size + 1, dtype=np.int64), documents
+
+
+def synthetic_queries(count: int, seed: int = 1) -> list:
+    """One to three word queries drawn mostly from the popular words"""
+    rng = np.random.default_rng(seed)
+    return [
+        ' '.join(rng.choice(BASE_WORDS, size=rng.integers(1, 4), replace=False))
+        for _ in range(count)
+    ]
+
+
+def time_calls(fn, args_list) -> np.ndarray:
+    """Latency of fn(*args) for each entry of args_list, in milliseconds"""
+    timings = []
+    for args in args_list:
+        started = time.perf_counter()
+        fn(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    return np.array(timings)
+
+
+def percentiles(timings: np.ndarray) -> str:
+    """p50/p99 summary of timings in milliseconds"""
+    p50, p99 = np.percentile(timings, [50, 99])
+    return f'p50 {p50:8.3f} ms  p99 {p99:8.3f} ms'
+
+
+def scale_catalog(rows: list, factor: int, seed: int = 0):
+    """Grow (id, name, category, tags) rows into `factor` noisy copies each
+    
+    Copies get a random amount of filler text, so document lengths vary the
+    way real descriptions do, and randomly lose tags. Returns the scaled rows
+    and, for each, the index of the row it was copied from.
+    """
+    rng = np.random.default_rng(seed)
+    filler = np.array([f'term{i}' for i in range(5000)])
+    scaled = []
+    sources = []
+    
+    for copy in range(factor):
+        for source, (_, name, category, tags) in enumerate(rows):
+            kept_tags = [tag for tag in tags if rng.random() > 0.3]
+            noise = ' '.join(rng.choice(filler, size=rng.integers(0, 25)))
+            scaled.append((len(scaled) + 1, f'{name} {noise}'.strip(), category, kept_tags))
+            sources.append(source)
+    
+    return scaled, np.array(sources)
+
+
+def synthetic_image_features(size: int, dim: int = 192, clusters: int = 2000, noise: float = 0.6,
+                             seed: int = 0) -> np.ndarray:
+    """L2-normalized non-negative vectors scattered around a few thousand "looks", like colour histograms"""
+    rng = np.random.default_rng(seed)
+    centers = rng.random((clusters, dim), dtype=np.float32) ** 4
+    vectors = centers[rng.integers(0, clusters, size=size)]
+    vectors += noise * rng.random((size, dim), dtype=np.float32) ** 4
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
@@ -0,0 +1,100 @@
+"""
+Request-time feature extraction in a bounded process pool
+Keeps decoding and histogramming uploads off the request threads
+
+Each web worker owns one small pool. At most VISUAL_EXTRACTION_MAX_PENDING
+uploads may be queued or running in it; beyond that ExtractionPoolBusy is
+raised so the view can answer 503 with Retry-After instead of piling up work.
+"""
+
+from django.conf import settings
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from ml_engine.features import query_features
+import threading
+import time
+
+
+class ExtractionPoolBusy(Exception):
+    """Too many uploads are already queued for extraction"""
+
+
+class ExtractionPool:
+    """Process pool accepting at most max_pending jobs at a time"""
+    
+    def __init__(self, processes: int, max_pending: int):
+        self.processes = processes
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+    
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.processes)
+            return self._executor
+    
+    def _reset(self):
+        """Drop a pool whose processes died, the next job starts a new one"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+    
+    def run(self, fn, *args, timeout: float = None):
+        """fn(*args) in a worker process, raises ExtractionPoolBusy when the pool is full
+        
+        A job holds its slot until it finishes, also after run gave up waiting
+        for it, so jobs still running past their timeout keep new ones out.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise ExtractionPoolBusy()
+        if not self.processes:
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=timeout)
+        except BrokenProcessPool:
+            self._reset()
+            raise
+        except TimeoutError:
+            # Only drops a job still queued; a running one frees its slot when it ends
+            future.cancel()
+            raise
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def extraction_pool() -> ExtractionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ExtractionPool(settings.VISUAL_EXTRACTION_PROCESSES, settings.VISUAL_EXTRACTION_MAX_PENDING)
+    return _pool
+
+
+def extract_upload(image_bytes: bytes) -> tuple:
+    """(features, perceptual hash, timings in ms) of an uploaded image, decoded at reduced resolution in the extraction pool
+    
+    Raises ExtractionPoolBusy when saturated, concurrent.futures.TimeoutError
+    after VISUAL_EXTRACTION_TIMEOUT and features.ImageTooLarge for inputs
+    above VISUAL_MAX_IMAGE_PIXELS.
+    """
+    submitted_at = time.time()
+    features, image_hash, timings = extraction_pool().run(
+        query_features, image_bytes, settings.VISUAL_MAX_IMAGE_PIXELS, settings.VISUAL_DECODE_SIZE,
+        timeout=settings.VISUAL_EXTRACTION_TIMEOUT,
+    )
+    timings['queue_ms'] = max(0.0, (timings.pop('started_at') - submitted_at) * 1000)
+    return features, image_hash, timings
@@ -0,0 +1,124 @@
+"""
+HSV colour histogram features of product images
+Free of Django imports so extraction can run in worker processes
+"""
+
+import cv2
+import numpy as np
+import hashlib
+import io
+import time
+from PIL import Image
+
+
+def histogram_features(img: np.ndarray) -> np.ndarray:
+    """64-bin H, S and V histograms of a BGR image, each L2-normalized, as one float32 vector"""
+    
+    # Resize for consistent feature extraction
+    img = cv2.resize(img, (224, 224))
+    
+    # Convert to HSV for better color representation
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    
+    # Extract histogram features from each channel
+    hist_h = cv2.calcHist([hsv], [0], None, [64], [0, 256])
+    hist_s = cv2.calcHist([hsv], [1], None, [64], [0, 256])
+    hist_v = cv2.calcHist([hsv], [2], None, [64], [0, 256])
+    
+    # Normalize histograms
+    hist_h = cv2.normalize(hist_h, hist_h).flatten()
+    hist_s = cv2.normalize(hist_s, hist_s).flatten()
+    hist_v = cv2.normalize(hist_v, hist_v).flatten()
+    
+    # Combine all features
+    features = np.concatenate([hist_h, hist_s, hist_v])
+    
+    return features.astype(np.float32)
+
+
+def perceptual_hash(img: np.ndarray) -> str:
+    """Difference hash of a BGR image plus its coarse mean colour, as 19 hex digits
+    
+    The 64 bits compare horizontally adjacent cells of a 9x8 grayscale
+    thumbnail, set when brightness increases. dHash ignores colour, so a plain
+    red and a plain blue image would collide; the mean colour at 8 levels per
+    channel tells them apart. Re-encoded, resized or recompressed copies of an
+    image keep the same hash.
+    """
+    thumbnail = cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), (9, 8), interpolation=cv2.INTER_AREA)
+    bits = thumbnail[:, 1:] > thumbnail[:, :-1]
+    colour = (img.reshape(-1, 3).mean(axis=0) // 32).astype(int)
+    return np.packbits(bits).tobytes().hex() + ''.join(str(level) for level in colour)
+
+
+def hash_bands(image_hash: str, max_distance: int) -> list:
+    """max_distance + 1 pieces of a perceptual hash, each with its colour part
+    
+    Two hashes differing in at most max_distance of the 64 bits agree on at
+    least one piece, so near-duplicates can be found by exact key lookups.
+    """
+    bits = np.unpackbits(np.frombuffer(bytes.fromhex(image_hash[:16]), dtype=np.uint8))
+    return [
+        f"{i}:{np.packbits(band).tobytes().hex()}:{image_hash[16:]}"
+        for i, band in enumerate(np.array_split(bits, max_distance + 1))
+    ]
+
+
+def hash_distance(a: str, b: str) -> int:
+    """Bits in which two perceptual hashes differ, 65 when their colours differ"""
+    if a[16:] != b[16:]:
+        return 65
+    return bin(int(a[:16], 16) ^ int(b[:16], 16)).count('1')
+
+
+def image_digest(image_bytes: bytes) -> str:
+    """sha256 of the encoded image, stored as ImageFeatures.image_hash"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def features_from_bytes(image_bytes: bytes):
+    """Features of an encoded image (decoded through PIL like every stored vector), None if it cannot be read"""
+    try:
+        image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+        return histogram_features(cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR))
+    except Exception as e:
+        print(f"Error extracting features: {e}")
+        return None
+
+
+def features_from_path(path) -> np.ndarray:
+    """features_from_bytes of an image file, so worker processes read the file instead of receiving its bytes"""
+    with open(path, 'rb') as f:
+        return features_from_bytes(f.read())
+
+
+class ImageTooLarge(ValueError):
+    """Image has more pixels than allowed even after reduced-resolution decoding"""
+
+
+def decode_reduced(image_bytes: bytes, max_pixels: int, size: int = 224) -> np.ndarray:
+    """Decode to BGR at the smallest JPEG scale (1/2, 1/4, 1/8) that still covers size x size
+    
+    Features are computed at 224x224, so large JPEGs are never decoded at full
+    size only to be resized. Other formats decode at full size and must stay
+    within max_pixels.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    image.draft('RGB', (size, size))
+    if image.width * image.height > max_pixels:
+        raise ImageTooLarge(f'Image is {image.width}x{image.height}, at most {max_pixels} pixels are allowed')
+    return cv2.cvtColor(np.array(image.convert('RGB')), cv2.COLOR_RGB2BGR)
+
+
+def query_features(image_bytes: bytes, max_pixels: int, size: int = 224) -> tuple:
+    """(features, perceptual hash, {'decode_ms', 'extract_ms', 'started_at'}) of an uploaded image, run in the extraction pool"""
+    started_at = time.time()
+    started = time.perf_counter()
+    img = decode_reduced(image_bytes, max_pixels, size)
+    decoded = time.perf_counter()
+    features = histogram_features(img)
+    return features, perceptual_hash(img), {
+        'started_at': started_at,
+        'decode_ms': (decoded - started) * 1000,
+        'extract_ms': (time.perf_counter() - decoded) * 1000,
+    }
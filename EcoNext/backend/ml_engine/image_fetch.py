@@ -0,0 +1,129 @@
+"""
+Downloading product images over pooled, retrying HTTP connections
+
+Downloads go through an on-disk cache: image bytes are stored once under
+their sha256 and each URL keeps its ETag/Last-Modified, so re-indexing only
+sends conditional GETs and unchanged images cost a 304.
+"""
+
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ml_engine.features import image_digest
+from pathlib import Path
+import hashlib
+import requests
+import threading
+import json
+import os
+
+_session = None
+_session_lock = threading.Lock()
+_cache = None
+
+
+def make_session(pool_size: int = 10, retries: int = None) -> requests.Session:
+    """Session keeping up to pool_size connections per host, retrying failed GETs with backoff"""
+    retry = Retry(
+        total=settings.IMAGE_FETCH_RETRIES if retries is None else retries,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['GET', 'HEAD'],
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def image_session() -> requests.Session:
+    """Process-wide session for one-off image downloads"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = make_session()
+    return _session
+
+
+class CachedImage:
+    """A downloaded image in the cache"""
+    
+    def __init__(self, digest: str, path: Path, not_modified: bool):
+        self.digest = digest
+        self.path = path
+        self.not_modified = not_modified  # The server answered 304, nothing was downloaded
+    
+    def read(self) -> bytes:
+        return self.path.read_bytes()
+
+
+class ImageCache:
+    """Image bytes on disk under blobs/<sha256>, with the validators of every URL under urls/"""
+    
+    def __init__(self, root):
+        self.root = Path(root)
+    
+    def _blob_path(self, digest: str) -> Path:
+        return self.root / 'blobs' / digest[:2] / digest
+    
+    def _meta_path(self, url: str) -> Path:
+        return self.root / 'urls' / f'{hashlib.sha1(url.encode()).hexdigest()}.json'
+    
+    @staticmethod
+    def _write(path: Path, data: bytes):
+        # Write then rename, so concurrent readers never see a partial file
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    
+    def fetch(self, url: str, session: requests.Session = None) -> CachedImage:
+        """Image at url, revalidated with a conditional GET when it was downloaded before"""
+        meta_path = self._meta_path(url)
+        meta = None
+        try:
+            meta = json.loads(meta_path.read_text())
+            if not self._blob_path(meta['digest']).exists():
+                meta = None
+        except (OSError, ValueError, KeyError):
+            pass
+        
+        headers = {}
+        if meta is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        
+        response = (session or image_session()).get(url, headers=headers, timeout=settings.IMAGE_FETCH_TIMEOUT)
+        if response.status_code == 304 and meta is not None:
+            return CachedImage(meta['digest'], self._blob_path(meta['digest']), not_modified=True)
+        response.raise_for_status()
+        
+        digest = image_digest(response.content)
+        blob_path = self._blob_path(digest)
+        if not blob_path.exists():
+            self._write(blob_path, response.content)
+        self._write(meta_path, json.dumps({
+            'url': url,
+            'digest': digest,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }).encode())
+        return CachedImage(digest, blob_path, not_modified=False)
+
+
+def image_cache() -> ImageCache:
+    """Cache under IMAGE_CACHE_DIR shared by every download of this process"""
+    global _cache
+    if _cache is None or _cache.root != Path(settings.IMAGE_CACHE_DIR):
+        _cache = ImageCache(settings.IMAGE_CACHE_DIR)
+    return _cache
+
+
+def fetch_image(url: str, session: requests.Session = None) -> bytes:
+    """Image bytes at url through the cache, raises requests.RequestException on failure"""
+    return image_cache().fetch(url, session).read()
@@ -1,87 +1,781 @@
 """
 Intent-Based Search using TF-IDF
 Maps user queries to product intents (e.g., "gym" -> shoes, bottle, yoga mat)
+
+The fitted vectorizer and document matrix are built once and shared by every
+request in the process (see get_intent_index). `manage.py build_intent_index`
+publishes the index as a snapshot of .npy arrays that workers memory-map on
+start, recorded in TFIDFIndex; the catalog version stamp tells each worker
+which edits it still has to catch up with.
 """
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer, ENGLISH_STOP_WORDS
+from sklearn.pipeline import make_pipeline
 import numpy as np
+import scipy.sparse as sp
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Max
 from products.models import Product
 from ml_engine.models import TFIDFIndex
+from ml_engine.result_cache import ResultCache
+from ml_engine.spelling import SpellingIndex, TOKEN_PATTERN
+from pathlib import Path
+from datetime import datetime
+import copy
+import hashlib
+import os
+import shutil
+import threading
+import time
 import json
 
+# Bump when the layout of IntentIndex changes so old snapshots are rebuilt
+INDEX_FORMAT = 6
+
+# Arrays of a snapshot directory, each stored as <name>.npy
+SNAPSHOT_ARRAYS = [
+    'data', 'indices', 'indptr',
+    'postings_data', 'postings_indices', 'postings_indptr',
+    'product_ids', 'idf',
+    'bm25_data', 'bm25_idf', 'doc_lengths',
+    'names_buffer', 'names_offsets',
+    'categories_buffer', 'categories_offsets',
+    'tags_buffer', 'tags_offsets',
+]
+
+# Separates the tags of one product inside its StringColumn entry
+TAG_SEPARATOR = '\x1f'
+
+# Ranking modes and the minimum score a result needs under each
+RANKERS = ('tfidf', 'bm25')
+MIN_SCORE = {
+    'tfidf': 0.1,  # cosine similarity
+    'bm25': 0.0,  # unbounded, any shared term counts
+}
+
+
+def catalog_stats() -> dict:
+    """Product count, highest id and latest update time of the catalog"""
+    return Product.objects.aggregate(
+        count=Count('id'),
+        last_id=Max('id'),
+        last_updated=Max('updated_at'),
+    )
+
+
+def catalog_version(stats: dict = None) -> str:
+    """Version stamp of the product catalog, changes when products are added, edited or removed"""
+    stats = stats or catalog_stats()
+    raw = f"{INDEX_FORMAT}:{stats['count']}:{stats['last_id']}:{stats['last_updated']}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+# Category recommendations by catalog version + normalized query
+query_cache = ResultCache(
+    'intent',
+    timeout=settings.INTENT_CACHE_SECONDS,
+    negative_timeout=settings.INTENT_CACHE_NEGATIVE_SECONDS,
+    lru_size=settings.INTENT_CACHE_LRU_SIZE,
+)
+
+
+def normalize_query(query: str) -> str:
+    """Lowercased query tokens without stop words, queries that normalize alike score alike"""
+    return ' '.join(
+        token for token in TOKEN_PATTERN.findall(query.lower())
+        if token not in ENGLISH_STOP_WORDS
+    )
+
+
+def product_rows(queryset) -> list:
+    """(product id, name, category name, tags) of the given products, in one query"""
+    return list(queryset.values_list('id', 'name', 'category__name', 'tags'))
+
+
+def product_document(name: str, category_name: str, tags: list) -> str:
+    """Combine product metadata for intent extraction"""
+    return f"{name} {category_name} {' '.join(tags)}"
+
+
+class StringColumn:
+    """Strings stored as one UTF-8 buffer plus offsets, so a snapshot can memory-map them"""
+    
+    def __init__(self, buffer, offsets):
+        self.buffer = buffer
+        self.offsets = offsets
+    
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [string.encode() for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+    
+    def __len__(self):
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, i: int) -> str:
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]].tobytes().decode()
+
+
+class BM25Weights:
+    """Okapi BM25 statistics of the index rows
+    
+    The saturated weight tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl)) of
+    every posting is precomputed from the document lengths, so a BM25 query
+    reads the same postings as a TF-IDF one and only multiplies other weights.
+    """
+    
+    def __init__(self, postings, idf, doc_lengths, avgdl: float, k1: float, b: float):
+        self.postings = postings
+        self.idf = idf
+        self.doc_lengths = doc_lengths
+        self.avgdl = avgdl
+        self.k1 = k1
+        self.b = b
+    
+    @classmethod
+    def from_counts(cls, counts, k1: float, b: float):
+        """Fit document lengths and IDF on a (documents x terms) count matrix"""
+        doc_lengths = np.asarray(counts.sum(axis=1), dtype=np.float32).ravel()
+        avgdl = float(doc_lengths.mean())
+        df = np.diff(counts.tocsc().indptr)
+        idf = np.log1p((counts.shape[0] - df + 0.5) / (df + 0.5)).astype(np.float32)
+        weights = cls(None, idf, doc_lengths, avgdl, k1, b).document_weights(counts, doc_lengths)
+        return cls(weights.tocsc(), idf, doc_lengths, avgdl, k1, b)
+    
+    def document_weights(self, counts, doc_lengths=None):
+        """Saturated term weights of documents, as CSR"""
+        counts = counts.tocsr().astype(np.float32)
+        if doc_lengths is None:
+            doc_lengths = np.asarray(counts.sum(axis=1), dtype=np.float32).ravel()
+        entry_rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+        length_norm = self.k1 * (1 - self.b + self.b * doc_lengths[entry_rows] / self.avgdl)
+        data = counts.data * (self.k1 + 1) / (counts.data + length_norm)
+        return sp.csr_matrix((data, counts.indices, counts.indptr), shape=counts.shape)
+    
+    def query_weights(self, counts):
+        """IDF-weighted query term counts, as CSR"""
+        counts = counts.tocsr().astype(np.float32)
+        return sp.csr_matrix((counts.data * self.idf[counts.indices], counts.indices, counts.indptr), shape=counts.shape)
+
+
+class IntentIndex:
+    """Fitted vectorizer, document matrix and the product ids of its rows
+    
+    Each row also carries its product's name, category name and tags, so
+    ranking, grouping and explaining results never needs the database. The
+    same columns feed the spelling dictionary used to correct query typos.
+    
+    Rows live in two segments: the base matrix from the last full fit and a
+    small delta of rows vectorized since. Editing a product masks its old row
+    out of `live` and appends a new one to the delta, so an update only
+    touches the rows of the products that changed. The hashing vectorizer has
+    no vocabulary to outgrow; compaction refits the IDF weights.
+    """
+    
+    def __init__(self, vectorizer, matrix, product_ids, version: str, watermark=None, postings=None, built_at=None,
+                 names=None, categories=None, tags=None, bm25=None):
+        self.vectorizer = vectorizer
+        self.matrix = matrix
+        # Column-major copy of the base matrix: the postings list of term t is
+        # indices[indptr[t]:indptr[t + 1]], with its TF-IDF weights in data
+        if postings is None and matrix is not None:
+            postings = matrix.tocsc()
+        self.postings = postings
+        self.bm25 = bm25
+        self.delta = None
+        self.delta_bm25 = None
+        self.delta_fields = []
+        self.names = names if names is not None else StringColumn.from_strings([])
+        self.categories = categories if categories is not None else StringColumn.from_strings([])
+        self.tags = tags if tags is not None else StringColumn.from_strings([])
+        self.product_ids = product_ids
+        self.live = np.ones(len(product_ids), dtype=bool)
+        self._rows = None
+        # Shared by the copies made on update, so the dictionary is built once per base
+        self._spelling = {'index': None, 'building': False}
+        self.version = version
+        self.watermark = watermark
+        self.built_at = built_at or time.time()
+        self.checked_at = time.monotonic()
+    
+    def __len__(self):
+        return len(self._rows) if self._rows is not None else int(self.live.sum())
+    
+    @property
+    def rows(self) -> dict:
+        """Row of every live product id, built on first use since only updates need it"""
+        if self._rows is None:
+            live_rows = np.flatnonzero(self.live)
+            self._rows = dict(zip(self.product_ids[live_rows].tolist(), live_rows.tolist()))
+        return self._rows
+    
+    @property
+    def spelling(self):
+        """Spelling dictionary over the words of the live rows, None while it is being built
+        
+        Small catalogs build it on first use; larger ones build it in a thread
+        and search uncorrected until it is ready.
+        """
+        holder = self._spelling
+        if holder['index'] is None and not holder['building']:
+            with _spelling_lock:
+                if holder['index'] is None and not holder['building']:
+                    holder['building'] = True
+                    if len(self) <= settings.INTENT_SPELLING_INLINE_ROWS:
+                        self._build_spelling(holder)
+                    else:
+                        threading.Thread(
+                            target=self._build_spelling, args=(holder,), name='intent-spelling', daemon=True
+                        ).start()
+        return holder['index']
+    
+    def _build_spelling(self, holder: dict):
+        try:
+            spelling = SpellingIndex(settings.INTENT_SPELLING_MAX_DISTANCE)
+            for row in np.flatnonzero(self.live):
+                spelling.add_document(product_document(*self.fields(row)))
+            holder['index'] = spelling
+        except Exception as e:
+            print(f"Error building spelling index: {e}")
+    
+    def fields(self, row: int) -> tuple:
+        """(name, category name, tags) of a row"""
+        base_rows = len(self.names)
+        if row >= base_rows:
+            return self.delta_fields[row - base_rows]
+        tags = self.tags[row]
+        return self.names[row], self.categories[row], tags.split(TAG_SEPARATOR) if tags else []
+    
+    @classmethod
+    def build(cls, stats: dict = None):
+        """Fit a fresh index over the whole catalog"""
+        # Read the stats before scanning so edits made during the scan are caught up later
+        stats = stats or catalog_stats()
+        index = IntentBasedSearcher().build_intent_catalog()
+        index.version = catalog_version(stats)
+        index.watermark = stats['last_updated']
+        return index
+    
+    def transform(self, queries: list, ranker: str = 'tfidf'):
+        """Query vectors for the given ranker, one row per query"""
+        if ranker == 'bm25':
+            return self.bm25.query_weights(self.vectorizer.steps[0][1].transform(queries))
+        return self.vectorizer.transform(queries)
+    
+    def _segments(self, ranker: str) -> tuple:
+        """Base postings and delta rows holding the ranker's weights"""
+        if ranker == 'bm25':
+            return self.bm25.postings, self.delta_bm25
+        return self.postings, self.delta
+    
+    def scores(self, query_vector) -> np.ndarray:
+        """Cosine similarity of a query against every row, 0 for replaced rows
+        
+        Dense reference path; searches go through top_k.
+        """
+        # Rows and queries are L2-normalized, so the dot product is the cosine
+        scores = (self.matrix @ query_vector.T).toarray().ravel()
+        if self.delta is not None:
+            scores = np.concatenate([scores, (self.delta @ query_vector.T).toarray().ravel()])
+        scores[~self.live] = 0
+        return scores
+    
+    def top_k(self, query_vector, k: int, min_score: float = 0.0, ranker: str = 'tfidf'):
+        """Rows and scores of the k best live matches above min_score, best first
+        
+        Only the postings of the query's terms are read, so the cost follows the
+        number of documents sharing a term with the query rather than the
+        catalog size, and partial selection replaces the full sort.
+        """
+        postings, delta = self._segments(ranker)
+        starts = postings.indptr[query_vector.indices]
+        ends = postings.indptr[query_vector.indices + 1]
+        rows = np.concatenate(
+            [postings.indices[start:end] for start, end in zip(starts, ends)] + [np.empty(0, dtype=np.int32)]
+        )
+        contributions = np.concatenate(
+            [postings.data[start:end] * weight for start, end, weight in zip(starts, ends, query_vector.data)]
+            + [np.empty(0)]
+        )
+        candidates, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=contributions, minlength=len(candidates))
+        
+        if delta is not None:
+            delta_scores = (delta @ query_vector.T).toarray().ravel()
+            hits = np.flatnonzero(delta_scores)
+            candidates = np.concatenate([candidates, hits + self.matrix.shape[0]])
+            scores = np.concatenate([scores, delta_scores[hits]])
+        
+        return self._select(candidates, scores, k, min_score)
+    
+    def top_k_batch(self, query_matrix, k: int, min_score: float = 0.0, ranker: str = 'tfidf') -> list:
+        """top_k for every row of a query matrix, scored with one sparse product"""
+        postings, delta = self._segments(ranker)
+        # postings.T is the (terms x products) CSR inverted index, so the product only reads
+        # the postings of query terms; row i holds the products sharing a term with query i
+        matches = (query_matrix @ postings.T).tocsr()
+        delta_scores = None
+        if delta is not None:
+            delta_scores = (query_matrix @ delta.T).toarray()
+        
+        results = []
+        for i in range(query_matrix.shape[0]):
+            start, end = matches.indptr[i], matches.indptr[i + 1]
+            candidates, scores = matches.indices[start:end], matches.data[start:end]
+            if delta_scores is not None:
+                hits = np.flatnonzero(delta_scores[i])
+                candidates = np.concatenate([candidates, hits + self.matrix.shape[0]])
+                scores = np.concatenate([scores, delta_scores[i][hits]])
+            results.append(self._select(candidates, scores, k, min_score))
+        
+        return results
+    
+    def _select(self, candidates, scores, k: int, min_score: float):
+        """Best k live candidates above min_score, best first, by partial selection"""
+        keep = self.live[candidates] & (scores > min_score)
+        candidates, scores = candidates[keep], scores[keep]
+        
+        if len(scores) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            candidates, scores = candidates[best], scores[best]
+        
+        order = np.argsort(-scores, kind='stable')
+        return candidates[order], scores[order]
+    
+    def apply_changes(self, changed: list, deleted_ids=()):
+        """Return a copy of the index with the given product rows re-vectorized or removed"""
+        changed = {product_id: fields for product_id, *fields in changed}
+        index = copy.copy(self)
+        index.live = self.live.copy()
+        index._rows = dict(self.rows)
+        
+        for product_id in (*deleted_ids, *changed):
+            row = index.rows.pop(product_id, None)
+            if row is not None:
+                index.live[row] = False
+        
+        if changed:
+            documents = [product_document(*fields) for fields in changed.values()]
+            vectors = self.vectorizer.transform(documents)
+            bm25_vectors = self.bm25.document_weights(self.vectorizer.steps[0][1].transform(documents))
+            first_row = len(self.product_ids)
+            index.delta = vectors if self.delta is None else sp.vstack([self.delta, vectors], format='csr')
+            index.delta_bm25 = (
+                bm25_vectors if self.delta_bm25 is None else sp.vstack([self.delta_bm25, bm25_vectors], format='csr')
+            )
+            index.delta_fields = self.delta_fields + [tuple(fields) for fields in changed.values()]
+            index.product_ids = np.concatenate([self.product_ids, np.fromiter(changed, dtype=np.int64)])
+            index.live = np.concatenate([index.live, np.ones(len(changed), dtype=bool)])
+            index.rows.update({product_id: first_row + i for i, product_id in enumerate(changed)})
+            
+            # New words become correctable; words of removed rows stay until compaction
+            if self._spelling['index'] is not None:
+                for document in documents:
+                    self._spelling['index'].add_document(document)
+        
+        return index
+    
+    def catch_up(self, stats: dict):
+        """Return a copy of the index that reflects products changed since it was built"""
+        products = Product.objects.all()
+        if self.watermark is not None:
+            # Saves bump updated_at; >= re-reads rows saved in the same tick, which is harmless
+            products = products.filter(updated_at__gte=self.watermark)
+        index = self.apply_changes(product_rows(products))
+        
+        if len(index) != stats['count']:
+            # Something was deleted: diff the ids to find what
+            current_ids = set(Product.objects.values_list('id', flat=True))
+            index = index.apply_changes([], [pid for pid in index.rows if pid not in current_ids])
+        
+        index.version = catalog_version(stats)
+        index.watermark = stats['last_updated']
+        return index
+    
+    def needs_compaction(self) -> bool:
+        """True once the delta has grown large or old enough for the IDF weights to drift"""
+        if self.vectorizer is None or self.delta is None:
+            return False
+        return (
+            self.delta.shape[0] >= settings.INTENT_INDEX_COMPACT_ROWS
+            or time.time() - self.built_at >= settings.INTENT_INDEX_COMPACT_SECONDS
+        )
+    
+    def save(self, directory) -> dict:
+        """Write the base segment as .npy arrays plus meta.json, returns the metadata"""
+        if self.delta is not None or not self.live.all():
+            raise ValueError('Only a freshly built index can be saved')
+        if self.vectorizer is None:
+            raise ValueError('An empty index cannot be saved')
+        if not np.array_equal(self.bm25.postings.indices, self.postings.indices):
+            raise ValueError('BM25 postings must share the TF-IDF sparsity')
+        
+        directory = Path(directory)
+        tmp_directory = directory.with_name(f'{directory.name}.{os.getpid()}.tmp')
+        tmp_directory.mkdir(parents=True)
+        try:
+            meta = self._write(tmp_directory)
+            os.replace(tmp_directory, directory)
+        except BaseException:
+            # A failed publish leaves no partial snapshot behind
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+            raise
+        
+        meta['size_bytes'] = sum(f.stat().st_size for f in directory.iterdir())
+        return meta
+    
+    def _write(self, directory: Path) -> dict:
+        """Write the snapshot files into an existing directory, returns the metadata"""
+        hashing, tfidf = self.vectorizer.steps[0][1], self.vectorizer.steps[1][1]
+        arrays = {
+            'data': self.matrix.data,
+            'indices': self.matrix.indices,
+            'indptr': self.matrix.indptr,
+            'postings_data': self.postings.data,
+            'postings_indices': self.postings.indices,
+            'postings_indptr': self.postings.indptr,
+            'product_ids': self.product_ids,
+            'idf': tfidf.idf_,
+            # Same sparsity as the TF-IDF postings, so only the weights are stored
+            'bm25_data': self.bm25.postings.data,
+            'bm25_idf': self.bm25.idf,
+            'doc_lengths': self.bm25.doc_lengths,
+        }
+        for name in ('names', 'categories', 'tags'):
+            column = getattr(self, name)
+            arrays[f'{name}_buffer'] = column.buffer
+            arrays[f'{name}_offsets'] = column.offsets
+        for name, array in arrays.items():
+            np.save(directory / f'{name}.npy', np.ascontiguousarray(array))
+        
+        meta = {
+            'format': INDEX_FORMAT,
+            'version': self.version,
+            'watermark': self.watermark.isoformat() if self.watermark else None,
+            'built_at': self.built_at,
+            'shape': list(self.matrix.shape),
+            'hashing': {
+                'n_features': hashing.n_features,
+                'ngram_range': list(hashing.ngram_range),
+                'lowercase': hashing.lowercase,
+                'stop_words': hashing.stop_words,
+            },
+            'bm25': {'k1': self.bm25.k1, 'b': self.bm25.b, 'avgdl': self.bm25.avgdl},
+        }
+        (directory / 'meta.json').write_text(json.dumps(meta))
+        return meta
+    
+    @classmethod
+    def load(cls, directory):
+        """Memory-map a saved index, or None if it is missing, unreadable or of an old format
+        
+        The arrays are mapped read-only, so loading costs no parsing or refit
+        and every worker on the host shares the same pages.
+        """
+        directory = Path(directory)
+        try:
+            meta = json.loads((directory / 'meta.json').read_text())
+            if meta['format'] != INDEX_FORMAT:
+                return None
+            if (meta['bm25']['k1'], meta['bm25']['b']) != (settings.INTENT_BM25_K1, settings.INTENT_BM25_B):
+                return None
+            arrays = {name: np.load(directory / f'{name}.npy', mmap_mode='r') for name in SNAPSHOT_ARRAYS}
+        except (OSError, ValueError, KeyError):
+            return None
+        
+        shape = tuple(meta['shape'])
+        matrix = sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=shape, copy=False)
+        postings = sp.csc_matrix(
+            (arrays['postings_data'], arrays['postings_indices'], arrays['postings_indptr']),
+            shape=shape, copy=False
+        )
+        bm25 = BM25Weights(
+            sp.csc_matrix((arrays['bm25_data'], postings.indices, postings.indptr), shape=shape, copy=False),
+            arrays['bm25_idf'], arrays['doc_lengths'],
+            **meta['bm25']
+        )
+        
+        vectorizer = IntentBasedSearcher().vectorizer
+        hashing, tfidf = vectorizer.steps[0][1], vectorizer.steps[1][1]
+        hashing.set_params(**{**meta['hashing'], 'ngram_range': tuple(meta['hashing']['ngram_range'])})
+        tfidf.idf_ = arrays['idf']
+        tfidf.n_features_in_ = hashing.n_features
+        
+        watermark = datetime.fromisoformat(meta['watermark']) if meta['watermark'] else None
+        columns = {
+            name: StringColumn(arrays[f'{name}_buffer'], arrays[f'{name}_offsets'])
+            for name in ('names', 'categories', 'tags')
+        }
+        return cls(
+            vectorizer, matrix, arrays['product_ids'], meta['version'],
+            watermark=watermark, postings=postings, built_at=meta['built_at'], bm25=bm25, **columns
+        )
+
+
+def publish_snapshot(index: IntentIndex) -> TFIDFIndex:
+    """Save the index under INTENT_INDEX_DIR and record it so workers switch to it"""
+    directory = Path(settings.INTENT_INDEX_DIR) / f'{index.version}-{int(index.built_at)}'
+    meta = index.save(directory)
+    
+    record = TFIDFIndex.objects.create(
+        version=index.version,
+        format=INDEX_FORMAT,
+        path=str(directory),
+        product_count=len(index),
+        feature_count=meta['hashing']['n_features'],
+        nnz=index.matrix.nnz,
+        size_bytes=meta['size_bytes'],
+    )
+    
+    # Keep a few older snapshots for workers that have not switched yet
+    for old in TFIDFIndex.objects.all()[settings.INTENT_INDEX_KEEP_SNAPSHOTS:]:
+        shutil.rmtree(old.path, ignore_errors=True)
+        old.delete()
+    
+    return record
+
+
+_index = None
+_index_lock = threading.Lock()
+_spelling_lock = threading.Lock()
+_snapshot_id = None
+_compacting = threading.Event()
+
+
+def _is_fresh(index) -> bool:
+    return index is not None and time.monotonic() - index.checked_at < settings.INTENT_INDEX_CHECK_SECONDS
+
+
+def _load_newer_snapshot(index):
+    """Load the newest published snapshot if it is newer than `index`"""
+    global _snapshot_id
+    record = TFIDFIndex.objects.filter(format=INDEX_FORMAT).first()
+    if record is None or record.pk == _snapshot_id:
+        return None
+    if index is not None and record.built_at.timestamp() <= index.built_at:
+        return None
+    _snapshot_id = record.pk
+    return IntentIndex.load(record.path)
+
+
+def _compact_in_background():
+    """Refit the whole index in a thread while requests keep using the current one"""
+    if _compacting.is_set():
+        return
+    _compacting.set()
+    
+    def run():
+        global _index
+        try:
+            index = IntentIndex.build()
+            index.checked_at = float('-inf')  # catch up with edits made during the fit
+            with _index_lock:
+                _index = index
+        except Exception as e:
+            print(f"Error compacting intent index: {e}")
+        finally:
+            _compacting.clear()
+            connection.close()
+    
+    threading.Thread(target=run, name='intent-index-compaction', daemon=True).start()
+
+
+def get_intent_index() -> IntentIndex:
+    """Return the process-wide intent index, catching up with catalog changes as needed"""
+    global _index
+    
+    index = _index
+    if _is_fresh(index):
+        return index
+    
+    with _index_lock:
+        index = _index
+        if _is_fresh(index):
+            return index
+        
+        stats = catalog_stats()
+        index = _load_newer_snapshot(index) or index
+        if index is None or index.vectorizer is None:
+            index = IntentIndex.build(stats)
+        elif index.version != catalog_version(stats):
+            index = index.catch_up(stats)
+        
+        if index.needs_compaction():
+            _compact_in_background()
+        
+        index.checked_at = time.monotonic()
+        _index = index
+        return index
+
+
+def request_intent_index_refresh():
+    """Make the next search in this process catch up with the catalog instead of waiting for the check interval"""
+    index = _index
+    if index is not None:
+        index.checked_at = float('-inf')
+
+
+def invalidate_intent_index():
+    """Drop the in-process index so the next search reloads it"""
+    global _index, _snapshot_id
+    with _index_lock:
+        _index = None
+        _snapshot_id = None
+
+
 class IntentBasedSearcher:
     def __init__(self):
-        self.vectorizer = TfidfVectorizer(
-            max_features=1000,
-            lowercase=True,
-            stop_words='english',
-            ngram_range=(1, 2)
+        # Hashing keeps the feature space fixed so single rows can be re-vectorized
+        # after the fit; TfidfTransformer adds the IDF weights and L2 norm on top
+        self.vectorizer = make_pipeline(
+            HashingVectorizer(
+                n_features=settings.INTENT_INDEX_FEATURES,
+                lowercase=True,
+                stop_words='english',
+                ngram_range=(1, 2),
+                alternate_sign=False,
+                norm=None
+            ),
+            TfidfTransformer()
         )
     
-    def build_intent_catalog(self):
-        """Build TF-IDF index for all products"""
+    def build_intent_catalog(self, catalog: list = None) -> IntentIndex:
+        """Build TF-IDF index for all products, or for the given product rows"""
         
-        # Prepare documents: product name + tags + description
-        products = Product.objects.all()
-        documents = []
-        product_list = []
+        # Prepare documents: product name + category + tags
+        if catalog is None:
+            catalog = product_rows(Product.objects.all())
         
-        for product in products:
-            # Combine product metadata for intent extraction
-            text = f"{product.name} {product.category.name} {' '.join(product.tags)}"
-            documents.append(text)
-            product_list.append(product)
+        if not catalog:
+            return IntentIndex(None, None, np.array([], dtype=np.int64), version='')
         
-        if not documents:
-            return []
+        product_ids, names, categories, tags = zip(*catalog)
+        documents = [product_document(*fields) for fields in zip(names, categories, tags)]
+        
+        # Build TF-IDF matrix, float32 halves the snapshot and its page-cache footprint
+        tfidf_matrix = self.vectorizer.fit_transform(documents).astype(np.float32)
+        tfidf_matrix.sort_indices()
         
-        # Build TF-IDF matrix
-        tfidf_matrix = self.vectorizer.fit_transform(documents)
+        # BM25 statistics over the raw term counts; sorted, they have the TF-IDF sparsity
+        counts = self.vectorizer.steps[0][1].transform(documents)
+        counts.sort_indices()
+        bm25 = BM25Weights.from_counts(counts, settings.INTENT_BM25_K1, settings.INTENT_BM25_B)
         
-        return product_list, tfidf_matrix, self.vectorizer
+        return IntentIndex(
+            self.vectorizer, tfidf_matrix, np.array(product_ids, dtype=np.int64), version='',
+            names=StringColumn.from_strings(names),
+            categories=StringColumn.from_strings(categories),
+            tags=StringColumn.from_strings(TAG_SEPARATOR.join(product_tags) for product_tags in tags),
+            bm25=bm25,
+        )
     
-    def search_by_intent(self, query: str, top_k: int = 5):
+    def search_by_intent(self, query: str, top_k: int = 5, ranker: str = None):
         """Search products by intent"""
+        return self.search_by_intent_batch([query], top_k, ranker)[0]
+    
+    def search_by_intent_batch(self, queries: list, top_k: int = 5, ranker: str = None) -> list:
+        """Search products for several queries at once, one result list per query"""
+        return self._build_results(queries, self._match_batch(queries, top_k, ranker))
+    
+    def _match_batch(self, queries: list, top_k: int, ranker: str = None) -> list:
+        """Ranked (product id, score, fields) per query, straight from the index"""
         
-        products, tfidf_matrix, vectorizer = self.build_intent_catalog()
+        ranker = ranker or settings.INTENT_SEARCH_RANKER
+        index = get_intent_index()
         
-        if not products:
-            return []
+        if not len(index) or index.vectorizer is None:
+            return [[] for _ in queries]
         
-        # Transform query
-        query_vector = vectorizer.transform([query])
+        # Fix typos before vectorizing, an unknown token would match nothing
+        spelling = index.spelling
+        if spelling is not None:
+            queries = [spelling.correct(query) or query for query in queries]
         
-        # Calculate similarities
-        similarities = cosine_similarity(query_vector, tfidf_matrix)[0]
+        # Transform all queries in one call and score them with one sparse product
+        query_matrix = index.transform(queries, ranker)
         
-        # Get top-k results
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
+        # Get top-k results above the minimum similarity threshold
+        if len(queries) == 1:
+            hits = [index.top_k(query_matrix, top_k, MIN_SCORE[ranker], ranker)]
+        else:
+            hits = index.top_k_batch(query_matrix, top_k, MIN_SCORE[ranker], ranker)
         
-        results = [
-            {
-                'product': products[idx],
-                'similarity_score': float(similarities[idx]),
-                'intent_match': self._get_intent_explanation(query, products[idx])
-            }
-            for idx in top_indices
-            if similarities[idx] > 0.1  # Minimum similarity threshold
+        return [
+            [
+                (int(index.product_ids[row]), float(score), index.fields(row))
+                for row, score in zip(rows, similarities)
+            ]
+            for rows, similarities in hits
         ]
+    
+    def _build_results(self, queries: list, matches: list) -> list:
+        """Attach products and explanations to ranked matches, fetching all products in one query"""
+        
+        products = Product.objects.select_related('category').in_bulk(
+            {product_id for query_matches in matches for product_id, _, _ in query_matches}
+        )
+        
+        results = []
+        for query, query_matches in zip(queries, matches):
+            # Products deleted since the index was built are skipped
+            query_matches = [match for match in query_matches if match[0] in products]
+            explanations = self._get_intent_explanations(query, [fields for _, _, fields in query_matches])
+            results.append([
+                {
+                    'product': products[product_id],
+                    'category': fields[1],
+                    'similarity_score': score,
+                    'intent_match': explanation
+                }
+                for (product_id, score, fields), explanation in zip(query_matches, explanations)
+            ])
         
         return results
     
-    def _get_intent_explanation(self, query: str, product: Product) -> str:
-        """Explain why product matches the query"""
+    def _get_intent_explanations(self, query: str, fields: list) -> list:
+        """Explain why each product matches the query, vectorized over the results"""
+        if not fields:
+            return []
+        
         query_lower = query.lower()
+        names, categories, tags = zip(*fields)
         
-        if query_lower in product.name.lower():
-            return f"Direct match in product name"
-        elif any(tag.lower() in query_lower for tag in product.tags):
-            return f"Matches intent: {query}"
-        elif query_lower in product.category.name.lower():
-            return f"Found in {product.category.name} category"
-        else:
-            return f"Related to: {query}"
+        name_match = np.char.find(np.char.lower(np.array(names, dtype=str)), query_lower) >= 0
+        category_match = np.char.find(np.char.lower(np.array(categories, dtype=str)), query_lower) >= 0
+        
+        # A product matches on tags when any of its tags occurs in the query
+        flat_tags = np.array([tag.lower() for product_tags in tags for tag in product_tags], dtype=str)
+        owners = np.repeat(np.arange(len(tags)), [len(product_tags) for product_tags in tags])
+        tag_hits = np.char.find(query_lower, flat_tags) >= 0 if len(flat_tags) else np.zeros(0, dtype=bool)
+        tag_match = np.bincount(owners[tag_hits], minlength=len(tags)) > 0
+        
+        reasons = np.select([name_match, tag_match, category_match], [0, 1, 2], default=3)
+        
+        return [
+            (
+                "Direct match in product name",
+                f"Matches intent: {query}",
+                f"Found in {category} category",
+                f"Related to: {query}",
+            )[reason]
+            for reason, category in zip(reasons, categories)
+        ]
+    
+    def did_you_mean(self, query: str):
+        """Query with misspelled words corrected against the catalog vocabulary, None if it is spelled fine"""
+        return self.did_you_mean_batch([query])[0]
+    
+    def did_you_mean_batch(self, queries: list) -> list:
+        """did_you_mean for several queries against one index lookup, each distinct query corrected once"""
+        index = get_intent_index()
+        spelling = index.spelling if len(index) and index.vectorizer is not None else None
+        if spelling is None:
+            return [None for _ in queries]
+        corrections = {query: spelling.correct(query) for query in set(queries)}
+        return [corrections[query] for query in queries]
     
     def extract_intent_tags(self, query: str) -> list:
         """Extract key intent tags from query"""
@@ -104,14 +798,45 @@ class IntentBasedSearcher:
         
         return matched_intents if matched_intents else [query]
     
-    def get_category_recommendations(self, query: str) -> dict:
+    def get_category_recommendations(self, query: str, ranker: str = None) -> dict:
         """Return category-wise recommendations for a query"""
         
-        search_results = self.search_by_intent(query, top_k=20)
+        return self.get_category_recommendations_batch([query], ranker)[0]
+    
+    def get_category_recommendations_batch(self, queries: list, ranker: str = None) -> list:
+        """get_category_recommendations for several queries, in the same order
+        
+        Ranked matches are cached per normalized query under the index version,
+        so any catalog change starts a fresh namespace.
+        """
+        
+        ranker = ranker or settings.INTENT_SEARCH_RANKER
+        version = get_intent_index().version
+        keys = [f"{version}:{ranker}:{normalize_query(query)}" for query in queries]
+        matches = query_cache.get_many(set(keys))
+        
+        # Search each uncached normalized query once
+        missing = {}
+        for query, key in zip(queries, keys):
+            if key not in matches:
+                missing.setdefault(key, query)
+        
+        if missing:
+            fresh = dict(zip(missing, self._match_batch(list(missing.values()), top_k=20, ranker=ranker)))
+            query_cache.set_many(fresh)
+            matches.update(fresh)
+        
+        return [
+            self._group_by_category(search_results)
+            for search_results in self._build_results(queries, [matches[key] for key in keys])
+        ]
+    
+    def _group_by_category(self, search_results: list) -> dict:
+        """Group search results by category name"""
         
         categories = {}
         for result in search_results:
-            category = result['product'].category.name
+            category = result['category']
             if category not in categories:
                 categories[category] = []
             categories[category].append(result)
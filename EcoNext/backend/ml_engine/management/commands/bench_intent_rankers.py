@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from products.models import Product
+from ml_engine.benchmarks import scale_catalog, time_calls, percentiles
+from ml_engine.intent_search import IntentBasedSearcher, RANKERS, MIN_SCORE, product_rows
+import numpy as np
+import time
+
+
+class Command(BaseCommand):
+    help = 'Compare TF-IDF and BM25 intent ranking (relevance and latency) on the seeded catalog scaled up'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--factors', nargs='+', type=int, default=[10, 100, 1000])
+        parser.add_argument('--top-k', type=int, default=10)
+
+    def handle(self, *args, **options):
+        rows = product_rows(Product.objects.all())
+        if not rows:
+            raise CommandError('No products found. Run seed_data and/or seed_indian_products first.')
+
+        # A tag is a query; products seeded with it are the relevant ones
+        queries = sorted({tag.lower() for _, _, _, tags in rows for tag in tags})
+        top_k = options['top_k']
+        discounts = 1 / np.log2(np.arange(2, top_k + 2))
+
+        self.stdout.write(f'{len(rows)} seeded products, {len(queries)} tag queries, top-{top_k}')
+
+        for factor in options['factors']:
+            scaled, sources = scale_catalog(rows, factor)
+            started = time.perf_counter()
+            index = IntentBasedSearcher().build_intent_catalog(scaled)
+            self.stdout.write(f'\n{len(scaled):,} products (built in {time.perf_counter() - started:.1f}s)')
+
+            # Row -> seeded tags of the product it was copied from
+            source_tags = [{tag.lower() for tag in rows[source][3]} for source in sources]
+
+            for ranker in RANKERS:
+                query_vectors = [(index.transform([query], ranker),) for query in queries]
+
+                def search(query_vector):
+                    return index.top_k(query_vector, top_k, MIN_SCORE[ranker], ranker)
+
+                precision, ndcg, mrr = [], [], []
+                for query, (query_vector,) in zip(queries, query_vectors):
+                    found_rows, _ = search(query_vector)
+                    relevant = np.array([query in source_tags[row] for row in found_rows], dtype=bool)
+                    total_relevant = min(top_k, sum(query in tags for tags in source_tags))
+                    precision.append(relevant.sum() / top_k)
+                    ideal = discounts[:total_relevant].sum()
+                    ndcg.append(discounts[:len(relevant)][relevant].sum() / ideal if ideal else 0.0)
+                    hits = np.flatnonzero(relevant)
+                    mrr.append(1 / (hits[0] + 1) if len(hits) else 0.0)
+
+                self.stdout.write(
+                    f'  {ranker:5}  P@{top_k} {np.mean(precision):.3f}  nDCG@{top_k} {np.mean(ndcg):.3f}  '
+                    f'MRR {np.mean(mrr):.3f}  {percentiles(time_calls(search, query_vectors))}'
+                )
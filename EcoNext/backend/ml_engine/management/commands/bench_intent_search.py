@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from ml_engine.benchmarks import synthetic_catalog, synthetic_queries, time_calls, percentiles
+from ml_engine.intent_search import IntentBasedSearcher, IntentIndex
+import numpy as np
+import time
+
+
+class Command(BaseCommand):
+    help = 'Benchmark intent search scoring (dense vs inverted index) on synthetic catalogs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000, 1000000])
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--top-k', type=int, default=20)
+
+    def handle(self, *args, **options):
+        top_k = options['top_k']
+        queries = synthetic_queries(options['queries'])
+
+        for size in options['sizes']:
+            started = time.perf_counter()
+            product_ids, documents = synthetic_catalog(size)
+            vectorizer = IntentBasedSearcher().vectorizer
+            index = IntentIndex(vectorizer, vectorizer.fit_transform(documents), product_ids, version='bench')
+            self.stdout.write(f'\n{size:,} products (built in {time.perf_counter() - started:.1f}s)')
+
+            query_vectors = [(vectorizer.transform([query]),) for query in queries]
+
+            def dense(query_vector):
+                scores = index.scores(query_vector)
+                return np.argsort(scores)[-top_k:][::-1]
+
+            def sparse(query_vector):
+                return index.top_k(query_vector, top_k)
+
+            self.stdout.write(f'  dense argsort   {percentiles(time_calls(dense, query_vectors))}')
+            self.stdout.write(f'  inverted top-k  {percentiles(time_calls(sparse, query_vectors))}')
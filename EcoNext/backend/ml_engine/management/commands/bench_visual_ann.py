@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from ml_engine.ann import IVFIndex
+from ml_engine.benchmarks import synthetic_image_features, time_calls, percentiles
+from ml_engine.visual_search import VisualIndex
+import numpy as np
+import time
+
+
+class Command(BaseCommand):
+    help = 'Benchmark IVF visual search against the exact path: recall@k and latency per probe count'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[100000, 1000000])
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--top-k', type=int, default=10)
+        parser.add_argument('--probes', nargs='+', type=int, default=[1, 2, 4, 8, 16, 32])
+
+    def handle(self, *args, **options):
+        top_k = options['top_k']
+
+        for size in options['sizes']:
+            vectors = synthetic_image_features(size + options['queries'])
+            # Held-out vectors stand in for uploaded photos
+            queries = [(query,) for query in vectors[size:]]
+            index = VisualIndex(np.ascontiguousarray(vectors[:size]), np.arange(size, dtype=np.int64))
+
+            started = time.perf_counter()
+            ann = IVFIndex.train(index.vectors, index.product_ids)
+            self.stdout.write(f'\n{size:,} vectors, {ann.n_lists} lists (trained in {time.perf_counter() - started:.1f}s)')
+
+            exact = [set(index.exact_search(query, top_k)[0].tolist()) for (query,) in queries]
+            self.stdout.write(f'  exact         recall 1.000  {percentiles(time_calls(lambda q: index.exact_search(q, top_k), queries))}')
+
+            for n_probe in options['probes']:
+                def search(query):
+                    return ann.search(query, top_k, n_probe)
+
+                recall = np.mean([
+                    len(expected & set(search(query)[0].tolist())) / top_k
+                    for (query,), expected in zip(queries, exact)
+                ])
+                self.stdout.write(f'  ivf probe {n_probe:<3} recall {recall:.3f}  {percentiles(time_calls(search, queries))}')
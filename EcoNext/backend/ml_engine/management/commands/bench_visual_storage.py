@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from ml_engine.vectors import pack_vector, unpack_vectors
+from ml_engine.visual_search import FEATURE_DIM
+from pathlib import Path
+import numpy as np
+import tempfile
+import sqlite3
+import time
+import json
+
+
+class Command(BaseCommand):
+    help = 'Compare ImageFeatures vector storage (JSON text vs packed binary): table size and full load time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        vectors = np.random.default_rng(0).random((rows, FEATURE_DIM), dtype=np.float32)
+        # The old index_product_image stored json.dumps(...) inside a JSONField: a JSON string of JSON
+        formats = {
+            'json': (lambda v: json.dumps(json.dumps(v.tolist())), self.load_json),
+            'float32': (lambda v: pack_vector(v, 'float32'), self.load_packed),
+            'float16': (lambda v: pack_vector(v, 'float16'), self.load_packed),
+            'int8': (lambda v: pack_vector(v, 'int8'), self.load_packed),
+        }
+
+        self.stdout.write(f'{rows:,} vectors of {FEATURE_DIM} dims, one SQLite table per format')
+        with tempfile.TemporaryDirectory() as directory:
+            for name, (encode, load) in formats.items():
+                path = Path(directory) / f'{name}.sqlite3'
+                db = sqlite3.connect(path)
+                db.execute('CREATE TABLE features (product_id INTEGER PRIMARY KEY, vector)')
+                db.executemany('INSERT INTO features VALUES (?, ?)', ((i, encode(v)) for i, v in enumerate(vectors)))
+                db.commit()
+                db.execute('VACUUM')
+
+                started = time.perf_counter()
+                loaded = load(db.execute('SELECT product_id, vector FROM features ORDER BY product_id').fetchall())
+                elapsed = time.perf_counter() - started
+                db.close()
+
+                error = np.abs(loaded - vectors).max()
+                self.stdout.write(
+                    f'  {name:8} {path.stat().st_size / 2 ** 20:7.1f} MB  load {elapsed * 1000:8.0f} ms  '
+                    f'max abs error {error:.4f}'
+                )
+
+    def load_json(self, rows):
+        return np.array([json.loads(json.loads(vector)) for _, vector in rows], dtype=np.float32)
+
+    def load_packed(self, rows):
+        return unpack_vectors([vector for _, vector in rows], FEATURE_DIM)
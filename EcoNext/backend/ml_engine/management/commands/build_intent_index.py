@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from ml_engine.intent_search import IntentIndex, INDEX_FORMAT, catalog_stats, catalog_version, publish_snapshot
+from ml_engine.models import TFIDFIndex
+import time
+
+
+class Command(BaseCommand):
+    help = 'Build the TF-IDF intent search index and publish it for the web workers (run periodically to compact incremental updates)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report whether the published index matches the current catalog',
+        )
+
+    def handle(self, *args, **options):
+        stats = catalog_stats()
+        version = catalog_version(stats)
+
+        if options['check']:
+            record = TFIDFIndex.objects.filter(format=INDEX_FORMAT).first()
+            if record is None:
+                self.stdout.write(self.style.WARNING('No intent index has been published'))
+            elif record.version != version:
+                self.stdout.write(self.style.WARNING(
+                    f'Intent index is stale (built for {record.version}, catalog is {version})'
+                ))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'Intent index is current ({record})'))
+            return
+
+        self.stdout.write('Building intent search index...')
+        started = time.perf_counter()
+        index = IntentIndex.build(stats)
+        if not len(index):
+            self.stdout.write(self.style.WARNING('The catalog has no products, nothing to publish'))
+            return
+        record = publish_snapshot(index)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {record.product_count} products in {elapsed:.2f}s '
+            f'(version {record.version}, {record.size_bytes / 1024:.0f} KB) -> {record.path}'
+        ))
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ml_engine.ann import IVFIndex, publish
+from ml_engine.visual_search import VisualIndex
+import time
+
+
+class Command(BaseCommand):
+    help = 'Train the IVF approximate index over the stored image features and publish it for the web workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lists', type=int, default=settings.VISUAL_IVF_LISTS,
+                            help='Inverted lists (k-means centroids), default sqrt(catalog size)')
+        parser.add_argument('--sample', type=int, default=None, help='Vectors k-means trains on, default 64 per list')
+        parser.add_argument('--iterations', type=int, default=15)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        visual_index = VisualIndex.build()
+        if not len(visual_index):
+            raise CommandError('No image features found. Index product images first.')
+
+        ann = IVFIndex.train(
+            visual_index.vectors, visual_index.product_ids,
+            n_lists=options['lists'], sample_size=options['sample'], iterations=options['iterations'],
+            version=visual_index.version,
+        )
+        directory = publish(ann, settings.VISUAL_ANN_DIR)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {len(ann)} image vectors in {ann.n_lists} lists in {elapsed:.2f}s -> {directory}'
+        ))
+        if settings.VISUAL_SEARCH_BACKEND != 'ivf':
+            self.stdout.write(self.style.WARNING("Set VISUAL_SEARCH_BACKEND = 'ivf' to serve searches from it"))
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from datetime import timedelta
+from products.models import Product
+from ml_engine.price_predictor import FORECAST_DAYS
+from ml_engine.prediction_accuracy import compact_predictions
+import time
+
+
+class Command(BaseCommand):
+    help = ('Fold price forecasts older than the retention window into per-product accuracy sums and delete them. '
+            'Each product keeps its current prediction. Meant to run daily, e.g. from cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=settings.PRICE_PREDICTION_RETENTION_DAYS,
+                            help='Forecasts made in this many most recent days are kept as they are')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Products compacted per transaction')
+
+    def handle(self, *args, **options):
+        if options['keep_days'] < FORECAST_DAYS:
+            # The last forecast days would be scored before their actual prices exist
+            raise CommandError(f'--keep-days must be at least {FORECAST_DAYS}')
+
+        started = time.perf_counter()
+        cutoff = timezone.now().date() - timedelta(days=options['keep_days'])
+        product_ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+        products = forecasts = 0
+        for start in range(0, len(product_ids), options['chunk_size']):
+            chunk = product_ids[start:start + options['chunk_size']]
+            chunk_products, chunk_forecasts = compact_predictions(chunk[0], chunk[-1], cutoff)
+            products += chunk_products
+            forecasts += chunk_forecasts
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Compacted {forecasts} forecasts made before {cutoff} of {products} products in {elapsed:.2f}s'
+        ))
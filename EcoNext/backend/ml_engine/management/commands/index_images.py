@@ -0,0 +1,130 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import Counter
+from pathlib import Path
+from products.models import Product
+from ml_engine.models import ImageFeatures
+from ml_engine.features import features_from_path
+from ml_engine.image_fetch import make_session, image_cache
+from ml_engine.vectors import pack_vector
+import os
+import time
+
+
+class Command(BaseCommand):
+    help = 'Download product images concurrently and store their feature vectors, skipping images that did not change'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.IMAGE_FETCH_WORKERS, help='Concurrent downloads')
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help='Feature extraction processes, 0 extracts in this process')
+        parser.add_argument('--batch-size', type=int, default=256)
+        parser.add_argument('--resume', action='store_true', help='Continue after the last checkpointed product')
+        parser.add_argument('--force', action='store_true', help='Re-extract images whose hash did not change')
+
+    def handle(self, *args, **options):
+        checkpoint = Path(settings.IMAGE_INDEX_CHECKPOINT)
+        products = Product.objects.exclude(image_url__isnull=True).exclude(image_url='').order_by('id')
+        if options['resume'] and checkpoint.exists():
+            last_id = int(checkpoint.read_text())
+            products = products.filter(id__gt=last_id)
+            self.stdout.write(f'Resuming after product {last_id}')
+        rows = list(products.values_list('id', 'image_url'))
+
+        self.stdout.write(f'Indexing images of {len(rows)} products...')
+        checkpoint.parent.mkdir(parents=True, exist_ok=True)
+        session = make_session(pool_size=options['workers'])
+        extractor = ProcessPoolExecutor(options['processes']) if options['processes'] else None
+        counts = Counter()
+        started = time.perf_counter()
+
+        try:
+            with ThreadPoolExecutor(options['workers']) as fetcher:
+                for start in range(0, len(rows), options['batch_size']):
+                    batch = rows[start:start + options['batch_size']]
+                    counts.update(self.index_batch(batch, session, fetcher, extractor, options['force']))
+                    # Everything up to here is written, a rerun with --resume continues after it
+                    checkpoint.write_text(str(batch[-1][0]))
+        finally:
+            if extractor is not None:
+                extractor.shutdown()
+            session.close()
+
+        checkpoint.unlink(missing_ok=True)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Done in {elapsed:.1f}s ({len(rows) / elapsed if elapsed else 0:.0f} images/s): "
+            f"{counts['created']} created, {counts['updated']} updated, "
+            f"{counts['unchanged']} unchanged, {counts['failed']} failed "
+            f"({counts['not_modified']} not modified, {counts['extracted']} extracted, {counts['reused']} reused)"
+        ))
+
+    def index_batch(self, batch, session, fetcher, extractor, force: bool) -> Counter:
+        """Download, extract and write one batch of (product id, image url) rows
+
+        Downloads go through the image cache, so images fetched before are
+        revalidated with conditional GETs and only decoded when their hash changed.
+        """
+        counts = Counter()
+        cache = image_cache()
+
+        def download(row):
+            product_id, url = row
+            try:
+                return product_id, cache.fetch(url, session)
+            except Exception as e:
+                self.stderr.write(f'Product {product_id}: could not download {url}: {e}')
+                return product_id, None
+
+        downloads = [(product_id, image) for product_id, image in fetcher.map(download, batch)]
+        counts['failed'] += sum(image is None for _, image in downloads)
+        counts['not_modified'] += sum(image is not None and image.not_modified for _, image in downloads)
+
+        stored = ImageFeatures.objects.in_bulk([product_id for product_id, _ in downloads], field_name='product_id')
+        pending = []
+        for product_id, image in downloads:
+            if image is None:
+                continue
+            if not force and product_id in stored and stored[product_id].image_hash == image.digest:
+                counts['unchanged'] += 1
+                continue
+            pending.append((product_id, image))
+
+        # The image hash is the dedup key: bytes indexed for another product are not decoded again,
+        # and an image shared within the batch is extracted once
+        vectors = {}
+        if not force:
+            vectors = dict(
+                ImageFeatures.objects.filter(image_hash__in={image.digest for _, image in pending})
+                .values_list('image_hash', 'vector')
+            )
+            counts['reused'] += sum(image.digest in vectors for _, image in pending)
+        paths = {image.digest: image.path for _, image in pending if image.digest not in vectors}
+        run = extractor.map if extractor else map
+        extracted = run(features_from_path, paths.values())
+        for digest, features in zip(paths, extracted):
+            vectors[digest] = None if features is None else pack_vector(features, settings.VISUAL_FEATURE_DTYPE)
+        counts['extracted'] += len(paths)
+
+        created, updated = [], []
+        now = timezone.now()
+        for product_id, image in pending:
+            vector = vectors[image.digest]
+            if vector is None:
+                counts['failed'] += 1
+                continue
+            if product_id in stored:
+                features_row = stored[product_id]
+                features_row.vector, features_row.image_hash, features_row.updated_at = vector, image.digest, now
+                updated.append(features_row)
+            else:
+                created.append(ImageFeatures(product_id=product_id, vector=vector, image_hash=image.digest))
+
+        ImageFeatures.objects.bulk_create(created)
+        # bulk_update skips auto_now, updated_at is set above so workers reload these vectors
+        ImageFeatures.objects.bulk_update(updated, ['vector', 'image_hash', 'updated_at'])
+        counts['created'] += len(created)
+        counts['updated'] += len(updated)
+        return counts
@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from ml_engine.models import VisualNeighbours
+from ml_engine.visual_search import VisualIndex
+import numpy as np
+import time
+
+# Similarity scores held per block: block rows x catalog size float32 values (256 MB)
+BLOCK_SCORES = 2 ** 26
+
+
+class Command(BaseCommand):
+    help = ('Precompute the visually closest products of every product, served by '
+            '/api/products/<id>/similar/visual/. Meant to run nightly, e.g. from cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=settings.VISUAL_NEIGHBOURS_K)
+        parser.add_argument('--block-size', type=int, default=None,
+                            help='Products scored per matrix product, default keeps each block near 256 MB')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        index = VisualIndex.build()
+        if not len(index):
+            raise CommandError('No image features found. Index product images first.')
+
+        block_size = options['block_size'] or max(1, BLOCK_SCORES // len(index))
+        computed_at = timezone.now()
+        written = 0
+        for rows, neighbour_rows, scores in index.neighbours(options['top_k'], block_size):
+            VisualNeighbours.objects.bulk_create(
+                [
+                    VisualNeighbours(
+                        product_id=int(index.product_ids[row]),
+                        product_ids=index.product_ids[neighbours].tolist(),
+                        scores=np.round(row_scores.astype(np.float64), 6).tolist(),
+                        version=index.version,
+                        computed_at=computed_at,
+                    )
+                    for row, neighbours, row_scores in zip(rows, neighbour_rows, scores)
+                ],
+                update_conflicts=True,
+                unique_fields=['product'],
+                update_fields=['product_ids', 'scores', 'version', 'computed_at'],
+            )
+            written += len(rows)
+
+        # Products whose image features were removed since the last run
+        removed, _ = VisualNeighbours.objects.exclude(version=index.version).delete()
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored the {min(options["top_k"], len(index) - 1)} closest products of {written} products '
+            f'in {elapsed:.2f}s ({removed} stale rows removed)'
+        ))
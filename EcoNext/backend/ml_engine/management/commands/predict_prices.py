@@ -0,0 +1,104 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from products.models import Product
+from ml_engine.price_predictor import forecast_range, init_forecast_worker
+import numpy as np
+import json
+import os
+import time
+
+
+class Command(BaseCommand):
+    help = ('Forecast the next 7 days of every product with enough price history, fitting many products per query. '
+            'Chunks of products run in parallel worker processes; a killed run continues with --resume.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=60, help='Days of price history to fit')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Products whose history is loaded, fitted and saved together')
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes, 1 runs in this process')
+        parser.add_argument('--resume', action='store_true', help='Skip the chunks a killed run finished today')
+        parser.add_argument('--from-trends', action='store_true',
+                            help='Fit the running PriceTrend sums instead of loading price history '
+                                 '(window of PRICE_TREND_DAYS, run rebuild_price_trends after bulk imports)')
+
+    def handle(self, *args, **options):
+        if options['from_trends']:
+            options['days'] = settings.PRICE_TREND_DAYS
+        checkpoint = Path(settings.PRICE_FORECAST_CHECKPOINT)
+        today = timezone.now().date().isoformat()
+        done = []
+        if options['resume']:
+            done = self.load_checkpoint(checkpoint, today, options['days'])
+
+        product_ids = np.fromiter(Product.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+        remaining = np.ones(len(product_ids), dtype=bool)
+        for first, last in done:
+            remaining &= (product_ids < first) | (product_ids > last)
+        pending = product_ids[remaining].tolist()
+        chunks = [
+            (pending[start], pending[min(start + options['chunk_size'], len(pending)) - 1])
+            for start in range(0, len(pending), options['chunk_size'])
+        ]
+        self.stdout.write(
+            f"Forecasting {len(pending)} products in {len(chunks)} chunks with {options['workers']} workers"
+            + (f' ({len(product_ids) - len(pending)} done before)' if done else '')
+        )
+        checkpoint.parent.mkdir(parents=True, exist_ok=True)
+
+        started = time.perf_counter()
+        totals = {'products': 0, 'saved': 0}
+
+        def finished(first_id, last_id, products, saved):
+            totals['products'] += products
+            totals['saved'] += saved
+            # Everything in this chunk is written, a rerun with --resume skips it
+            done.append((first_id, last_id))
+            self.save_checkpoint(checkpoint, today, options['days'], done)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"  {totals['products']}/{len(pending)} products, "
+                f"{totals['products'] / elapsed if elapsed else 0:.0f} products/s"
+            )
+
+        if options['workers'] > 1:
+            # Workers must not share this process's connections; each opens its own
+            connections.close_all()
+            with ProcessPoolExecutor(options['workers'], initializer=init_forecast_worker) as pool:
+                futures = [
+                    pool.submit(forecast_range, options['days'], first, last, options['from_trends'])
+                    for first, last in chunks
+                ]
+                for future in as_completed(futures):
+                    finished(*future.result())
+        else:
+            for first, last in chunks:
+                finished(*forecast_range(options['days'], first, last, options['from_trends']))
+
+        checkpoint.unlink(missing_ok=True)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved {totals['saved']} predictions for {totals['products']} products in {elapsed:.2f}s "
+            f"({totals['products'] / elapsed if elapsed else 0:.0f} products/s, "
+            f"{totals['products'] - totals['saved']} without enough history)"
+        ))
+
+    def load_checkpoint(self, checkpoint: Path, today: str, days: int) -> list:
+        """Id ranges finished by an interrupted run of today with the same window"""
+        try:
+            state = json.loads(checkpoint.read_text())
+        except (OSError, ValueError):
+            return []
+        if state.get('date') != today or state.get('days') != days:
+            self.stdout.write('Ignoring the checkpoint of an earlier run')
+            return []
+        return [tuple(chunk) for chunk in state['done']]
+
+    def save_checkpoint(self, checkpoint: Path, today: str, days: int, done: list):
+        tmp_path = checkpoint.with_name(f'{checkpoint.name}.{os.getpid()}.tmp')
+        tmp_path.write_text(json.dumps({'date': today, 'days': days, 'done': done}))
+        os.replace(tmp_path, checkpoint)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from products.models import Product
+from ml_engine.price_trends import rebuild_trends
+import time
+
+
+class Command(BaseCommand):
+    help = ('Recompute the running price trend sums of every product from its price history. '
+            'New PriceHistory rows update them on save; run this after bulk imports, which skip signals.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Products whose history is loaded together')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        product_ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+        written = 0
+        for start in range(0, len(product_ids), options['chunk_size']):
+            chunk = product_ids[start:start + options['chunk_size']]
+            written += rebuild_trends(chunk[0], chunk[-1])
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt the price trends of {written} products in {elapsed:.2f}s '
+            f'({len(product_ids) - written} without price history)'
+        ))
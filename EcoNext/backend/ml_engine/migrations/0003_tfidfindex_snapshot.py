@@ -0,0 +1,36 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ml_engine', '0002_priceprediction_price_change'),
+    ]
+
+    operations = [
+        # Nothing ever wrote the per-product rows; the model now records built snapshots
+        migrations.DeleteModel(
+            name='TFIDFIndex',
+        ),
+        migrations.CreateModel(
+            name='TFIDFIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.CharField(max_length=32)),
+                ('format', models.PositiveSmallIntegerField()),
+                ('path', models.CharField(max_length=500)),
+                ('product_count', models.IntegerField(default=0)),
+                ('feature_count', models.IntegerField(default=0)),
+                ('nnz', models.BigIntegerField(default=0)),
+                ('size_bytes', models.BigIntegerField(default=0)),
+                ('built_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'TFIDF Indices',
+                'ordering': ['-built_at'],
+                'get_latest_by': 'built_at',
+            },
+        ),
+    ]
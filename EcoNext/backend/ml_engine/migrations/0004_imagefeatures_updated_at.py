@@ -0,0 +1,20 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ml_engine', '0003_tfidfindex_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagefeatures',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:40
+
+from django.db import migrations, models
+import numpy as np
+import struct
+import json
+
+# ml_engine.vectors layout 1: header (layout, dtype code, dim) + values, float32 is code 1
+HEADER = struct.Struct('<BBH')
+
+
+def pack_json_vectors(apps, schema_editor):
+    ImageFeatures = apps.get_model('ml_engine', 'ImageFeatures')
+    batch = []
+    for features in ImageFeatures.objects.only('id', 'features_vector').iterator(chunk_size=2000):
+        value = features.features_vector
+        if isinstance(value, str):
+            value = json.loads(value)
+        vector = np.asarray(value, dtype='<f4').ravel()
+        features.vector = HEADER.pack(1, 1, len(vector)) + vector.tobytes()
+        batch.append(features)
+        if len(batch) >= 2000:
+            ImageFeatures.objects.bulk_update(batch, ['vector'])
+            batch = []
+    ImageFeatures.objects.bulk_update(batch, ['vector'])
+
+
+def unpack_to_json(apps, schema_editor):
+    ImageFeatures = apps.get_model('ml_engine', 'ImageFeatures')
+    batch = []
+    for features in ImageFeatures.objects.only('id', 'vector').iterator(chunk_size=2000):
+        blob = bytes(features.vector)
+        _, code, dim = HEADER.unpack_from(blob)
+        if code == 3:
+            scale = struct.unpack_from('<f', blob, HEADER.size)[0]
+            vector = np.frombuffer(blob, dtype='i1', offset=HEADER.size + 4) * scale
+        else:
+            vector = np.frombuffer(blob, dtype='<f4' if code == 1 else '<f2', offset=HEADER.size)
+        features.features_vector = json.dumps(vector.astype(float).tolist())
+        batch.append(features)
+        if len(batch) >= 2000:
+            ImageFeatures.objects.bulk_update(batch, ['features_vector'])
+            batch = []
+    ImageFeatures.objects.bulk_update(batch, ['features_vector'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ml_engine', '0004_imagefeatures_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagefeatures',
+            name='vector',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='imagefeatures',
+            name='features_vector',
+            field=models.JSONField(null=True),
+        ),
+        migrations.RunPython(pack_json_vectors, unpack_to_json),
+        migrations.RemoveField(
+            model_name='imagefeatures',
+            name='features_vector',
+        ),
+    ]
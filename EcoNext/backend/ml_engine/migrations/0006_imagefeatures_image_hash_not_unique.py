@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ml_engine', '0005_imagefeatures_vector'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imagefeatures',
+            name='image_hash',
+            field=models.CharField(db_index=True, max_length=64),
+        ),
+    ]
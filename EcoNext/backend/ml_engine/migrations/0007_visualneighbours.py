@@ -0,0 +1,29 @@
+# Generated by Django 5.1.6 on 2026-10-18 05:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ml_engine', '0006_imagefeatures_image_hash_not_unique'),
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisualNeighbours',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_ids', models.JSONField(default=list)),
+                ('scores', models.JSONField(default=list)),
+                ('version', models.CharField(max_length=32)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='visual_neighbours', to='products.product')),
+            ],
+            options={
+                'verbose_name_plural': 'Visual Neighbours',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.6 on 2026-10-18 06:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ml_engine', '0007_visualneighbours'),
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceTrend',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_start', models.DateField()),
+                ('last_date', models.DateField()),
+                ('n', models.IntegerField(default=0)),
+                ('sum_x', models.FloatField(default=0.0)),
+                ('sum_y', models.FloatField(default=0.0)),
+                ('sum_xy', models.FloatField(default=0.0)),
+                ('sum_xx', models.FloatField(default=0.0)),
+                ('sum_yy', models.FloatField(default=0.0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='price_trend', to='products.product')),
+            ],
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.6 on 2026-10-18 06:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def point_at_newest_predictions(apps, schema_editor):
+    PricePrediction = apps.get_model('ml_engine', 'PricePrediction')
+    CurrentPrediction = apps.get_model('ml_engine', 'CurrentPrediction')
+    batch = []
+    last_product = None
+    newest_first = PricePrediction.objects.order_by('product_id', '-prediction_date', '-id').values_list('product_id', 'id')
+    for product_id, prediction_id in newest_first.iterator(chunk_size=2000):
+        if product_id == last_product:
+            continue
+        last_product = product_id
+        batch.append(CurrentPrediction(product_id=product_id, prediction_id=prediction_id))
+        if len(batch) >= 2000:
+            CurrentPrediction.objects.bulk_create(batch)
+            batch = []
+    CurrentPrediction.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ml_engine', '0008_pricetrend'),
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrentPrediction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prediction', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ml_engine.priceprediction')),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='current_prediction', to='products.product')),
+            ],
+        ),
+        migrations.RunPython(point_at_newest_predictions, migrations.RunPython.noop),
+    ]
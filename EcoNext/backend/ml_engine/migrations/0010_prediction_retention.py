@@ -0,0 +1,63 @@
+# Generated by Django 5.1.6 on 2026-10-18 06:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def keep_newest_prediction_per_day(apps, schema_editor):
+    """Delete all but the last saved prediction of each product and day, moving current pointers to it"""
+    PricePrediction = apps.get_model('ml_engine', 'PricePrediction')
+    CurrentPrediction = apps.get_model('ml_engine', 'CurrentPrediction')
+    kept = {}
+    duplicates = {}
+    rows = PricePrediction.objects.order_by('product_id', 'prediction_date', '-id').values_list(
+        'id', 'product_id', 'prediction_date'
+    )
+    for prediction_id, product_id, prediction_date in rows.iterator(chunk_size=2000):
+        key = (product_id, prediction_date)
+        if key in kept:
+            duplicates[prediction_id] = kept[key]
+        else:
+            kept[key] = prediction_id
+    if not duplicates:
+        return
+    for current in CurrentPrediction.objects.filter(prediction_id__in=list(duplicates)):
+        current.prediction_id = duplicates[current.prediction_id]
+        current.save(update_fields=['prediction'])
+    doomed = list(duplicates)
+    for start in range(0, len(doomed), 500):
+        PricePrediction.objects.filter(id__in=doomed[start:start + 500]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ml_engine', '0009_currentprediction'),
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PredictionAccuracy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('forecasts', models.IntegerField(default=0)),
+                ('first_date', models.DateField()),
+                ('last_date', models.DateField()),
+                ('compared', models.JSONField(default=list)),
+                ('abs_error_sum', models.JSONField(default=list)),
+                ('abs_percent_error_sum', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(keep_newest_prediction_per_day, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='priceprediction',
+            constraint=models.UniqueConstraint(fields=('product', 'prediction_date'), name='unique_prediction_per_day'),
+        ),
+        migrations.AddField(
+            model_name='predictionaccuracy',
+            name='product',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='prediction_accuracy', to='products.product'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 06:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ml_engine', '0010_prediction_retention'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imagefeatures',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -32,16 +32,69 @@ class PricePrediction(models.Model):
     
     class Meta:
         ordering = ['-prediction_date']
+        constraints = [
+            # A rerun on the same day replaces the forecast, see PricePredictor.save_results
+            models.UniqueConstraint(fields=['product', 'prediction_date'], name='unique_prediction_per_day'),
+        ]
     
     def __str__(self):
         return f"Prediction for {self.product.name} on {self.prediction_date}"
 
 
+class CurrentPrediction(models.Model):
+    """Newest PricePrediction of a product, set by PricePredictor so product pages need no latest() scan"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='current_prediction')
+    prediction = models.OneToOneField(PricePrediction, on_delete=models.CASCADE, related_name='+')
+    
+    def __str__(self):
+        return f"Current prediction of {self.product.name}"
+
+
+class PredictionAccuracy(models.Model):
+    """Errors of a product's compacted forecasts against the prices that followed, see ml_engine.prediction_accuracy
+    
+    Each list holds one value per forecast day (day1_price to day7_price).
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='prediction_accuracy')
+    forecasts = models.IntegerField(default=0)  # Predictions compacted into these sums
+    first_date = models.DateField()
+    last_date = models.DateField()
+    compared = models.JSONField(default=list)  # Forecast prices with a known actual price
+    abs_error_sum = models.JSONField(default=list)
+    abs_percent_error_sum = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def mean_absolute_percent_error(self) -> list:
+        """MAPE per forecast day, None for days never compared"""
+        return [total / count if count else None for total, count in zip(self.abs_percent_error_sum, self.compared)]
+    
+    def __str__(self):
+        return f"Prediction accuracy of {self.product.name} ({self.forecasts} forecasts)"
+
+
+class PriceTrend(models.Model):
+    """Running least-squares sums of a product's prices in the forecast window, see ml_engine.price_trends"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='price_trend')
+    window_start = models.DateField()  # Prices from this date on are in the sums, x is a price's position among them
+    last_date = models.DateField()  # Newest price in the sums
+    n = models.IntegerField(default=0)
+    sum_x = models.FloatField(default=0.0)
+    sum_y = models.FloatField(default=0.0)
+    sum_xy = models.FloatField(default=0.0)
+    sum_xx = models.FloatField(default=0.0)
+    sum_yy = models.FloatField(default=0.0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Price trend of {self.product.name} ({self.n} prices)"
+
+
 class ImageFeatures(models.Model):
     product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='image_features_model')
-    features_vector = models.JSONField()  # CNN extracted features from ResNet50
-    image_hash = models.CharField(max_length=64, unique=True)
+    vector = models.BinaryField()  # Packed HSV histogram, see ml_engine.vectors
+    image_hash = models.CharField(max_length=64, db_index=True)  # sha256 of the image bytes, products may share an image
     processed_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # Lets workers reload only the changed vectors
     
     class Meta:
         verbose_name_plural = 'Image Features'
@@ -50,15 +103,36 @@ class ImageFeatures(models.Model):
         return f"Image Features for {self.product.name}"
 
 
+class VisualNeighbours(models.Model):
+    """Visually closest products of a product, precomputed nightly by precompute_visual_neighbours"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='visual_neighbours')
+    product_ids = models.JSONField(default=list)  # Best first
+    scores = models.JSONField(default=list)  # Cosine similarity of each neighbour
+    version = models.CharField(max_length=32)  # Image features version the neighbours were computed from
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = 'Visual Neighbours'
+    
+    def __str__(self):
+        return f"Visual neighbours of {self.product.name}"
+
+
 class TFIDFIndex(models.Model):
-    """Stores TF-IDF matrix for intent-based search"""
-    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='tfidf_index')
-    query_tags = models.JSONField(default=list)  # ["gym shoe", "running shoes", "athletic"]
-    tfidf_scores = models.JSONField(default=dict)  # {"tag": score}
+    """A published intent search index snapshot; workers serve the newest one"""
+    version = models.CharField(max_length=32)  # Catalog version the index was built from
+    format = models.PositiveSmallIntegerField()
+    path = models.CharField(max_length=500)  # Snapshot directory of .npy arrays + meta.json
+    product_count = models.IntegerField(default=0)
+    feature_count = models.IntegerField(default=0)
+    nnz = models.BigIntegerField(default=0)
+    size_bytes = models.BigIntegerField(default=0)
     built_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
+        ordering = ['-built_at']
+        get_latest_by = 'built_at'
         verbose_name_plural = 'TFIDF Indices'
     
     def __str__(self):
-        return f"TF-IDF Index for {self.product.name}"
+        return f"TF-IDF Index {self.version} ({self.product_count} products)"
@@ -0,0 +1,101 @@
+"""
+Retention of old price forecasts
+Compacts them into per-product PredictionAccuracy sums and deletes them
+
+A forecast made on day d predicts day d + k with its day{k}_price. Once it is
+older than the retention window, every predicted day with a known price in
+PriceHistory adds its absolute and percentage error to the product's sums;
+the forecast row itself is dropped. Current predictions are always kept.
+"""
+
+import numpy as np
+from django.db import transaction
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+from django.utils import timezone
+from datetime import timedelta
+from products.models import PriceHistory
+from ml_engine.models import PricePrediction, PredictionAccuracy, CurrentPrediction
+from ml_engine.price_predictor import FORECAST_DAYS
+
+
+def compact_predictions(first_id: int, last_id: int, cutoff) -> tuple:
+    """Compact the non-current forecasts made before cutoff of products first_id..last_id, (products, forecasts)"""
+    with transaction.atomic():
+        expired = PricePrediction.objects.filter(
+            product_id__gte=first_id,
+            product_id__lte=last_id,
+            prediction_date__lt=cutoff
+        ).exclude(id__in=CurrentPrediction.objects.values('prediction_id'))
+        rows = list(expired.order_by().values_list(
+            'product_id', 'prediction_date',
+            *[Cast(f'day{day + 1}_price', FloatField()) for day in range(FORECAST_DAYS)]
+        ))
+        if not rows:
+            return 0, 0
+        
+        dates = [prediction_date for _, prediction_date, *_ in rows]
+        actual_prices = {
+            (product_id, date.toordinal()): price
+            for product_id, date, price in PriceHistory.objects.filter(
+                product_id__gte=first_id,
+                product_id__lte=last_id,
+                date__gt=min(dates),
+                date__lte=max(dates) + timedelta(days=FORECAST_DAYS)
+            ).values_list('product_id', 'date', Cast('price', FloatField()))
+        }
+        
+        forecast = np.array([prices for _, _, *prices in rows], dtype=np.float64)
+        actual = np.array([
+            [actual_prices.get((product_id, date.toordinal() + day + 1), np.nan) for day in range(FORECAST_DAYS)]
+            for product_id, date, *_ in rows
+        ])
+        compared = ~np.isnan(forecast) & ~np.isnan(actual) & (actual > 0)
+        abs_error = np.where(compared, np.abs(forecast - actual), 0)
+        abs_percent_error = np.where(compared, abs_error / np.where(compared, actual, 1) * 100, 0)
+        
+        product_ids, rows_of = np.unique([product_id for product_id, *_ in rows], return_inverse=True)
+        sums = {}
+        for name, values in [('compared', compared), ('abs_error_sum', abs_error),
+                             ('abs_percent_error_sum', abs_percent_error)]:
+            sums[name] = np.zeros((len(product_ids), FORECAST_DAYS))
+            np.add.at(sums[name], rows_of, values)
+        forecasts = np.bincount(rows_of, minlength=len(product_ids))
+        first_dates = {}
+        last_dates = {}
+        for row, date in zip(rows_of.tolist(), dates):
+            first_dates[row] = min(first_dates.get(row, date), date)
+            last_dates[row] = max(last_dates.get(row, date), date)
+        
+        existing = {
+            accuracy.product_id: accuracy
+            for accuracy in PredictionAccuracy.objects.filter(product_id__in=product_ids.tolist())
+        }
+        summaries = []
+        for i, product_id in enumerate(product_ids.tolist()):
+            summary = existing.get(product_id) or PredictionAccuracy(
+                product_id=product_id, first_date=first_dates[i], last_date=last_dates[i],
+                compared=[0] * FORECAST_DAYS, abs_error_sum=[0.0] * FORECAST_DAYS,
+                abs_percent_error_sum=[0.0] * FORECAST_DAYS
+            )
+            summary.forecasts += int(forecasts[i])
+            summary.first_date = min(summary.first_date, first_dates[i])
+            summary.last_date = max(summary.last_date, last_dates[i])
+            summary.compared = [int(a + b) for a, b in zip(summary.compared, sums['compared'][i])]
+            summary.abs_error_sum = [a + float(b) for a, b in zip(summary.abs_error_sum, sums['abs_error_sum'][i])]
+            summary.abs_percent_error_sum = [
+                a + float(b) for a, b in zip(summary.abs_percent_error_sum, sums['abs_percent_error_sum'][i])
+            ]
+            summaries.append(summary)
+        # bulk_update leaves auto_now alone
+        now = timezone.now()
+        for summary in existing.values():
+            summary.updated_at = now
+        PredictionAccuracy.objects.bulk_update(
+            list(existing.values()),
+            ['forecasts', 'first_date', 'last_date', 'compared', 'abs_error_sum', 'abs_percent_error_sum', 'updated_at'],
+        )
+        PredictionAccuracy.objects.bulk_create([summary for summary in summaries if summary.pk is None])
+        expired.delete()
+    
+    return len(product_ids), len(rows)
@@ -1,15 +1,97 @@
 """
 Price Predictor using Linear Regression
 Predicts next 7 days price trend based on historical data
+
+save_predictions fits one product at a time; save_predictions_batch fits
+many at once with closed-form least squares over a padded (products x days)
+price matrix and gives the same forecasts (see `manage.py predict_prices`).
+predict_from_trends reads the running sums of ml_engine.price_trends
+instead of the history and gives the same forecasts too.
 """
 
 import numpy as np
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import StandardScaler
 from products.models import Product, PriceHistory
+from django.conf import settings
+from django.db import OperationalError
+from django.db.models import FloatField
+from django.db.models.functions import Cast
 from django.utils import timezone
 from datetime import timedelta, datetime
-from ml_engine.models import PricePrediction
+from ml_engine.models import PricePrediction, PriceTrend, CurrentPrediction
+from ml_engine.price_trends import fit_sums, shift_x, SUM_FIELDS
+import time
+
+# Days forecast after the last known price
+FORECAST_DAYS = 7
+
+# Fewer price points than this give no forecast
+MIN_HISTORY = 5
+
+# Tries per chunk in predict_prices workers
+FORECAST_ATTEMPTS = 3
+
+# Columns a same-day rerun overwrites
+PREDICTION_FIELDS = [f'day{day + 1}_price' for day in range(FORECAST_DAYS)] + [
+    'price_change', 'recommendation', 'confidence_score'
+]
+
+
+def recommendation_for(price_change_percent: float) -> str:
+    """Recommendation for a forecast average this far (in %) from the current price"""
+    if price_change_percent < -5:
+        return 'wait'
+    if price_change_percent > 5:
+        return 'best_price'
+    return 'neutral'
+
+
+def fit_trends(prices: np.ndarray, present: np.ndarray) -> dict:
+    """Least-squares line through each row's present prices, all rows at once
+    
+    x is the position of a price among its row's present prices, as in
+    PricePredictor.prepare_features, so days without a price are skipped
+    rather than counted. Returns per-row 'count', 'slope', 'intercept' and
+    'r2' (scored like sklearn: 1 for a perfect fit of constant prices, 0 for
+    any other fit of them).
+    """
+    weights = present.astype(np.float64)
+    x = np.cumsum(present, axis=1) - 1.0
+    count = weights.sum(axis=1)
+    safe_count = np.maximum(count, 1)
+    
+    x_mean = (weights * x).sum(axis=1) / safe_count
+    y_mean = (weights * prices).sum(axis=1) / safe_count
+    dx = (x - x_mean[:, None]) * weights
+    dy = (prices - y_mean[:, None]) * weights
+    sxx = (dx * dx).sum(axis=1)
+    slope = (dx * dy).sum(axis=1) / np.where(sxx > 0, sxx, 1)
+    intercept = y_mean - slope * x_mean
+    
+    residuals = (prices - intercept[:, None] - slope[:, None] * x) * weights
+    ss_res = (residuals * residuals).sum(axis=1)
+    ss_tot = (dy * dy).sum(axis=1)
+    r2 = np.where(ss_tot > 0, 1 - ss_res / np.where(ss_tot > 0, ss_tot, 1), np.where(ss_res == 0, 1.0, 0.0))
+    
+    return {'count': count, 'slope': slope, 'intercept': intercept, 'r2': r2}
+
+
+def forecast_results(product_ids, current_prices, predictions, r2) -> list:
+    """(product id, train_and_predict result) pairs of fitted forecasts"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        price_change = (predictions.mean(axis=1) - current_prices) / current_prices * 100
+    confidence = np.maximum(0, r2)
+    return [
+        (int(product_ids[i]), {
+            'predictions': predictions[i],
+            'recommendation': recommendation_for(price_change[i]),
+            'confidence': float(confidence[i]),
+            'price_change': float(price_change[i])
+        })
+        for i in range(len(product_ids))
+    ]
+
 
 class PricePredictor:
     def __init__(self, days_history=60):
@@ -32,7 +114,7 @@ class PricePredictor:
     
     def prepare_features(self, prices):
         """Convert prices to features for ML"""
-        if len(prices) < 5:
+        if len(prices) < MIN_HISTORY:
             return None, None
         
         X = np.arange(len(prices)).reshape(-1, 1)
@@ -45,7 +127,7 @@ class PricePredictor:
         """Train model and predict next 7 days"""
         prices, dates = self.get_historical_prices(product)
         
-        if len(prices) < 5:
+        if len(prices) < MIN_HISTORY:
             return None
         
         X, y = self.prepare_features(prices)
@@ -56,7 +138,7 @@ class PricePredictor:
         
         # Predict next 7 days
         current_price = float(product.current_price)
-        future_X = np.arange(len(prices), len(prices) + 7).reshape(-1, 1)
+        future_X = np.arange(len(prices), len(prices) + FORECAST_DAYS).reshape(-1, 1)
         future_X_scaled = self.scaler.transform(future_X)
         
         predictions = self.model.predict(future_X_scaled)
@@ -64,13 +146,7 @@ class PricePredictor:
         # Determine recommendation
         average_future_price = np.mean(predictions)
         price_change_percent = ((average_future_price - current_price) / current_price) * 100
-        
-        if price_change_percent < -5:
-            recommendation = 'wait'
-        elif price_change_percent > 5:
-            recommendation = 'best_price'
-        else:
-            recommendation = 'neutral'
+        recommendation = recommendation_for(price_change_percent)
         
         # Calculate confidence (R² score)
         confidence = self.model.score(X, y)
@@ -83,26 +159,195 @@ class PricePredictor:
         }
     
     def save_predictions(self, product):
-        """Save predictions to database"""
+        """Save predictions to database, replacing today's prediction of the product if there is one"""
         result = self.train_and_predict(product)
         
         if result is None:
             return None
         
-        predictions = result['predictions']
+        prediction_obj, = self.save_results([(product.id, result)])
         
-        prediction_obj = PricePrediction.objects.create(
-            product=product,
-            day1_price=predictions[0],
-            day2_price=predictions[1],
-            day3_price=predictions[2],
-            day4_price=predictions[3],
-            day5_price=predictions[4],
-            day6_price=predictions[5],
-            day7_price=predictions[6],
-            price_change=result['price_change'],
-            recommendation=result['recommendation'],
-            confidence_score=result['confidence']
+        return prediction_obj
+    
+    def get_price_matrix(self, first_id: int, last_id: int, product_ids: np.ndarray) -> tuple:
+        """(prices, present) of the given products (sorted ids within first_id..last_id) over the history window
+        
+        One query loads the window for the whole id range; row i holds
+        product_ids[i]'s price per day, present marks the days that have one.
+        Prices are cast to float in SQL, the same doubles float(Decimal) gives
+        without building a Decimal per row.
+        """
+        cutoff_date = timezone.now().date() - timedelta(days=self.days_history)
+        history = list(
+            PriceHistory.objects.filter(
+                product_id__gte=first_id,
+                product_id__lte=last_id,
+                date__gte=cutoff_date
+            ).values_list('product_id', 'date', Cast('price', FloatField()))
         )
         
-        return prediction_obj
+        days = self.days_history + 1
+        if history:
+            days = max(days, (max(date for _, date, _ in history) - cutoff_date).days + 1)
+        prices = np.zeros((len(product_ids), days))
+        present = np.zeros((len(product_ids), days), dtype=bool)
+        if history:
+            history_ids = np.array([product_id for product_id, _, _ in history], dtype=np.int64)
+            rows = np.searchsorted(product_ids, history_ids)
+            known = (rows < len(product_ids)) & (product_ids[np.minimum(rows, len(product_ids) - 1)] == history_ids)
+            columns = np.array([(date - cutoff_date).days for _, date, _ in history])
+            values = np.array([price for _, _, price in history], dtype=np.float64)
+            prices[rows[known], columns[known]] = values[known]
+            present[rows[known], columns[known]] = True
+        
+        return prices, present
+    
+    def predict_batch(self, products: list) -> list:
+        """train_and_predict for many (product id, current price) pairs, sorted by id, in one history query
+        
+        Returns (product id, result) pairs for the products with enough history.
+        """
+        if not products:
+            return []
+        product_ids = np.array([product_id for product_id, _ in products], dtype=np.int64)
+        current_prices = np.array([float(price) for _, price in products])
+        prices, present = self.get_price_matrix(int(product_ids[0]), int(product_ids[-1]), product_ids)
+        
+        fit = fit_trends(prices, present)
+        future_x = fit['count'][:, None] + np.arange(FORECAST_DAYS)
+        predictions = fit['intercept'][:, None] + fit['slope'][:, None] * future_x
+        
+        usable = fit['count'] >= MIN_HISTORY
+        return forecast_results(product_ids[usable], current_prices[usable], predictions[usable], fit['r2'][usable])
+    
+    def predict_from_trends(self, first_id: int, last_id: int) -> list:
+        """predict_batch of the products with ids in first_id..last_id from their PriceTrend sums
+        
+        A trend's window ends at the product's newest price, the history window
+        at today, so prices between the two window starts are read back (one
+        query, only those rows) and subtracted as the trend's first positions.
+        Products whose newest price is older than the history window get no
+        forecast, as in predict_batch.
+        """
+        if self.days_history > settings.PRICE_TREND_DAYS:
+            raise ValueError(f'Price trends hold {settings.PRICE_TREND_DAYS} days of prices, not {self.days_history}')
+        cutoff_date = timezone.now().date() - timedelta(days=self.days_history)
+        trends = list(
+            PriceTrend.objects.filter(
+                product_id__gte=first_id,
+                product_id__lte=last_id,
+                n__gte=MIN_HISTORY,
+                last_date__gte=cutoff_date
+            ).order_by('product_id').values_list(
+                'product_id', Cast('product__current_price', FloatField()), 'window_start', *SUM_FIELDS
+            )
+        )
+        if not trends:
+            return []
+        columns = list(zip(*trends))
+        product_ids = np.array(columns[0], dtype=np.int64)
+        sums = {name: np.array(column, dtype=np.float64) for name, column in zip(SUM_FIELDS, columns[3:])}
+        
+        older = list(
+            PriceHistory.objects.filter(
+                product_id__gte=first_id,
+                product_id__lte=last_id,
+                date__gte=min(columns[2]),
+                date__lt=cutoff_date
+            ).order_by('product_id', 'date').values_list('product_id', 'date', Cast('price', FloatField()))
+        )
+        if older:
+            older_ids = np.array([product_id for product_id, _, _ in older], dtype=np.int64)
+            rows = np.minimum(np.searchsorted(product_ids, older_ids), len(product_ids) - 1)
+            window_starts = np.array([start.toordinal() for start in columns[2]])
+            dates = np.array([date.toordinal() for _, date, _ in older])
+            kept = (product_ids[rows] == older_ids) & (dates >= window_starts[rows])
+            rows = rows[kept]
+            y = np.array([price for _, _, price in older], dtype=np.float64)[kept]
+            # The first positions of each trend, in date order
+            x = (np.arange(len(rows)) - np.searchsorted(rows, rows)).astype(np.float64)
+            for name, weights in [
+                ('n', None), ('sum_x', x), ('sum_y', y), ('sum_xy', x * y), ('sum_xx', x * x), ('sum_yy', y * y)
+            ]:
+                sums[name] -= np.bincount(rows, weights=weights, minlength=len(product_ids))
+            sums['sum_x'], sums['sum_xy'], sums['sum_xx'] = shift_x(
+                np.bincount(rows, minlength=len(product_ids)), sums['n'], sums['sum_x'], sums['sum_y'],
+                sums['sum_xy'], sums['sum_xx']
+            )
+        
+        fit = fit_sums(**sums)
+        future_x = sums['n'][:, None] + np.arange(FORECAST_DAYS)
+        predictions = fit['intercept'][:, None] + fit['slope'][:, None] * future_x
+        
+        usable = sums['n'] >= MIN_HISTORY
+        return forecast_results(
+            product_ids[usable], np.array(columns[1], dtype=np.float64)[usable], predictions[usable], fit['r2'][usable]
+        )
+    
+    def save_predictions_batch(self, products: list) -> list:
+        """save_predictions for many (product id, current price) pairs, sorted by id, with one bulk insert"""
+        return self.save_results(self.predict_batch(products))
+    
+    def save_results(self, results: list) -> list:
+        """Upsert today's PricePrediction of every (product id, result) pair at once and make them current
+        
+        A product forecast again on the same day keeps one row, overwritten
+        in place, so reruns and the seed commands do not grow the table.
+        """
+        predictions = [
+            PricePrediction(
+                product_id=product_id,
+                **{f'day{day + 1}_price': result['predictions'][day] for day in range(FORECAST_DAYS)},
+                price_change=result['price_change'],
+                recommendation=result['recommendation'],
+                confidence_score=result['confidence']
+            )
+            for product_id, result in results
+        ]
+        predictions = PricePrediction.objects.bulk_create(
+            predictions,
+            update_conflicts=True,
+            unique_fields=['product', 'prediction_date'],
+            update_fields=PREDICTION_FIELDS,
+        )
+        set_current_predictions(predictions)
+        return predictions
+    
+    def save_predictions_range(self, first_id: int, last_id: int, from_trends: bool = False) -> tuple:
+        """save_predictions_batch for the products with ids in first_id..last_id, (products, predictions saved)"""
+        in_range = Product.objects.filter(id__gte=first_id, id__lte=last_id)
+        if from_trends:
+            return in_range.count(), len(self.save_results(self.predict_from_trends(first_id, last_id)))
+        products = list(in_range.order_by('id').values_list('id', 'current_price'))
+        return len(products), len(self.save_predictions_batch(products))
+
+
+def set_current_predictions(predictions: list):
+    """Point each product's CurrentPrediction at its just saved prediction, with one upsert"""
+    CurrentPrediction.objects.bulk_create(
+        [CurrentPrediction(product_id=prediction.product_id, prediction=prediction) for prediction in predictions],
+        update_conflicts=True,
+        unique_fields=['product'],
+        update_fields=['prediction'],
+    )
+
+
+def init_forecast_worker():
+    """Set up Django in a forecasting worker process, which opens its own database connections"""
+    import django
+    django.setup()
+
+
+def forecast_range(days_history: int, first_id: int, last_id: int, from_trends: bool = False) -> tuple:
+    """Worker task: forecast one chunk of products, returns (first id, last id, products, predictions saved)
+    
+    On SQLite only one worker writes at a time; a chunk whose insert timed
+    out waiting for the lock is retried (bulk_create rolled it back).
+    """
+    for attempt in range(FORECAST_ATTEMPTS):
+        try:
+            return (first_id, last_id) + PricePredictor(days_history).save_predictions_range(first_id, last_id, from_trends)
+        except OperationalError as e:
+            if 'locked' not in str(e) or attempt == FORECAST_ATTEMPTS - 1:
+                raise
+            time.sleep(attempt + 1)
@@ -0,0 +1,159 @@
+"""
+Running least-squares sums of each product's recent prices
+Kept in PriceTrend so a forecast needs no price history query
+
+record_price folds a new PriceHistory row into its product's sums in O(1)
+and subtracts the prices that fell out of the window. The window is the
+PRICE_TREND_DAYS days up to the product's newest price, and x is a price's
+position among the prices in the window (0 for the oldest), as in
+PricePredictor.prepare_features, so days without a price are skipped rather
+than counted. rebuild_trends recomputes the sums from the history, for
+backfills and rows written without signals (bulk_create, raw SQL); see
+`manage.py rebuild_price_trends`.
+"""
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import FloatField, Max
+from django.db.models.functions import Cast
+from datetime import timedelta
+from products.models import PriceHistory
+from ml_engine.models import PriceTrend
+
+SUM_FIELDS = ['n', 'sum_x', 'sum_y', 'sum_xy', 'sum_xx', 'sum_yy']
+
+
+def fit_sums(n, sum_x, sum_y, sum_xy, sum_xx, sum_yy) -> dict:
+    """Least-squares line of every set of sums at once: per-set 'slope', 'intercept' and 'r2'
+    
+    r2 is scored like sklearn: 1 for constant prices (flat within rounding
+    of the sums), otherwise the squared correlation of x and price.
+    """
+    n = np.asarray(n, dtype=np.float64)
+    safe_n = np.maximum(n, 1)
+    sxx = sum_xx - sum_x * sum_x / safe_n
+    sxy = sum_xy - sum_x * sum_y / safe_n
+    syy = sum_yy - sum_y * sum_y / safe_n
+    
+    slope = np.where(sxx > 0, sxy / np.where(sxx > 0, sxx, 1), 0.0)
+    intercept = (sum_y - slope * sum_x) / safe_n
+    flat = syy <= 1e-13 * np.maximum(sum_yy, 1)
+    r2 = np.where(flat, 1.0, np.clip(sxy * sxy / np.where(flat | (sxx <= 0), 1, sxx * syy), 0, 1))
+    
+    return {'slope': slope, 'intercept': intercept, 'r2': r2}
+
+
+def rebuild_trends(first_id: int, last_id: int) -> int:
+    """Recompute the PriceTrend of every product with an id in first_id..last_id, returns trends written
+    
+    Two history queries cover the whole range: the newest date of each
+    product, then the prices from the oldest window start on. Products
+    without price history lose their trend.
+    """
+    days = settings.PRICE_TREND_DAYS
+    in_range = PriceHistory.objects.filter(product_id__gte=first_id, product_id__lte=last_id)
+    newest = dict(in_range.order_by().values('product_id').annotate(last=Max('date')).values_list('product_id', 'last'))
+    
+    with transaction.atomic():
+        PriceTrend.objects.filter(product_id__gte=first_id, product_id__lte=last_id).exclude(
+            product_id__in=list(newest)
+        ).delete()
+        if not newest:
+            return 0
+        
+        product_ids = np.array(sorted(newest), dtype=np.int64)
+        window_starts = np.array([newest[product_id].toordinal() - days for product_id in product_ids.tolist()])
+        history = list(
+            in_range.filter(date__gte=min(newest.values()) - timedelta(days=days))
+            .order_by('product_id', 'date')
+            .values_list('product_id', 'date', Cast('price', FloatField()))
+        )
+        rows = np.searchsorted(product_ids, np.array([product_id for product_id, _, _ in history], dtype=np.int64))
+        kept = np.array([date.toordinal() for _, date, _ in history]) >= window_starts[rows]
+        rows = rows[kept]
+        y = np.array([price for _, _, price in history], dtype=np.float64)[kept]
+        # Rows are sorted by product then date, so a price's position is its offset from the product's first row
+        x = (np.arange(len(rows)) - np.searchsorted(rows, rows)).astype(np.float64)
+        
+        sums = {
+            name: np.bincount(rows, weights=weights, minlength=len(product_ids))
+            for name, weights in [
+                ('n', None), ('sum_x', x), ('sum_y', y), ('sum_xy', x * y), ('sum_xx', x * x), ('sum_yy', y * y)
+            ]
+        }
+        PriceTrend.objects.bulk_create(
+            [
+                PriceTrend(
+                    product_id=int(product_id),
+                    window_start=newest[product_id] - timedelta(days=days),
+                    last_date=newest[product_id],
+                    **{name: (int if name == 'n' else float)(sums[name][i]) for name in SUM_FIELDS}
+                )
+                for i, product_id in enumerate(product_ids.tolist())
+            ],
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=['window_start', 'last_date', 'updated_at'] + SUM_FIELDS,
+        )
+    return len(product_ids)
+
+
+def record_price(product_id: int, date, price: float):
+    """Add one new price of a product to its PriceTrend, moving the window forward when it is the newest
+    
+    Prices that leave the window are read back from the history and
+    subtracted, and the positions of the rest are shifted down, so each call
+    touches only the product's trend row and its expired prices. A product
+    without a trend gets one built from its history, and so does one given a
+    price older than its newest, which moves every newer price up a position.
+    """
+    days = settings.PRICE_TREND_DAYS
+    with transaction.atomic():
+        trend = PriceTrend.objects.select_for_update().filter(product_id=product_id).first()
+        if trend is None or trend.window_start <= date <= trend.last_date:
+            rebuild_trends(product_id, product_id)
+            return
+        if date < trend.window_start:
+            # Older than the window of the newest price
+            return
+        
+        window_start = date - timedelta(days=days)
+        if window_start > trend.window_start:
+            expired = PriceHistory.objects.filter(
+                product_id=product_id, date__gte=trend.window_start, date__lt=window_start
+            ).order_by('date').values_list(Cast('price', FloatField()), flat=True)
+            remove_oldest(trend, list(expired))
+            trend.window_start = window_start
+        
+        add_point(trend, trend.n, float(price), 1)
+        trend.last_date = date
+        trend.save()
+
+
+def shift_x(shift, n, sum_x, sum_y, sum_xy, sum_xx) -> tuple:
+    """(sum_x, sum_xy, sum_xx) after moving every x down by shift, for one set of sums or arrays of them"""
+    # x' = x - shift for every price in the sums
+    return sum_x - shift * n, sum_xy - shift * sum_y, sum_xx + shift * (shift * n - 2 * sum_x)
+
+
+def remove_oldest(trend: PriceTrend, prices: list):
+    """Subtract the oldest prices of a trend, given oldest first, and shift the rest to start at x = 0"""
+    for x, price in enumerate(prices):
+        add_point(trend, x, price, -1)
+    trend.sum_x, trend.sum_xy, trend.sum_xx = shift_x(
+        len(prices), trend.n, trend.sum_x, trend.sum_y, trend.sum_xy, trend.sum_xx
+    )
+    if trend.n == 0:
+        # Drop the rounding left over from the subtractions
+        trend.sum_x = trend.sum_y = trend.sum_xy = trend.sum_xx = trend.sum_yy = 0.0
+
+
+def add_point(trend: PriceTrend, x: int, y: float, sign: int):
+    """Add (sign 1) or remove (sign -1) one price from a trend's sums"""
+    trend.n += sign
+    trend.sum_x += sign * x
+    trend.sum_y += sign * y
+    trend.sum_xy += sign * x * y
+    trend.sum_xx += sign * x * x
+    trend.sum_yy += sign * y * y
@@ -0,0 +1,110 @@
+"""
+Result cache for ML search endpoints
+Uses the Django cache configured in settings.CACHES (Redis) and falls back to
+an in-process LRU while that cache is unreachable
+"""
+
+from collections import OrderedDict
+from django.core.cache import caches
+import hashlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Small thread-safe LRU with per-entry expiry"""
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get_many(self, keys) -> dict:
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                expires_at, value = entry
+                if expires_at <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = value
+        return found
+    
+    def set_many(self, mapping: dict, timeout: float):
+        expires_at = time.monotonic() + timeout
+        with self._lock:
+            for key, value in mapping.items():
+                self._entries[key] = (expires_at, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ResultCache:
+    """Namespaced get_many/set_many over the shared cache, with empty results cached for a shorter time"""
+    
+    # How long to stay on the LRU after the shared cache failed
+    RETRY_SECONDS = 30
+    
+    def __init__(self, prefix: str, timeout: int, negative_timeout: int, lru_size: int = 1024, alias: str = 'default'):
+        self.prefix = prefix
+        self.timeout = timeout
+        self.negative_timeout = negative_timeout
+        self.alias = alias
+        self.fallback = LRUCache(lru_size)
+        self._shared_down_until = 0.0
+    
+    def _key(self, key: str) -> str:
+        # Hash so arbitrary user text makes a valid key for every cache backend
+        return f"{self.prefix}:{hashlib.md5(key.encode()).hexdigest()}"
+    
+    def _shared(self):
+        if time.monotonic() < self._shared_down_until:
+            return None
+        return caches[self.alias]
+    
+    def _shared_failed(self, e):
+        logger.warning("Result cache unavailable, using in-process LRU: %s", e)
+        self._shared_down_until = time.monotonic() + self.RETRY_SECONDS
+    
+    def get_many(self, keys) -> dict:
+        """Cached values for the given keys, missing keys are left out"""
+        hashed = {self._key(key): key for key in keys}
+        shared = self._shared()
+        if shared is not None:
+            try:
+                found = shared.get_many(list(hashed))
+                return {hashed[k]: value for k, value in found.items()}
+            except Exception as e:
+                self._shared_failed(e)
+        found = self.fallback.get_many(hashed)
+        return {hashed[k]: value for k, value in found.items()}
+    
+    def set_many(self, mapping: dict):
+        """Store values; empty ones are negative entries and expire after negative_timeout"""
+        for timeout, entries in (
+            (self.timeout, {self._key(k): v for k, v in mapping.items() if v}),
+            (self.negative_timeout, {self._key(k): v for k, v in mapping.items() if not v}),
+        ):
+            if not entries:
+                continue
+            shared = self._shared()
+            if shared is not None:
+                try:
+                    shared.set_many(entries, timeout=timeout)
+                    continue
+                except Exception as e:
+                    self._shared_failed(e)
+            self.fallback.set_many(entries, timeout)
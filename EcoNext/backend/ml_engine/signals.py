@@ -0,0 +1,62 @@
+"""
+Keep the intent and visual search indexes and the price trends in step with the catalog
+
+Every worker catches up with edits on its own (see get_intent_index and
+get_visual_index); these receivers make the writing process catch up on its
+next search and make category renames visible to the other workers too.
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from functools import partial
+from products.models import Product, Category, PriceHistory
+from ml_engine.models import ImageFeatures
+from ml_engine.price_trends import record_price, rebuild_trends
+from ml_engine.intent_search import request_intent_index_refresh
+from ml_engine.visual_search import request_visual_index_refresh
+
+
+@receiver(post_save, sender=Product, dispatch_uid='intent_index_product_saved')
+def product_saved(sender, instance, **kwargs):
+    """Name, category or tags may have changed, and the price and stock visual search filters on"""
+    transaction.on_commit(request_intent_index_refresh)
+    transaction.on_commit(request_visual_index_refresh)
+
+
+@receiver(post_delete, sender=Product, dispatch_uid='intent_index_product_deleted')
+def product_deleted(sender, instance, **kwargs):
+    transaction.on_commit(request_intent_index_refresh)
+    transaction.on_commit(request_visual_index_refresh)
+
+
+@receiver(post_save, sender=Category, dispatch_uid='intent_index_category_saved')
+def category_saved(sender, instance, created, **kwargs):
+    """The category name is part of every product document in it"""
+    if created:
+        return
+    # Bumping updated_at makes every worker re-vectorize these products
+    instance.products.update(updated_at=timezone.now())
+    transaction.on_commit(request_intent_index_refresh)
+
+
+@receiver(post_save, sender=ImageFeatures, dispatch_uid='visual_index_features_saved')
+@receiver(post_delete, sender=ImageFeatures, dispatch_uid='visual_index_features_deleted')
+def image_features_changed(sender, instance, **kwargs):
+    transaction.on_commit(request_visual_index_refresh)
+
+
+@receiver(post_save, sender=PriceHistory, dispatch_uid='price_trend_history_saved')
+def price_history_saved(sender, instance, created, **kwargs):
+    """A new price is added to the trend sums in the same transaction as its row"""
+    if created:
+        record_price(instance.product_id, instance.date, instance.price)
+    else:
+        transaction.on_commit(partial(rebuild_trends, instance.product_id, instance.product_id))
+
+
+@receiver(post_delete, sender=PriceHistory, dispatch_uid='price_trend_history_deleted')
+def price_history_deleted(sender, instance, **kwargs):
+    # After commit, when a deleted product's trend is gone with it
+    transaction.on_commit(partial(rebuild_trends, instance.product_id, instance.product_id))
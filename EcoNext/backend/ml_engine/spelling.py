@@ -0,0 +1,96 @@
+"""
+Typo-tolerant query correction using symmetric deletion (SymSpell)
+Corrects "yoga matt" -> "yoga mat", "samsng" -> "samsung" against the catalog vocabulary
+"""
+
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+import re
+
+# Same tokens the intent vectorizer extracts
+TOKEN_PATTERN = re.compile(r'(?u)\b\w\w+\b')
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Damerau-Levenshtein (optimal string alignment) distance, or max_distance + 1 once it is exceeded"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+class SpellingIndex:
+    """Symmetric-delete spelling dictionary over a vocabulary
+    
+    Every word is filed under each string obtained by deleting up to
+    max_distance characters from its first prefix_length characters. A typo
+    shares one of those deletes with the word it was meant to be, so finding
+    candidates is a handful of dict lookups per token rather than a scan of
+    the vocabulary.
+    """
+    
+    def __init__(self, max_distance: int = 2, prefix_length: int = 7, min_length: int = 3):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.min_length = min_length  # Shorter tokens are too ambiguous to correct
+        self.words = {}  # word -> number of documents it occurs in
+        self.deletes = {}  # delete -> words filed under it
+    
+    def _deletes(self, word: str) -> set:
+        """The word's prefix and every string reachable from it by up to max_distance deletions"""
+        prefix = word[:self.prefix_length]
+        found = {prefix}
+        frontier = {prefix}
+        for _ in range(self.max_distance):
+            frontier = {w[:i] + w[i + 1:] for w in frontier if len(w) > 1 for i in range(len(w))}
+            found |= frontier
+        return found
+    
+    def add_document(self, text: str):
+        """Count the words of a document into the vocabulary"""
+        for word in set(TOKEN_PATTERN.findall(text.lower())):
+            if word in ENGLISH_STOP_WORDS or word.isdigit():
+                continue
+            if word not in self.words:
+                self.words[word] = 0
+                if len(word) >= self.min_length:
+                    for delete in self._deletes(word):
+                        self.deletes.setdefault(delete, []).append(word)
+            self.words[word] += 1
+    
+    def lookup(self, token: str):
+        """Most frequent vocabulary word closest to token, None if the token is known or nothing is close"""
+        if token in self.words or len(token) < self.min_length or token.isdigit():
+            return None
+        
+        best = None
+        best_key = (self.max_distance + 1, 0)
+        for delete in self._deletes(token):
+            for word in self.deletes.get(delete, ()):
+                distance = edit_distance(token, word, self.max_distance)
+                key = (distance, -self.words[word])
+                if distance <= self.max_distance and key < best_key:
+                    best, best_key = word, key
+        return best
+    
+    def correct(self, query: str):
+        """Query with unknown tokens replaced by their corrections, None if nothing changed"""
+        tokens = TOKEN_PATTERN.findall(query.lower())
+        corrected = []
+        changed = False
+        for token in tokens:
+            replacement = None if token in ENGLISH_STOP_WORDS else self.lookup(token)
+            corrected.append(replacement or token)
+            changed = changed or replacement is not None
+        return ' '.join(corrected) if changed else None
@@ -0,0 +1,172 @@
+"""
+Search-as-you-type suggestions
+Completes "yo" -> "yoga mat", "Yoga Mat Pro" from popular searches, product names and tags
+
+The suggest index lives in process memory and is rebuilt in a background
+thread every SUGGEST_REBUILD_SECONDS, so keystrokes never touch the database.
+"""
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from django.db.models.functions import Lower
+from django.utils import timezone
+from products.models import Product, ProductSearch
+from collections import Counter
+from datetime import timedelta
+from bisect import bisect_left
+import numpy as np
+import threading
+import time
+
+# Prefixes this short span much of the catalog, their answers are precomputed
+SHORT_PREFIX_LENGTH = 2
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase with runs of whitespace collapsed, the form completions are matched in"""
+    return ' '.join(text.lower().split())
+
+
+class SuggestIndex:
+    """Completions in a sorted key array, looked up by bisecting on the prefix
+    
+    Every completion is ranked once at build time, by how often it was
+    searched and then by how many products it describes. A lookup bisects the
+    range of keys starting with the prefix and takes the best ranks inside it.
+    Completions are also keyed from each later word, so "mat" finds "Yoga Mat".
+    """
+    
+    def __init__(self, completions: list, limit: int):
+        """completions: (text, kind, search count, product count)"""
+        completions = sorted(completions, key=lambda c: (-c[2], -c[3], c[0]))
+        self.texts = [text for text, _, _, _ in completions]
+        self.kinds = [kind for _, kind, _, _ in completions]
+        self.limit = limit
+        
+        keys = []
+        for rank, text in enumerate(self.texts):
+            words = normalize_text(text).split()
+            keys.extend((' '.join(words[i:]), rank) for i in range(len(words)))
+        keys.sort()
+        self.keys = [key for key, _ in keys]
+        self.ranks = np.array([rank for _, rank in keys], dtype=np.int64)
+        
+        self.short = {}
+        for key in self.keys:
+            for length in range(1, SHORT_PREFIX_LENGTH + 1):
+                prefix = key[:length]
+                if prefix not in self.short:
+                    self.short[prefix] = self._best_ranks(prefix, limit)
+    
+    def __len__(self):
+        return len(self.texts)
+    
+    def _best_ranks(self, prefix: str, limit: int) -> list:
+        """Ranks of the best completions with a key starting with prefix, best first"""
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + '\U0010ffff', start)
+        ranks = self.ranks[start:end]
+        
+        # Over-select since one completion can match under several of its words
+        if len(ranks) > 2 * limit:
+            ranks = np.partition(ranks, 2 * limit - 1)[:2 * limit]
+        best = np.unique(ranks)[:limit].tolist()
+        if len(best) < limit and len(ranks) < end - start:
+            best = np.unique(self.ranks[start:end])[:limit].tolist()
+        return best
+    
+    def suggest(self, prefix: str, limit: int = None) -> list:
+        """Best completions of prefix as {'text', 'type'} dicts"""
+        limit = min(limit or self.limit, self.limit)
+        prefix = normalize_text(prefix)
+        if not prefix:
+            return []
+        
+        ranks = self.short.get(prefix, [])
+        if len(prefix) > SHORT_PREFIX_LENGTH:
+            ranks = self._best_ranks(prefix, limit)
+        
+        return [{'text': self.texts[rank], 'type': self.kinds[rank]} for rank in ranks[:limit]]
+    
+    @classmethod
+    def build(cls):
+        """Collect completions from the catalog and the recent search log"""
+        since = timezone.now() - timedelta(days=settings.SUGGEST_QUERY_DAYS)
+        popular = (
+            ProductSearch.objects.filter(timestamp__gte=since)
+            .annotate(text=Lower('query'))
+            .values('text')
+            .annotate(count=Count('id'))
+            .filter(count__gte=settings.SUGGEST_MIN_QUERY_COUNT)
+            .order_by('-count')[:settings.SUGGEST_MAX_QUERIES]
+        )
+        searches = Counter()
+        for row in popular:
+            searches[normalize_text(row['text'])] += row['count']
+        
+        # Display text and product count per normalized text
+        catalog = {}
+        for name, tags in Product.objects.values_list('name', 'tags'):
+            for text, kind in [(name, 'product')] + [(tag, 'tag') for tag in tags or []]:
+                key = normalize_text(text)
+                if not key:
+                    continue
+                shown, shown_kind, count = catalog.get(key, (text, kind, 0))
+                catalog[key] = (shown, shown_kind, count + 1)
+        
+        completions = [
+            (shown, kind, searches.pop(key, 0), count)
+            for key, (shown, kind, count) in catalog.items()
+        ]
+        completions.extend((key, 'query', count, 0) for key, count in searches.items() if key)
+        return cls(completions, settings.SUGGEST_MAX_RESULTS)
+
+
+_suggest_index = None
+_suggest_built_at = 0.0
+_suggest_lock = threading.Lock()
+_rebuilding = threading.Event()
+
+
+def _rebuild_in_background():
+    """Rebuild the suggest index in a thread while requests keep using the current one"""
+    if _rebuilding.is_set():
+        return
+    _rebuilding.set()
+    
+    def run():
+        global _suggest_index, _suggest_built_at
+        try:
+            index = SuggestIndex.build()
+            _suggest_index, _suggest_built_at = index, time.monotonic()
+        except Exception as e:
+            print(f"Error rebuilding suggest index: {e}")
+        finally:
+            _rebuilding.clear()
+            connection.close()
+    
+    threading.Thread(target=run, name='suggest-index-rebuild', daemon=True).start()
+
+
+def get_suggest_index() -> SuggestIndex:
+    """Return the process-wide suggest index, the first call builds it"""
+    global _suggest_index, _suggest_built_at
+    
+    index = _suggest_index
+    if index is None:
+        with _suggest_lock:
+            if _suggest_index is None:
+                _suggest_index, _suggest_built_at = SuggestIndex.build(), time.monotonic()
+            return _suggest_index
+    
+    if time.monotonic() - _suggest_built_at >= settings.SUGGEST_REBUILD_SECONDS:
+        _rebuild_in_background()
+    return index
+
+
+def invalidate_suggest_index():
+    """Drop the in-process suggest index so the next call rebuilds it"""
+    global _suggest_index
+    with _suggest_lock:
+        _suggest_index = None
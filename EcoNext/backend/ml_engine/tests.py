@@ -1,3 +1,892 @@
-from django.test import TestCase
+from django.core.management import call_command, CommandError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from products.models import Category, Product, PriceHistory
+from ml_engine.models import ImageFeatures, PricePrediction, PriceTrend, PredictionAccuracy, TFIDFIndex
+from ml_engine.price_predictor import PricePredictor
+from ml_engine.price_trends import fit_sums, rebuild_trends, SUM_FIELDS
+from ml_engine.visual_search import (
+    VisualSearchEngine, ProductColumns, FEATURE_DIM, get_visual_index, invalidate_visual_index
+)
+from ml_engine.vectors import pack_vector, unpack_vector, unpack_vectors
+from ml_engine.ann import IVFIndex
+from ml_engine.extraction_pool import ExtractionPool, ExtractionPoolBusy
+from ml_engine.result_cache import ResultCache
+from ml_engine.intent_search import (
+    IntentBasedSearcher, IntentIndex, INDEX_FORMAT, normalize_query, catalog_stats, catalog_version,
+    get_intent_index, invalidate_intent_index, request_intent_index_refresh, publish_snapshot
+)
+from django.core.cache import caches
+from unittest import mock
+from concurrent.futures import TimeoutError
+from ml_engine.features import perceptual_hash, hash_bands, hash_distance, decode_reduced
+from sklearn.metrics.pairwise import cosine_similarity
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from functools import partial
+from pathlib import Path
+from datetime import timedelta
+from PIL import Image
+import numpy as np
+import cv2
+import tempfile
+import copy
+import json
+import threading
+import time
+import os
+import io
 
-# Create your tests here.
+
+@override_settings(VISUAL_INDEX_CHECK_SECONDS=0)
+class VisualIndexTests(TestCase):
+    def setUp(self):
+        invalidate_visual_index()
+        self.rng = np.random.default_rng(0)
+        self.category = Category.objects.create(name='Fitness')
+        self.vectors = {}
+        for i in range(30):
+            self.add_product(i)
+    
+    def tearDown(self):
+        invalidate_visual_index()
+    
+    def add_product(self, i):
+        product = Product.objects.create(name=f'Product {i}', category=self.category, current_price=10)
+        vector = self.rng.random(FEATURE_DIM).astype(np.float32)
+        ImageFeatures.objects.create(product=product, vector=pack_vector(vector), image_hash=str(i))
+        self.vectors[product.id] = vector
+        return product
+    
+    def test_matches_cosine_similarity(self):
+        query = self.rng.random(FEATURE_DIM).astype(np.float32)
+        results = VisualSearchEngine().find_similar_products(query, top_k=5)
+        
+        ids = list(self.vectors)
+        expected = cosine_similarity([query], [self.vectors[pid] for pid in ids])[0]
+        best = np.argsort(-expected)[:5]
+        self.assertEqual([product.id for product, _ in results], [ids[i] for i in best])
+        np.testing.assert_allclose([score for _, score in results], expected[best], rtol=1e-5)
+    
+    def test_catches_up_with_changes(self):
+        self.assertEqual(len(get_visual_index()), 30)
+        
+        product = self.add_product(30)
+        product.image_features_model.delete()
+        for i in (31, 32):
+            self.add_product(i)
+        
+        index = get_visual_index()
+        self.assertEqual(len(index), 32)
+        self.assertNotIn(product.id, index.product_ids)
+        
+        # Querying with a stored vector finds its own product first
+        last = list(self.vectors)[-1]
+        results = VisualSearchEngine().find_similar_products(self.vectors[last], top_k=1)
+        self.assertEqual(results[0][0].id, last)
+    
+    def test_precomputed_neighbours_match_live_lookup(self):
+        product_id = next(iter(self.vectors))
+        url = f'/api/products/{product_id}/similar/visual/?limit=5'
+        live = self.client.get(url).data
+        self.assertEqual(live['source'], 'live')
+        
+        call_command('precompute_visual_neighbours', block_size=7, stdout=io.StringIO())
+        with self.assertNumQueries(2):
+            precomputed = self.client.get(url).data
+        self.assertEqual(precomputed['source'], 'precomputed')
+        
+        ids = [result['product']['id'] for result in live['results']]
+        self.assertEqual(len(ids), 5)
+        self.assertNotIn(product_id, ids)
+        self.assertEqual([result['product']['id'] for result in precomputed['results']], ids)
+        np.testing.assert_allclose(
+            [result['similarity_score'] for result in precomputed['results']],
+            [result['similarity_score'] for result in live['results']],
+            rtol=1e-5,
+        )
+    
+    def test_reindexed_products_fall_back_to_live_lookup(self):
+        product_id = next(iter(self.vectors))
+        url = f'/api/products/{product_id}/similar/visual/?limit=5'
+        call_command('precompute_visual_neighbours', stdout=io.StringIO())
+        self.assertEqual(self.client.get(url).data['source'], 'precomputed')
+        
+        # index_images re-indexes with bulk_update, which sends no signals
+        vector = self.rng.random(FEATURE_DIM).astype(np.float32)
+        ImageFeatures.objects.filter(product_id=product_id).update(vector=pack_vector(vector), updated_at=timezone.now())
+        self.vectors[product_id] = vector
+        response = self.client.get(url).data
+        self.assertEqual(response['source'], 'live')
+        
+        ids = list(self.vectors)
+        expected = cosine_similarity([vector], [self.vectors[pid] for pid in ids])[0]
+        best = [ids[i] for i in np.argsort(-expected) if ids[i] != product_id][:5]
+        self.assertEqual([result['product']['id'] for result in response['results']], best)
+    
+    def test_product_columns_catch_up_with_edits_and_deletes(self):
+        ids = list(self.vectors)
+        columns = ProductColumns.build()
+        Product.objects.filter(id=ids[0]).delete()
+        Product.objects.filter(id=ids[1]).update(current_price=99, stock=4, updated_at=timezone.now())
+        added = self.add_product(30)
+        
+        columns = columns.catch_up(catalog_stats())
+        fresh = ProductColumns.build()
+        for name in ('ids', 'category_ids', 'prices', 'stock'):
+            np.testing.assert_array_equal(getattr(columns, name), getattr(fresh, name))
+        self.assertEqual(columns.rows_of(np.array([ids[0], added.id])).tolist(), [-1, len(columns) - 1])
+    
+    def test_similar_limit_is_clamped(self):
+        product_id = next(iter(self.vectors))
+        call_command('precompute_visual_neighbours', stdout=io.StringIO())
+        url = f'/api/products/{product_id}/similar/visual/'
+        
+        self.assertEqual(self.client.get(url, {'limit': -3}).data['total_found'], 1)
+        self.assertEqual(self.client.get(url, {'limit': 1000}).data['total_found'], 20)
+        self.assertEqual(self.client.get(url, {'limit': 'many'}).status_code, 400)
+    
+    @override_settings(VISUAL_INDEX_CHECK_SECONDS=0, VISUAL_FILTER_EXACT_ROWS=0)
+    def test_filters_apply_before_top_k(self):
+        kitchen = Category.objects.create(name='Kitchen')
+        ids = list(self.vectors)
+        allowed = ids[::3]
+        Product.objects.filter(id__in=allowed).update(category=kitchen, current_price=5, stock=3)
+        Product.objects.filter(id=ids[1]).update(category=kitchen, current_price=8, stock=3)
+        filters = {'category': kitchen.id, 'max_price': 6, 'in_stock': True}
+        query = self.rng.random(FEATURE_DIM).astype(np.float32)
+        
+        results = VisualSearchEngine().find_similar_products(query, top_k=5, filters=filters)
+        expected = cosine_similarity([query], [self.vectors[pid] for pid in allowed])[0]
+        self.assertEqual([product.id for product, _ in results], [allowed[i] for i in np.argsort(-expected)[:5]])
+        
+        # Through IVF, probing further until k candidates pass
+        index = get_visual_index()
+        ann_index = index.with_ann(IVFIndex.train(index.vectors, index.product_ids, n_lists=4))
+        found, _ = ann_index.search(query, 5, n_probe=1, mask=index.filter_mask(**filters))
+        self.assertEqual(len(found), 5)
+        self.assertTrue(set(found.tolist()) <= set(allowed))
+        
+        # Stock changes reach the snapshot without touching the image features
+        Product.objects.filter(id__in=allowed).update(stock=0, updated_at=timezone.now())
+        self.assertEqual(VisualSearchEngine().find_similar_products(query, top_k=5, filters=filters), [])
+    
+    def test_ivf_matches_exact_when_probing_every_list(self):
+        index = get_visual_index()
+        ann = IVFIndex.train(index.vectors, index.product_ids, n_lists=4)
+        index = index.with_ann(ann)
+        query = self.rng.random(FEATURE_DIM).astype(np.float32)
+        
+        ids, scores = index.search(query, 5, n_probe=4)
+        exact_ids, exact_scores = index.exact_search(index.normalize(query), 5)
+        np.testing.assert_array_equal(ids, exact_ids)
+        np.testing.assert_allclose(scores, exact_scores, rtol=1e-6)
+    
+    def test_ivf_serves_rows_added_after_training(self):
+        index = get_visual_index()
+        ann = IVFIndex.train(index.vectors, index.product_ids, n_lists=4)
+        
+        # One product re-indexed and one added after training
+        first = next(iter(self.vectors))
+        changed = ImageFeatures.objects.get(product_id=first)
+        changed.vector = pack_vector(self.rng.random(FEATURE_DIM))
+        changed.save()
+        added = self.add_product(30)
+        
+        index = get_visual_index().with_ann(ann)
+        self.assertEqual(set(index.product_ids[index.uncovered]), {first, added.id})
+        
+        ids, _ = index.search(self.vectors[added.id], 1, n_probe=1)
+        self.assertEqual(ids.tolist(), [added.id])
+
+
+class ExtractionPoolTests(TestCase):
+    def test_timed_out_jobs_keep_their_slot_until_they_finish(self):
+        pool = ExtractionPool(1, 1)
+        try:
+            with self.assertRaises(TimeoutError):
+                pool.run(time.sleep, 1, timeout=0.05)
+            # Still sleeping in the worker, so the pool stays full...
+            with self.assertRaises(ExtractionPoolBusy):
+                pool.run(time.sleep, 0)
+            
+            # and takes jobs again once the sleep ends
+            deadline = time.monotonic() + 10
+            while True:
+                try:
+                    self.assertIsNone(pool.run(time.sleep, 0, timeout=5))
+                    break
+                except ExtractionPoolBusy:
+                    self.assertLess(time.monotonic(), deadline)
+                    time.sleep(0.05)
+        finally:
+            pool._reset()
+
+
+class BrokenCache:
+    """Cache backend whose server is down"""
+    
+    def get_many(self, keys):
+        raise ConnectionError('Connection refused')
+    
+    def set_many(self, mapping, timeout=None):
+        raise ConnectionError('Connection refused')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ResultCacheTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.cache = ResultCache('test', timeout=600, negative_timeout=60, lru_size=8)
+    
+    def test_hits_and_misses(self):
+        self.cache.set_many({'yoga mat': [1, 2], 'kettlebell': [3]})
+        self.assertEqual(self.cache.get_many(['yoga mat', 'kettlebell', 'sofa']), {'yoga mat': [1, 2], 'kettlebell': [3]})
+        # Kept in the shared cache, not the in-process fallback
+        self.assertEqual(self.cache.fallback.get_many(['yoga mat']), {})
+    
+    def test_empty_results_are_cached_for_the_negative_timeout(self):
+        shared = caches['default']
+        with mock.patch.object(shared, 'set_many', wraps=shared.set_many) as set_many:
+            self.cache.set_many({'yoga mat': [1], 'xyzzy': []})
+        self.assertEqual(
+            sorted(call.kwargs['timeout'] for call in set_many.call_args_list), [60, 600]
+        )
+        self.assertEqual(self.cache.get_many(['xyzzy']), {'xyzzy': []})
+    
+    def test_falls_back_to_the_lru_when_the_backend_fails(self):
+        cache = ResultCache('test', timeout=600, negative_timeout=0.05, lru_size=8)
+        with mock.patch('ml_engine.result_cache.caches', {'default': BrokenCache()}):
+            with self.assertLogs('ml_engine.result_cache', 'WARNING'):
+                cache.set_many({'yoga mat': [1], 'xyzzy': []})
+            self.assertEqual(cache.get_many(['yoga mat', 'xyzzy']), {'yoga mat': [1], 'xyzzy': []})
+            time.sleep(0.1)
+            self.assertEqual(cache.get_many(['yoga mat', 'xyzzy']), {'yoga mat': [1]})
+    
+    def test_catalog_changes_start_a_fresh_namespace(self):
+        invalidate_intent_index()
+        self.addCleanup(invalidate_intent_index)
+        category = Category.objects.create(name='Fitness')
+        Product.objects.create(name='Yoga Mat', category=category, current_price=20, tags=['yoga'])
+        searcher = IntentBasedSearcher()
+        first = searcher.get_category_recommendations('yoga')
+        self.assertEqual(len(first['Fitness']), 1)
+        
+        Product.objects.create(name='Yoga Block', category=category, current_price=9, tags=['yoga'])
+        with override_settings(INTENT_INDEX_CHECK_SECONDS=0):
+            second = searcher.get_category_recommendations('yoga')
+        self.assertEqual({result['product'].name for result in second['Fitness']}, {'Yoga Mat', 'Yoga Block'})
+    
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query('The  Yoga MATS for a gym!'), 'yoga mats gym')
+        self.assertEqual(normalize_query('yoga mats gym'), normalize_query('YOGA, mats & the gym'))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class IntentIndexTests(TestCase):
+    def setUp(self):
+        invalidate_intent_index()
+        caches['default'].clear()
+        self.fitness = Category.objects.create(name='Fitness')
+        self.kitchen = Category.objects.create(name='Kitchen')
+        self.products = {
+            name: Product.objects.create(name=name, category=category, current_price=20, tags=tags)
+            for name, category, tags in [
+                ('Yoga Mat', self.fitness, ['yoga', 'gym']),
+                ('Yoga Block', self.fitness, ['yoga']),
+                ('Dumbbells', self.fitness, ['gym', 'weights']),
+                ('Chef Knife', self.kitchen, ['cooking', 'knife']),
+                ('Frying Pan', self.kitchen, ['cooking']),
+            ]
+        }
+    
+    def tearDown(self):
+        invalidate_intent_index()
+    
+    def recommended(self, query):
+        """{category: [product names]} recommended for the query"""
+        return {
+            category: [result['product'].name for result in results]
+            for category, results in IntentBasedSearcher().get_category_recommendations(query).items()
+        }
+    
+    @override_settings(INTENT_INDEX_CHECK_SECONDS=0)
+    def test_index_is_reused_until_the_catalog_changes(self):
+        index = get_intent_index()
+        self.assertEqual(index.version, catalog_version())
+        with mock.patch.object(IntentIndex, 'build', side_effect=AssertionError('rebuilt')):
+            self.assertIs(get_intent_index(), index)
+        
+        Product.objects.create(name='Kettlebell', category=self.fitness, current_price=40, tags=['gym'])
+        updated = get_intent_index()
+        self.assertIsNot(updated, index)
+        self.assertEqual(updated.version, catalog_version())
+        self.assertEqual(len(updated), 6)
+    
+    def test_index_is_not_checked_again_within_the_interval(self):
+        index = get_intent_index()
+        Product.objects.create(name='Kettlebell', category=self.fitness, current_price=40, tags=['gym'])
+        self.assertIs(get_intent_index(), index)
+        
+        # Saves request a refresh once committed
+        request_intent_index_refresh()
+        self.assertEqual(len(get_intent_index()), 6)
+    
+    def caught_up(self, base):
+        """Index after the catch-up, asserting it kept the base fit instead of rebuilding"""
+        with mock.patch.object(IntentIndex, 'build', side_effect=AssertionError('rebuilt')):
+            index = get_intent_index()
+        self.assertIs(index.matrix, base.matrix)
+        self.assertEqual(index.version, catalog_version())
+        return index
+    
+    @override_settings(INTENT_INDEX_CHECK_SECONDS=0)
+    def test_tag_edits_are_searchable_after_catch_up(self):
+        base = get_intent_index()
+        dumbbells = self.products['Dumbbells']
+        dumbbells.tags = ['pilates']
+        dumbbells.save()
+        
+        index = self.caught_up(base)
+        # Only the edited product, plus the last one saved before the watermark, is re-vectorized
+        self.assertIn(dumbbells.id, index.product_ids[len(base.product_ids):])
+        self.assertLessEqual(index.delta.shape[0], 2)
+        self.assertEqual(self.recommended('pilates'), {'Fitness': ['Dumbbells']})
+        self.assertEqual(self.recommended('weights'), {})
+        
+        rows, _ = index.top_k(index.transform(['pilates']), 5)
+        self.assertEqual(index.product_ids[rows].tolist(), [dumbbells.id])
+    
+    @override_settings(INTENT_INDEX_CHECK_SECONDS=0)
+    def test_deleted_products_drop_out(self):
+        base = get_intent_index()
+        self.products['Frying Pan'].delete()
+        
+        index = self.caught_up(base)
+        self.assertEqual(len(index), 4)
+        self.assertEqual(self.recommended('cooking'), {'Kitchen': ['Chef Knife']})
+    
+    @override_settings(INTENT_INDEX_CHECK_SECONDS=0)
+    def test_category_renames_reach_every_product(self):
+        base = get_intent_index()
+        self.kitchen.name = 'Cookware'
+        self.kitchen.save()
+        
+        index = self.caught_up(base)
+        self.assertEqual(set(index.product_ids[len(base.product_ids):]), {
+            self.products['Chef Knife'].id, self.products['Frying Pan'].id
+        })
+        self.assertEqual(set(self.recommended('cooking')), {'Cookware'})
+        self.assertEqual(sorted(self.recommended('cookware')['Cookware']), ['Chef Knife', 'Frying Pan'])
+    
+    @override_settings(INTENT_INDEX_CHECK_SECONDS=0, INTENT_INDEX_COMPACT_ROWS=1)
+    def test_large_deltas_are_compacted_into_a_new_fit(self):
+        started = []
+        
+        class DeferredThread:
+            def __init__(self, target, args=(), **kwargs):
+                self.run = partial(target, *args)
+            
+            def start(self):
+                started.append(self)
+        
+        base = get_intent_index()
+        dumbbells = self.products['Dumbbells']
+        dumbbells.tags = ['pilates']
+        dumbbells.save()
+        with mock.patch('ml_engine.intent_search.threading.Thread', DeferredThread):
+            self.assertIsNotNone(self.caught_up(base).delta)
+        self.assertEqual(len(started), 1)
+        
+        # The refit runs while searches keep using the caught-up index
+        started[0].run()
+        compacted = get_intent_index()
+        self.assertIsNot(compacted.matrix, base.matrix)
+        self.assertIsNone(compacted.delta)
+        self.assertEqual(len(compacted), 5)
+        self.assertEqual(self.recommended('pilates'), {'Fitness': ['Dumbbells']})
+
+
+def is_memory_mapped(array) -> bool:
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+class IntentSnapshotTests(TestCase):
+    def setUp(self):
+        invalidate_intent_index()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings_override = override_settings(INTENT_INDEX_DIR=self.directory, INTENT_INDEX_KEEP_SNAPSHOTS=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.category = Category.objects.create(name='Fitness')
+        for name, tags in [('Yoga Mat', ['yoga', 'gym']), ('Yoga Block', ['yoga']), ('Dumbbells', ['gym'])]:
+            Product.objects.create(name=name, category=self.category, current_price=20, tags=tags)
+    
+    def tearDown(self):
+        invalidate_intent_index()
+    
+    def test_loaded_snapshot_matches_the_built_index(self):
+        index = IntentIndex.build()
+        index.save(self.directory / 'snapshot')
+        loaded = IntentIndex.load(self.directory / 'snapshot')
+        
+        self.assertEqual(loaded.version, index.version)
+        self.assertEqual(loaded.watermark, index.watermark)
+        for name in ('product_ids', 'names', 'tags'):
+            with self.subTest(array=name):
+                column = getattr(loaded, name)
+                self.assertTrue(is_memory_mapped(column if name == 'product_ids' else column.buffer))
+        self.assertTrue(is_memory_mapped(loaded.matrix.data))
+        self.assertTrue(is_memory_mapped(loaded.postings.indices))
+        
+        for ranker in ('tfidf', 'bm25'):
+            for query in ('yoga', 'gym mat', 'yoga block'):
+                with self.subTest(ranker=ranker, query=query):
+                    rows, scores = loaded.top_k(loaded.transform([query], ranker), 5, ranker=ranker)
+                    expected_rows, expected_scores = index.top_k(index.transform([query], ranker), 5, ranker=ranker)
+                    np.testing.assert_array_equal(loaded.product_ids[rows], index.product_ids[expected_rows])
+                    np.testing.assert_allclose(scores, expected_scores, rtol=1e-6)
+                    self.assertEqual([loaded.fields(row) for row in rows], [index.fields(row) for row in expected_rows])
+    
+    def test_publishing_prunes_old_snapshots(self):
+        index = IntentIndex.build()
+        records = []
+        for i in range(3):
+            index.built_at = 1_700_000_000 + i
+            records.append(publish_snapshot(index))
+        
+        self.assertEqual(list(TFIDFIndex.objects.values_list('pk', flat=True)), [records[2].pk, records[1].pk])
+        self.assertFalse(Path(records[0].path).exists())
+        self.assertTrue(all(Path(record.path).exists() for record in records[1:]))
+    
+    def test_snapshots_of_another_format_are_rejected(self):
+        record = publish_snapshot(IntentIndex.build())
+        meta_path = Path(record.path) / 'meta.json'
+        meta = json.loads(meta_path.read_text())
+        meta['format'] = INDEX_FORMAT - 1
+        meta_path.write_text(json.dumps(meta))
+        self.assertIsNone(IntentIndex.load(record.path))
+        
+        # Workers fall back to fitting the catalog themselves
+        TFIDFIndex.objects.filter(pk=record.pk).update(format=INDEX_FORMAT - 1)
+        index = get_intent_index()
+        self.assertFalse(is_memory_mapped(index.matrix.data))
+        self.assertEqual(len(index), 3)
+    
+    def test_empty_catalog_publishes_nothing(self):
+        Product.objects.all().delete()
+        out = io.StringIO()
+        call_command('build_intent_index', stdout=out)
+        self.assertIn('nothing to publish', out.getvalue())
+        
+        with self.assertRaises(ValueError):
+            IntentIndex.build().save(self.directory / 'snapshot')
+        self.assertFalse(TFIDFIndex.objects.exists())
+        self.assertEqual(list(self.directory.iterdir()), [])
+    
+    def test_failed_saves_leave_no_files(self):
+        index = IntentIndex.build()
+        with mock.patch('ml_engine.intent_search.np.save', side_effect=OSError('No space left on device')):
+            with self.assertRaises(OSError):
+                publish_snapshot(index)
+        self.assertFalse(TFIDFIndex.objects.exists())
+        self.assertEqual(list(self.directory.iterdir()), [])
+    
+    def test_mismatched_bm25_postings_are_rejected_before_writing(self):
+        index = IntentIndex.build()
+        index.bm25 = copy.copy(index.bm25)
+        index.bm25.postings = index.bm25.postings[:, ::-1].tocsc()
+        with mock.patch.object(Path, 'mkdir') as mkdir, self.assertRaises(ValueError):
+            index.save(self.directory / 'snapshot')
+        mkdir.assert_not_called()
+    
+    @override_settings(INTENT_INDEX_CHECK_SECONDS=0)
+    def test_snapshot_of_an_older_catalog_is_caught_up(self):
+        publish_snapshot(IntentIndex.build())
+        Product.objects.create(name='Kettlebell', category=self.category, current_price=40, tags=['gym'])
+        
+        with mock.patch.object(IntentIndex, 'build', side_effect=AssertionError('rebuilt')):
+            index = get_intent_index()
+        self.assertTrue(is_memory_mapped(index.matrix.data))
+        self.assertEqual(index.version, catalog_version())
+        self.assertEqual(len(index), 4)
+
+
+class IntentTopKTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        words = ['yoga', 'mat', 'gym', 'bottle', 'knife', 'pan', 'chef', 'steel', 'cotton', 'mug']
+        catalog = [
+            (i, ' '.join(rng.choice(words, 3)), 'Misc', rng.choice(words, 2).tolist())
+            for i in range(1, 61)
+        ]
+        # Identical documents score the same for every query
+        catalog += [(i, 'Zafu Cushion', 'Fitness', ['meditation']) for i in (61, 62, 63)]
+        self.index = IntentBasedSearcher().build_intent_catalog(catalog)
+    
+    def assert_matches_dense(self, index, query, k, min_score=0.0):
+        """top_k agrees with the dense reference scores of every live row"""
+        query_vector = index.transform([query])
+        rows, scores = index.top_k(query_vector, k, min_score)
+        dense = index.scores(query_vector)
+        expected = np.sort(dense[index.live & (dense > min_score)])[::-1][:k]
+        
+        np.testing.assert_allclose(scores, expected, rtol=1e-5)
+        np.testing.assert_allclose(dense[rows], scores, rtol=1e-5)
+        self.assertTrue(index.live[rows].all())
+        self.assertEqual(len(set(rows.tolist())), len(rows))
+        return rows, scores
+    
+    def test_matches_dense_scores(self):
+        for query in ('yoga mat', 'chef knife steel', 'gym bottle', 'cotton'):
+            for k in (1, 5, 20):
+                with self.subTest(query=query, k=k):
+                    self.assert_matches_dense(self.index, query, k, min_score=0.1)
+    
+    def test_ties(self):
+        rows, scores = self.assert_matches_dense(self.index, 'zafu cushion', 2)
+        self.assertTrue(set(self.index.product_ids[rows].tolist()) < {61, 62, 63})
+        self.assertEqual(scores[0], scores[1])
+        
+        rows, _ = self.assert_matches_dense(self.index, 'zafu cushion', 3)
+        self.assertEqual(set(self.index.product_ids[rows].tolist()), {61, 62, 63})
+    
+    def test_k_larger_than_live_rows(self):
+        rows, _ = self.assert_matches_dense(self.index, 'yoga mat gym bottle knife pan chef steel cotton mug', 1000)
+        self.assertEqual(len(rows), 60)
+        rows, _ = self.assert_matches_dense(self.index, 'zafu', 1000)
+        self.assertEqual(len(rows), 3)
+    
+    def test_deleted_and_replaced_rows_are_skipped(self):
+        index = self.index.apply_changes([(62, 'Zafu Kettle', 'Kitchen', [])], deleted_ids=[61])
+        rows, _ = self.assert_matches_dense(index, 'zafu cushion', 1000)
+        self.assertEqual(sorted(index.product_ids[rows].tolist()), [62, 63])
+        # 62 is served from its delta row, its base row and the deleted row are masked out
+        self.assertIn(len(self.index.product_ids), rows)
+        self.assertEqual(index.live[60:63].tolist(), [False, False, True])
+    
+    def test_batch_matches_single_queries(self):
+        index = self.index.apply_changes([(5, 'Yoga Bottle', 'Fitness', ['gym'])], deleted_ids=[7])
+        queries = ['yoga mat', 'chef knife', 'zafu', 'gym bottle']
+        for ranker in ('tfidf', 'bm25'):
+            batch = index.top_k_batch(index.transform(queries, ranker), 5, 0.0, ranker)
+            for query, (rows, scores) in zip(queries, batch):
+                with self.subTest(ranker=ranker, query=query):
+                    single_rows, single_scores = index.top_k(index.transform([query], ranker), 5, 0.0, ranker)
+                    np.testing.assert_allclose(scores, single_scores, rtol=1e-5)
+                    # Rows tied with the k-th score may be picked either way
+                    above = scores > scores[-1] * (1 + 1e-5)
+                    self.assertEqual(set(rows[above].tolist()), set(single_rows[above].tolist()))
+
+
+class VectorCodecTests(TestCase):
+    def test_round_trip(self):
+        vectors = np.random.default_rng(0).random((6, FEATURE_DIM)).astype(np.float32)
+        dtypes = ['float32', 'float16', 'int8', 'float32', 'int8', 'float16']
+        blobs = [pack_vector(vector, dtype) for vector, dtype in zip(vectors, dtypes)]
+        
+        self.assertEqual([len(blob) for blob in blobs[:3]], [4 + 4 * FEATURE_DIM, 4 + 2 * FEATURE_DIM, 8 + FEATURE_DIM])
+        np.testing.assert_array_equal(unpack_vector(blobs[0]), vectors[0])
+        
+        # Mixed dtypes decode in one call, in order, within quantization error
+        decoded = unpack_vectors(blobs, FEATURE_DIM)
+        np.testing.assert_allclose(decoded, vectors, atol=1 / 127)
+    
+    def test_rejects_malformed_vectors(self):
+        with self.assertRaises(ValueError):
+            unpack_vectors([pack_vector(np.ones(FEATURE_DIM))[:-1]])
+        with self.assertRaises(ValueError):
+            unpack_vectors([pack_vector(np.ones(8))], FEATURE_DIM)
+
+
+class PerceptualHashTests(TestCase):
+    def encode(self, img, quality):
+        buffer = io.BytesIO()
+        Image.fromarray(img).save(buffer, 'JPEG', quality=quality)
+        return perceptual_hash(decode_reduced(buffer.getvalue(), 10 ** 8))
+    
+    def test_recompressed_copies_are_near_and_share_a_band(self):
+        rng = np.random.default_rng(0)
+        img = cv2.GaussianBlur(rng.integers(0, 256, size=(600, 800, 3), dtype=np.uint8), (51, 51), 0)
+        original, recompressed = self.encode(img, 95), self.encode(img, 60)
+        
+        self.assertLessEqual(hash_distance(original, recompressed), 3)
+        self.assertTrue(set(hash_bands(original, 3)) & set(hash_bands(recompressed, 3)))
+        self.assertGreater(hash_distance(original, self.encode(255 - img, 95)), 3)
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class IndexImagesCommandTests(TestCase):
+    """index_images against a local HTTP server serving fixture images"""
+    
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=self.directory.name))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        
+        self.checkpoint = self.root / 'checkpoint'
+        self.settings = override_settings(
+            IMAGE_INDEX_CHECKPOINT=self.checkpoint, IMAGE_CACHE_DIR=self.root / 'cache', IMAGE_FETCH_RETRIES=0
+        )
+        self.settings.enable()
+        
+        category = Category.objects.create(name='Fitness')
+        self.products = []
+        for i, colour in enumerate(['red', 'green', 'blue', 'green']):
+            if i < 3:
+                self.write_image(f'{colour}.png', colour)
+            url = f'http://127.0.0.1:{self.server.server_port}/{colour}.png'
+            self.products.append(Product.objects.create(
+                name=f'Product {i}', category=category, current_price=10, image_url=url
+            ))
+        Product.objects.create(
+            name='Missing image', category=category, current_price=10,
+            image_url=f'http://127.0.0.1:{self.server.server_port}/missing.png'
+        )
+    
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.settings.disable()
+        self.directory.cleanup()
+    
+    def write_image(self, name, colour, modified=None):
+        Image.new('RGB', (64, 48), colour).save(self.root / name)
+        if modified:
+            os.utime(self.root / name, (modified, modified))
+    
+    def index_images(self, *args):
+        out = io.StringIO()
+        call_command('index_images', '--processes', '0', '--batch-size', '2', *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+    
+    def test_indexes_changed_images_only(self):
+        output = self.index_images()
+        # The second product with the green image gets a 304 and reuses the vector stored for the first
+        self.assertIn('4 created, 0 updated, 0 unchanged, 1 failed (1 not modified, 3 extracted, 1 reused)', output)
+        self.assertFalse(self.checkpoint.exists())
+        
+        # Products sharing an image share its hash
+        hashes = dict(ImageFeatures.objects.values_list('product_id', 'image_hash'))
+        self.assertEqual(hashes[self.products[1].id], hashes[self.products[3].id])
+        
+        # Features match the single-image path
+        red = ImageFeatures.objects.get(product=self.products[0])
+        expected = VisualSearchEngine().process_image_from_url(self.products[0].image_url)
+        np.testing.assert_array_equal(unpack_vector(red.vector), expected)
+        
+        # Re-indexing revalidates with If-Modified-Since and only decodes the changed image
+        self.write_image('red.png', 'yellow', modified=time.time() + 60)
+        output = self.index_images()
+        self.assertIn('0 created, 1 updated, 3 unchanged, 1 failed (3 not modified, 1 extracted, 0 reused)', output)
+    
+    def test_resume_continues_after_checkpoint(self):
+        self.checkpoint.write_text(str(self.products[1].id))
+        output = self.index_images('--resume')
+        self.assertIn('2 created', output)
+        self.assertEqual(
+            set(ImageFeatures.objects.values_list('product_id', flat=True)),
+            {self.products[2].id, self.products[3].id}
+        )
+
+
+class PricePredictionBatchTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        category = Category.objects.create(name='Fitness')
+        today = timezone.now().date()
+        for i in range(8):
+            product = Product.objects.create(name=f'Product {i}', category=category, current_price=100 + i)
+            # Gappy histories, some reaching past the 60 day window, one too short and one flat
+            days = np.sort(rng.choice(70, size=3 if i == 0 else rng.integers(10, 60), replace=False))[::-1]
+            prices = np.full(len(days), 50.0) if i == 1 else 100 + 5 * i + 0.3 * days + rng.normal(0, 2, len(days))
+            for day, price in zip(days, prices):
+                row = PriceHistory.objects.create(product=product, price=round(float(price), 2))
+                # date is auto_now_add, so it is moved back afterwards (today's row comes last)
+                PriceHistory.objects.filter(id=row.id).update(date=today - timedelta(days=int(day)))
+    
+    def test_batch_matches_per_product_fits(self):
+        products = list(Product.objects.order_by('id').values_list('id', 'current_price'))
+        batch = dict(PricePredictor().predict_batch(products))
+        
+        for product in Product.objects.all():
+            single = PricePredictor().train_and_predict(product)
+            if single is None:
+                self.assertNotIn(product.id, batch)
+                continue
+            result = batch[product.id]
+            np.testing.assert_allclose(result['predictions'], single['predictions'], rtol=1e-9)
+            self.assertAlmostEqual(result['confidence'], single['confidence'], places=9)
+            self.assertAlmostEqual(result['price_change'], single['price_change'], places=9)
+            self.assertEqual(result['recommendation'], single['recommendation'])
+        self.assertEqual(len(batch), 7)
+    
+    def test_command_saves_every_forecast_in_one_insert(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(PRICE_FORECAST_CHECKPOINT=Path(directory) / 'checkpoint'):
+                # Product ids, then the chunk's products, history, insert and current prediction upsert
+                with self.assertNumQueries(5):
+                    call_command('predict_prices', stdout=io.StringIO())
+        self.assertEqual(PricePrediction.objects.count(), 7)
+    
+    def test_resume_skips_chunks_finished_today(self):
+        product_ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = Path(directory) / 'checkpoint'
+            checkpoint.write_text(json.dumps({
+                'date': timezone.now().date().isoformat(),
+                'days': 60,
+                'done': [[product_ids[0], product_ids[3]]],
+            }))
+            with override_settings(PRICE_FORECAST_CHECKPOINT=checkpoint):
+                out = io.StringIO()
+                call_command('predict_prices', resume=True, chunk_size=2, stdout=out)
+            self.assertFalse(checkpoint.exists())
+        
+        self.assertIn('Forecasting 4 products in 2 chunks', out.getvalue())
+        self.assertEqual(
+            set(PricePrediction.objects.values_list('product_id', flat=True)),
+            set(product_ids[4:])
+        )
+
+
+class PriceTrendTests(TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.category = Category.objects.create(name='Fitness')
+        self.today = timezone.now().date()
+    
+    def add_history(self, product, days):
+        prices = 100 + 0.4 * days + self.rng.normal(0, 2, len(days))
+        for day, price in zip(sorted(days, reverse=True), prices):
+            row = PriceHistory.objects.create(product=product, price=round(float(price), 2))
+            # date is auto_now_add, so it is moved back afterwards; the trends are rebuilt below
+            PriceHistory.objects.filter(id=row.id).update(date=self.today - timedelta(days=int(day)))
+    
+    def sums(self, product):
+        return PriceTrend.objects.filter(product=product).values_list('window_start', 'last_date', *SUM_FIELDS).get()
+    
+    def test_new_price_updates_the_sums_like_a_rebuild(self):
+        product = Product.objects.create(name='Kettlebell', category=self.category, current_price=120)
+        # Reaches past the window, so today's price expires the oldest ones
+        self.add_history(product, np.sort(self.rng.choice(np.arange(1, 90), size=50, replace=False)))
+        rebuild_trends(product.id, product.id)
+        
+        # The trend row, the expired prices and the update
+        with self.assertNumQueries(6):
+            PriceHistory.objects.create(product=product, price='131.25')
+        incremental = self.sums(product)
+        rebuild_trends(product.id, product.id)
+        rebuilt = self.sums(product)
+        
+        self.assertEqual(incremental[:3], rebuilt[:3])
+        np.testing.assert_allclose(incremental[3:], rebuilt[3:], rtol=1e-9)
+    
+    def test_trend_forecasts_match_history_forecasts_for_daily_prices(self):
+        for i in range(4):
+            product = Product.objects.create(name=f'Product {i}', category=self.category, current_price=100 + i)
+            self.add_history(product, np.arange(20 + 15 * i))
+        call_command('rebuild_price_trends', stdout=io.StringIO())
+        self.assert_same_forecasts()
+    
+    def test_trend_forecasts_match_history_forecasts_with_gaps(self):
+        products = []
+        for i in range(6):
+            product = Product.objects.create(name=f'Product {i}', category=self.category, current_price=100 + i)
+            # Missing days, histories reaching past the window, and newest prices up to 25 days old
+            self.add_history(product, np.sort(self.rng.choice(np.arange(5 * i, 90), size=25 + 5 * i, replace=False)))
+            products.append(product)
+        call_command('rebuild_price_trends', stdout=io.StringIO())
+        self.assert_same_forecasts()
+        
+        # Today's price expires the oldest prices of the incremental sums
+        PriceHistory.objects.create(product=products[3], price='131.25')
+        self.assert_same_forecasts()
+    
+    def assert_same_forecasts(self):
+        products = list(Product.objects.order_by('id').values_list('id', 'current_price'))
+        from_history = dict(PricePredictor().predict_batch(products))
+        from_trends = dict(PricePredictor().predict_from_trends(products[0][0], products[-1][0]))
+        
+        self.assertTrue(from_history)
+        self.assertEqual(from_trends.keys(), from_history.keys())
+        for product_id, result in from_trends.items():
+            np.testing.assert_allclose(result['predictions'], from_history[product_id]['predictions'], rtol=1e-9)
+            self.assertAlmostEqual(result['confidence'], from_history[product_id]['confidence'], places=9)
+            self.assertEqual(result['recommendation'], from_history[product_id]['recommendation'])
+    
+    def test_constant_prices_fit_perfectly(self):
+        x = np.arange(30, dtype=np.float64)
+        y = np.full(30, 1999.99)
+        fit = fit_sums(30, x.sum(), y.sum(), (x * y).sum(), (x * x).sum(), (y * y).sum())
+        self.assertAlmostEqual(float(fit['slope']), 0, places=6)
+        self.assertAlmostEqual(float(fit['intercept']), 1999.99, places=6)
+        self.assertEqual(float(fit['r2']), 1.0)
+
+
+class PredictionRetentionTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Fitness')
+        self.product = Product.objects.create(name='Kettlebell', category=category, current_price=145)
+        self.today = timezone.now().date()
+        # Rises by 1 a day from 100, 45 days ago
+        for day in range(45, -1, -1):
+            row = PriceHistory.objects.create(product=self.product, price=145 - day)
+            PriceHistory.objects.filter(id=row.id).update(date=self.today - timedelta(days=day))
+        for day in (40, 35, 10):
+            row = PricePrediction.objects.create(product=self.product, **{f'day{k}_price': 100 for k in range(1, 8)})
+            PricePrediction.objects.filter(id=row.id).update(prediction_date=self.today - timedelta(days=day))
+        result = {'predictions': [146.0] * 7, 'recommendation': 'neutral', 'confidence': 0.9, 'price_change': 0.7}
+        self.current, = PricePredictor().save_results([(self.product.id, result)])
+    
+    def test_same_day_forecasts_replace_each_other(self):
+        result = {'predictions': [150.0] * 7, 'recommendation': 'best_price', 'confidence': 0.8, 'price_change': 3.4}
+        replaced, = PricePredictor().save_results([(self.product.id, result)])
+        
+        self.assertEqual(replaced.id, self.current.id)
+        self.assertEqual(PricePrediction.objects.filter(prediction_date=self.today).count(), 1)
+        self.assertEqual(PricePrediction.objects.get(id=replaced.id).recommendation, 'best_price')
+        self.assertEqual(self.product.current_prediction.prediction_id, replaced.id)
+    
+    def test_old_forecasts_are_compacted_into_accuracy_sums(self):
+        call_command('compact_price_predictions', keep_days=30, stdout=io.StringIO())
+        # Compacting again finds nothing left to add
+        call_command('compact_price_predictions', keep_days=30, stdout=io.StringIO())
+        
+        self.assertEqual(
+            set(PricePrediction.objects.values_list('prediction_date', flat=True)),
+            {self.today - timedelta(days=10), self.today}
+        )
+        accuracy = PredictionAccuracy.objects.get(product=self.product)
+        self.assertEqual(accuracy.forecasts, 2)
+        self.assertEqual(accuracy.first_date, self.today - timedelta(days=40))
+        self.assertEqual(accuracy.last_date, self.today - timedelta(days=35))
+        self.assertEqual(accuracy.compared, [2] * 7)
+        # Made 40 and 35 days ago, day k was priced 105 + k and 110 + k
+        np.testing.assert_allclose(accuracy.abs_error_sum, [15 + 2 * k for k in range(1, 8)])
+        np.testing.assert_allclose(
+            accuracy.mean_absolute_percent_error(),
+            [((5 + k) / (105 + k) + (10 + k) / (110 + k)) * 50 for k in range(1, 8)]
+        )
+    
+    def test_current_prediction_is_kept(self):
+        PricePrediction.objects.filter(id=self.current.id).update(prediction_date=self.today - timedelta(days=60))
+        call_command('compact_price_predictions', keep_days=7, stdout=io.StringIO())
+        
+        self.assertEqual(list(PricePrediction.objects.values_list('id', flat=True)), [self.current.id])
+        self.assertEqual(PredictionAccuracy.objects.get(product=self.product).forecasts, 3)
+    
+    def test_rejects_windows_shorter_than_the_forecast(self):
+        with self.assertRaises(CommandError):
+            call_command('compact_price_predictions', keep_days=3, stdout=io.StringIO())
@@ -0,0 +1,89 @@
+"""
+Binary encoding of feature vectors stored in ImageFeatures.vector
+
+A packed vector is a 4-byte header (layout version, dtype code, dimension as
+little-endian uint16) followed by the values. int8 vectors carry a float32
+scale between header and values and are dequantized as int8 * scale.
+"""
+
+import numpy as np
+import struct
+
+LAYOUT_VERSION = 1
+HEADER = struct.Struct('<BBH')
+
+# dtype code -> (name, stored dtype)
+DTYPES = {
+    1: ('float32', np.dtype('<f4')),
+    2: ('float16', np.dtype('<f2')),
+    3: ('int8', np.dtype('i1')),
+}
+DTYPE_CODES = {name: code for code, (name, _) in DTYPES.items()}
+
+
+def pack_vector(vector: np.ndarray, dtype: str = 'float32') -> bytes:
+    """Encode a 1-d vector as header + values in the given storage dtype"""
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    code = DTYPE_CODES[dtype]
+    header = HEADER.pack(LAYOUT_VERSION, code, len(vector))
+    
+    if dtype == 'int8':
+        # Symmetric per-vector quantization
+        peak = float(np.abs(vector).max()) if len(vector) else 0.0
+        scale = peak / 127 if peak else 1.0
+        values = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        return header + struct.pack('<f', scale) + values.tobytes()
+    
+    return header + vector.astype(DTYPES[code][1]).tobytes()
+
+
+def unpack_vector(blob) -> np.ndarray:
+    """Decode one packed vector as float32"""
+    return unpack_vectors([blob])[0]
+
+
+def unpack_vectors(blobs: list, dim: int = None) -> np.ndarray:
+    """Decode packed vectors into one (n, dim) float32 matrix, in order
+    
+    Vectors of one storage dtype all have the same record length, so each
+    group is decoded with a single frombuffer over the joined bytes instead
+    of per-row parsing. Raises ValueError for malformed or mismatched rows.
+    """
+    if not blobs:
+        return np.empty((0, dim or 0), dtype=np.float32)
+    
+    lengths = np.fromiter((len(blob) for blob in blobs), dtype=np.int64, count=len(blobs))
+    matrix = None
+    for length in np.unique(lengths):
+        if length < HEADER.size:
+            raise ValueError('Vector shorter than its header')
+        rows = np.flatnonzero(lengths == length)
+        records = np.frombuffer(b''.join(blobs[i] for i in rows), dtype=np.uint8).reshape(len(rows), length)
+        
+        headers = np.ascontiguousarray(records[:, :HEADER.size]).view(np.dtype([
+            ('layout', 'u1'), ('code', 'u1'), ('dim', '<u2')
+        ])).ravel()
+        if (headers['layout'] != LAYOUT_VERSION).any():
+            raise ValueError('Unknown vector layout')
+        
+        for code in np.unique(headers['code']):
+            if code not in DTYPES:
+                raise ValueError(f'Unknown vector dtype code {code}')
+            name, stored = DTYPES[code]
+            group = headers['code'] == code
+            offset = HEADER.size + (4 if name == 'int8' else 0)
+            width = int(headers['dim'][group][0])
+            if (headers['dim'][group] != width).any() or offset + width * stored.itemsize != length:
+                raise ValueError('Vector length does not match its header')
+            if matrix is None:
+                matrix = np.empty((len(blobs), dim or width), dtype=np.float32)
+            if width != matrix.shape[1]:
+                raise ValueError(f'Expected {matrix.shape[1]}-dim vectors, got {width}')
+            
+            values = np.ascontiguousarray(records[group, offset:]).view(stored)
+            if name == 'int8':
+                scales = np.ascontiguousarray(records[group, HEADER.size:offset]).view('<f4')
+                values = values * scales
+            matrix[rows[group]] = values
+    
+    return matrix
@@ -1,118 +1,513 @@
 """
 Visual Search using Image Histograms (OpenCV-based)
 Extract features from images and find similar products
+
+The feature vectors of the catalog are held by every worker as one
+L2-normalized float32 matrix (see get_visual_index), refreshed when
+ImageFeatures rows change. With VISUAL_SEARCH_BACKEND = 'ivf' queries go
+through the published approximate index (ml_engine.ann) instead of scoring
+every row. Next to it sits a columnar snapshot of each product's category,
+price and stock, so filters are boolean masks applied before the top k.
 """
 
-import cv2
 import numpy as np
-import io
 from typing import List, Tuple
-import json
+from django.conf import settings
+from django.db.models import Count, Max
 from products.models import Product
 from ml_engine.models import ImageFeatures
-from sklearn.metrics.pairwise import cosine_similarity
-import requests
-from PIL import Image
+from ml_engine.vectors import pack_vector, unpack_vectors
+from ml_engine.ann import IVFIndex, ASSIGN_BLOCK, current_path
+from ml_engine.features import features_from_bytes, image_digest, hash_bands, hash_distance
+from ml_engine.image_fetch import fetch_image
+from ml_engine.extraction_pool import extract_upload
+from ml_engine.result_cache import ResultCache
+from ml_engine.intent_search import catalog_stats, catalog_version
+import copy
+import hashlib
+import threading
+import time
 
-class VisualSearchEngine:
-    def __init__(self):
-        """Initialize Visual Search Engine using histogram-based features"""
-        self.feature_dim = 256  # Histogram bins
+# Length of the HSV histogram vector: 64 bins for each of the 3 channels
+FEATURE_DIM = 192
+
+
+def features_stats() -> dict:
+    """Row count, highest id and latest update time of ImageFeatures"""
+    return ImageFeatures.objects.aggregate(
+        count=Count('id'),
+        last_id=Max('id'),
+        last_updated=Max('updated_at'),
+    )
+
+
+def features_version(stats: dict) -> str:
+    """Version stamp of the stored image features, changes when rows are added, edited or removed"""
+    raw = f"{stats['count']}:{stats['last_id']}:{stats['last_updated']}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def changes_since(queryset, id_field: str, known_ids: np.ndarray, watermark, count: int, load) -> tuple:
+    """(keep, changed) to bring a snapshot of the queryset's rows, holding known_ids, up to date
+    
+    changed is load() of the rows saved since watermark, with their ids as
+    its first item; keep marks the known ids neither changed nor deleted
+    since. Deletions leave no rows behind, so they are found by diffing the
+    ids only when the row count does not add up to count.
+    """
+    rows = queryset
+    if watermark is not None:
+        # Saves bump updated_at; >= re-reads rows saved in the same tick, which is harmless
+        rows = rows.filter(updated_at__gte=watermark)
+    changed = load(rows)
+    
+    keep = ~np.isin(known_ids, changed[0])
+    if keep.sum() + len(changed[0]) != count:
+        current_ids = np.fromiter(queryset.values_list(id_field, flat=True), dtype=np.int64)
+        keep &= np.isin(known_ids, current_ids)
+    return keep, changed
+
+
+class ProductColumns:
+    """Category, price and stock of every product as arrays sorted by product id"""
+    
+    def __init__(self, ids, category_ids, prices, stock, version: str = '', watermark=None):
+        self.ids = ids
+        self.category_ids = category_ids
+        self.prices = prices
+        self.stock = stock
+        self.version = version
+        self.watermark = watermark
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    @staticmethod
+    def _arrays(rows) -> tuple:
+        rows = sorted(rows)
+        return (
+            np.array([row[0] for row in rows], dtype=np.int64),
+            np.array([row[1] for row in rows], dtype=np.int64),
+            np.array([float(row[2]) for row in rows], dtype=np.float64),
+            np.array([row[3] for row in rows], dtype=np.int64),
+        )
+    
+    @staticmethod
+    def _rows(queryset) -> list:
+        return list(queryset.values_list('id', 'category_id', 'current_price', 'stock'))
+    
+    @classmethod
+    def build(cls, stats: dict = None):
+        """Load every product"""
+        stats = stats or catalog_stats()
+        return cls(*cls._arrays(cls._rows(Product.objects.all())), catalog_version(stats), stats['last_updated'])
+    
+    def catch_up(self, stats: dict):
+        """Return a copy with the products changed since it was loaded replaced"""
+        keep, changed = changes_since(
+            Product.objects.all(), 'id', self.ids, self.watermark, stats['count'],
+            lambda rows: self._arrays(self._rows(rows))
+        )
+        
+        ids = np.concatenate([self.ids[keep], changed[0]])
+        order = np.argsort(ids, kind='stable')
+        columns = [ids] + [
+            np.concatenate([column[keep], changed_column])
+            for column, changed_column in zip((self.category_ids, self.prices, self.stock), changed[1:])
+        ]
+        return ProductColumns(*(column[order] for column in columns), catalog_version(stats), stats['last_updated'])
+    
+    def rows_of(self, product_ids: np.ndarray) -> np.ndarray:
+        """Position of each product id, -1 for unknown products"""
+        positions = np.searchsorted(self.ids, product_ids)
+        positions[positions >= len(self.ids)] = 0
+        found = len(self.ids) > 0 and self.ids[positions] == product_ids
+        return np.where(found, positions, -1)
+
+
+class VisualIndex:
+    """L2-normalized feature vectors of the indexed product images, with the product id of each row
+    
+    A query is one matrix-vector product over the contiguous matrix followed
+    by a partial selection of the top k.
     
-    def extract_features(self, image_bytes):
-        """Extract histogram features from image"""
+    With an approximate index attached, rows it does not hold as they are now
+    (added or re-indexed since it was trained) are `uncovered`: they are
+    scored exactly and merged with its candidates, so results stay current
+    between rebuilds.
+    
+    `row_columns` holds the category, price and stock of each row's product
+    (from `catalog`) for filter masks.
+    """
+    
+    def __init__(self, vectors: np.ndarray, product_ids: np.ndarray, version: str = '', watermark=None):
+        self.vectors = vectors
+        self.product_ids = product_ids
+        self.version = version
+        self.watermark = watermark
+        self.ann = None
+        self.uncovered = None
+        self.uncovered_rows = None
+        self.covered_ids = None
+        self.checked_at = time.monotonic()
+        self.catalog = None
+        self.row_columns = None
+        self._order = None  # Row order sorting product_ids, built on first rows_of
+    
+    def __len__(self):
+        return len(self.product_ids)
+    
+    def rows_of(self, product_ids: np.ndarray) -> np.ndarray:
+        """Row holding each product's vector, -1 for products that are not indexed"""
+        if self._order is None:
+            self._order = np.argsort(self.product_ids, kind='stable')
+        if not len(self):
+            return np.full(len(product_ids), -1, dtype=np.int64)
+        positions = np.searchsorted(self.product_ids, product_ids, sorter=self._order)
+        rows = self._order[np.minimum(positions, len(self) - 1)]
+        return np.where(self.product_ids[rows] == product_ids, rows, -1)
+    
+    def row_of(self, product_id: int):
+        """Row holding the product's vector, or None"""
+        row = int(self.rows_of(np.array([product_id], dtype=np.int64))[0])
+        return None if row < 0 else row
+    
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        """Rows scaled to unit length, all-zero rows are left as they are"""
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return np.ascontiguousarray(vectors / np.where(norms > 0, norms, 1), dtype=np.float32)
+    
+    @staticmethod
+    def _decode_rows(rows) -> tuple:
+        """(product ids, normalized vectors) of (product id, packed vector) rows, malformed rows are skipped"""
+        product_ids = [product_id for product_id, _ in rows]
+        blobs = [blob for _, blob in rows]
         try:
-            # Convert bytes to numpy array
-            if isinstance(image_bytes, bytes):
-                nparr = np.frombuffer(image_bytes, np.uint8)
-                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            else:
-                # If PIL Image
-                img = cv2.cvtColor(np.array(image_bytes), cv2.COLOR_RGB2BGR)
-            
-            if img is None:
-                return None
-            
-            # Resize for consistent feature extraction
-            img = cv2.resize(img, (224, 224))
-            
-            # Convert to HSV for better color representation
-            hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-            
-            # Extract histogram features from each channel
-            hist_h = cv2.calcHist([hsv], [0], None, [64], [0, 256])
-            hist_s = cv2.calcHist([hsv], [1], None, [64], [0, 256])
-            hist_v = cv2.calcHist([hsv], [2], None, [64], [0, 256])
-            
-            # Normalize histograms
-            hist_h = cv2.normalize(hist_h, hist_h).flatten()
-            hist_s = cv2.normalize(hist_s, hist_s).flatten()
-            hist_v = cv2.normalize(hist_v, hist_v).flatten()
-            
-            # Combine all features
-            features = np.concatenate([hist_h, hist_s, hist_v])
-            
-            return features.astype(np.float32)
+            vectors = unpack_vectors(blobs, FEATURE_DIM)
+        except ValueError:
+            # Decode row by row to drop the bad ones
+            decoded = []
+            for product_id, blob in rows:
+                try:
+                    decoded.append((product_id, unpack_vectors([blob], FEATURE_DIM)[0]))
+                except ValueError:
+                    continue
+            product_ids = [product_id for product_id, _ in decoded]
+            vectors = np.array([vector for _, vector in decoded], dtype=np.float32).reshape(-1, FEATURE_DIM)
+        return np.array(product_ids, dtype=np.int64), VisualIndex.normalize(vectors)
+    
+    @classmethod
+    def build(cls, stats: dict = None):
+        """Load every stored feature vector"""
+        # Read the stats before loading so rows saved meanwhile are caught up later
+        stats = stats or features_stats()
+        product_ids, vectors = cls._decode_rows(list(ImageFeatures.objects.values_list('product_id', 'vector')))
+        return cls(vectors, product_ids, features_version(stats), stats['last_updated'])
+    
+    def catch_up(self, stats: dict):
+        """Return a copy of the index with the rows changed since it was loaded replaced"""
+        keep, (changed_ids, changed) = changes_since(
+            ImageFeatures.objects.all(), 'product_id', self.product_ids, self.watermark, stats['count'],
+            lambda rows: self._decode_rows(list(rows.values_list('product_id', 'vector')))
+        )
+        
+        index = VisualIndex(
+            np.concatenate([self.vectors[keep], changed]),
+            np.concatenate([self.product_ids[keep], changed_ids]),
+            features_version(stats),
+            stats['last_updated'],
+        )
+        if self.ann is not None:
+            index._set_coverage(self.ann, np.concatenate([self.uncovered[keep], np.ones(len(changed_ids), dtype=bool)]))
+        return index
+    
+    def with_ann(self, ann: IVFIndex):
+        """Copy of the index serving queries through an approximate index, compared row by row with it"""
+        order = np.argsort(ann.product_ids)
+        positions = np.searchsorted(ann.product_ids, self.product_ids, sorter=order)
+        rows = np.flatnonzero(positions < len(order))
+        ann_rows = order[positions[rows]]
+        
+        # A row is covered if the approximate index holds its product with the same vector
+        uncovered = np.ones(len(self), dtype=bool)
+        for start in range(0, len(rows), ASSIGN_BLOCK):
+            block, ann_block = rows[start:start + ASSIGN_BLOCK], ann_rows[start:start + ASSIGN_BLOCK]
+            same = (ann.product_ids[ann_block] == self.product_ids[block]) & np.all(
+                ann.vectors[ann_block] == self.vectors[block], axis=1
+            )
+            uncovered[block[same]] = False
+        
+        index = copy.copy(self)
+        index._set_coverage(ann, uncovered)
+        return index
+    
+    def with_catalog(self, catalog: ProductColumns):
+        """Copy of the index with the catalog columns aligned to its rows"""
+        positions = catalog.rows_of(self.product_ids)
+        found = positions >= 0
+        
+        def aligned(column, missing):
+            if not len(catalog):
+                return np.full(len(self), missing, dtype=column.dtype)
+            return np.where(found, column[positions], missing)
+        
+        index = copy.copy(self)
+        index.catalog = catalog
+        index.row_columns = ProductColumns(
+            self.product_ids,
+            aligned(catalog.category_ids, -1),
+            aligned(catalog.prices, np.nan),
+            aligned(catalog.stock, 0),
+        )
+        return index
+    
+    def filter_mask(self, category: int = None, min_price: float = None, max_price: float = None,
+                    in_stock: bool = False):
+        """Rows whose product passes every given filter, None when no filter is given"""
+        columns = self.row_columns
+        conditions = []
+        if category is not None:
+            conditions.append(columns.category_ids == category)
+        if min_price is not None:
+            conditions.append(columns.prices >= min_price)
+        if max_price is not None:
+            conditions.append(columns.prices <= max_price)
+        if in_stock:
+            conditions.append(columns.stock > 0)
+        return np.logical_and.reduce(conditions) if conditions else None
+    
+    def _set_coverage(self, ann: IVFIndex, uncovered: np.ndarray):
+        self.ann = ann
+        self.uncovered = uncovered
+        self.uncovered_rows = np.flatnonzero(uncovered)
+        self.covered_ids = np.sort(self.product_ids[~uncovered])
+    
+    @staticmethod
+    def _top(candidates, scores, k: int) -> tuple:
+        """k best (candidate, score) pairs, best first, by partial selection"""
+        if len(scores) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            candidates, scores = candidates[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return candidates[order], scores[order]
+    
+    def search(self, features: np.ndarray, k: int, n_probe: int = None, mask: np.ndarray = None) -> tuple:
+        """Product ids and cosine similarities of the k closest rows, best first
+        
+        With a mask only its rows are candidates, so filtered searches still
+        return k hits whenever k rows pass.
+        """
+        if not len(self):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        
+        query = self.normalize(np.asarray(features, dtype=np.float32))
+        rows = None if mask is None else np.flatnonzero(mask)
+        if self.ann is None:
+            return self.exact_search(query, k, rows)
+        if rows is not None and len(rows) <= settings.VISUAL_FILTER_EXACT_ROWS:
+            # Few products pass the filters: scoring them beats probing lists for them
+            return self._top(self.product_ids[rows], self.vectors[rows] @ query, k)
+        
+        uncovered_rows = self.uncovered_rows if mask is None else self.uncovered_rows[mask[self.uncovered_rows]]
+        # Over-fetch since some candidates may have been deleted or re-indexed since training,
+        # and probe further while too few of them pass the filters
+        fetch, n_probe = 2 * k, n_probe or settings.VISUAL_IVF_PROBES
+        while True:
+            ann_ids, ann_scores = self.ann.search(query, fetch, n_probe)
+            positions = np.searchsorted(self.covered_ids, ann_ids)
+            valid = positions < len(self.covered_ids)
+            valid[valid] = self.covered_ids[positions[valid]] == ann_ids[valid]
+            if mask is None:
+                break
+            valid[valid] = mask[self.rows_of(ann_ids[valid])]
+            exhausted = n_probe >= self.ann.n_lists and len(ann_ids) < fetch
+            if valid.sum() + len(uncovered_rows) >= k or exhausted:
+                break
+            fetch, n_probe = fetch * 2, min(n_probe * 2, self.ann.n_lists)
+        
+        return self._top(
+            np.concatenate([ann_ids[valid], self.product_ids[uncovered_rows]]),
+            np.concatenate([ann_scores[valid], self.vectors[uncovered_rows] @ query]),
+            k,
+        )
+    
+    def exact_search(self, query: np.ndarray, k: int, rows: np.ndarray = None) -> tuple:
+        """Brute-force search over every row (or the given rows), the reference for the approximate path"""
+        scores = self.vectors @ query
+        if rows is None:
+            return self._top(self.product_ids, scores, k)
+        return self._top(self.product_ids[rows], scores[rows], k)
+    
+    def neighbours(self, k: int, block_size: int):
+        """Yield (rows, neighbour rows, similarities) giving the k closest other rows of every row, best first
+        
+        Rows are taken block_size at a time: each block is one
+        (block_size x N) matrix product followed by a partial selection per
+        row, so memory stays bounded by the block instead of N x N.
+        """
+        k = min(k, len(self) - 1)
+        for start in range(0, len(self), block_size):
+            rows = np.arange(start, min(start + block_size, len(self)))
+            scores = self.vectors[rows] @ self.vectors.T
+            scores[rows - start, rows] = -np.inf  # A product is not its own neighbour
             
-        except Exception as e:
-            print(f"Error extracting features: {e}")
-            return None
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k > 0 else np.empty((len(rows), 0), dtype=np.int64)
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            order = np.argsort(-best_scores, axis=1, kind='stable')
+            yield rows, np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+_visual_index = None
+_visual_lock = threading.Lock()
+
+# Top-k [product id, similarity] pairs of uploads, by visual index version + image sha256 or perceptual hash band
+result_cache = ResultCache(
+    'visual',
+    timeout=settings.VISUAL_CACHE_SECONDS,
+    negative_timeout=settings.VISUAL_CACHE_NEGATIVE_SECONDS,
+    lru_size=settings.VISUAL_CACHE_LRU_SIZE,
+)
+
+
+def get_visual_index() -> VisualIndex:
+    """Return the process-wide visual index, catching up with ImageFeatures changes as needed"""
+    global _visual_index
     
+    index = _visual_index
+    if index is not None and time.monotonic() - index.checked_at < settings.VISUAL_INDEX_CHECK_SECONDS:
+        return index
+    
+    with _visual_lock:
+        index = _visual_index
+        if index is not None and time.monotonic() - index.checked_at < settings.VISUAL_INDEX_CHECK_SECONDS:
+            return index
+        
+        catalog = index.catalog if index is not None else None
+        stats = features_stats()
+        if index is None:
+            index = VisualIndex.build(stats)
+        elif index.version != features_version(stats):
+            index = index.catch_up(stats)
+        
+        if settings.VISUAL_SEARCH_BACKEND == 'ivf':
+            path = current_path(settings.VISUAL_ANN_DIR)
+            if path is not None and (index.ann is None or index.ann.path != path):
+                ann = IVFIndex.load(path)
+                if ann is not None:
+                    index = index.with_ann(ann)
+        
+        product_stats = catalog_stats()
+        if catalog is None:
+            catalog = ProductColumns.build(product_stats)
+        elif catalog.version != catalog_version(product_stats):
+            catalog = catalog.catch_up(product_stats)
+        if index.catalog is not catalog:
+            index = index.with_catalog(catalog)
+        
+        index.checked_at = time.monotonic()
+        _visual_index = index
+        return index
+
+
+def request_visual_index_refresh():
+    """Make the next visual search in this process catch up instead of waiting for the check interval"""
+    index = _visual_index
+    if index is not None:
+        index.checked_at = float('-inf')
+
+
+def invalidate_visual_index():
+    """Drop the in-process visual index so the next search reloads it"""
+    global _visual_index
+    with _visual_lock:
+        _visual_index = None
+
+
+class VisualSearchEngine:
     def process_image_from_url(self, image_url: str):
         """Download and process image from URL"""
         try:
-            response = requests.get(image_url, timeout=10)
-            image = Image.open(io.BytesIO(response.content)).convert('RGB')
-            return self.extract_features(image)
+            return features_from_bytes(fetch_image(image_url))
         except Exception as e:
             print(f"Error processing image: {e}")
             return None
     
-    def process_image_from_upload(self, image_file):
-        """Process uploaded image file"""
-        try:
-            image = Image.open(image_file).convert('RGB')
-            return self.extract_features(image)
-        except Exception as e:
-            print(f"Error processing image: {e}")
-            return None
-    
-    def find_similar_products(self, features: np.ndarray, top_k: int = 5) -> List[Tuple[Product, float]]:
-        """Find similar products based on image features"""
-        
-        # Get all product features from database
-        all_features = ImageFeatures.objects.all()
-        
-        if not all_features.exists():
-            return []
+    def find_similar_products(self, features: np.ndarray, top_k: int = 5, filters: dict = None) -> List[Tuple[Product, float]]:
+        """Find similar products based on image features, among those passing the VisualIndex.filter_mask filters"""
         
-        # Stack all features
-        catalog_features = []
-        products = []
+        index = get_visual_index()
+        product_ids, similarities = index.search(features, top_k, mask=index.filter_mask(**(filters or {})))
+        return self.load_products(product_ids.tolist(), similarities)
+    
+    def find_similar_to_upload(self, image_bytes: bytes, top_k: int = 5, filters: dict = None) -> tuple:
+        """(results, cache match, timings in ms) of an uploaded image
         
-        for img_feat in all_features:
-            try:
-                feat_vector = np.array(json.loads(img_feat.features_vector))
-                catalog_features.append(feat_vector)
-                products.append(img_feat.product)
-            except:
-                continue
+        Results are cached under the visual index version, so they expire with
+        any ImageFeatures change. They are keyed by the sha256 of the upload,
+        letting a re-upload of the same file skip decoding, and by the bands of
+        its perceptual hash, so re-encoded or resized copies within
+        VISUAL_CACHE_MAX_DISTANCE bits share results. cache match is 'exact',
+        'perceptual' or None; errors of extract_upload are raised.
         
-        if not catalog_features:
-            return []
+        Filtered results also depend on the catalog version, since prices and
+        stock change without the image features changing.
+        """
+        index = get_visual_index()
+        filters = {name: value for name, value in (filters or {}).items() if value not in (None, False)}
+        mask = index.filter_mask(**filters)
+        namespace = f"{index.version}:{top_k}"
+        if filters:
+            namespace += f":{index.catalog.version}:{sorted(filters.items())}"
+        exact_key = f"{namespace}:sha256:{image_digest(image_bytes)}"
+        cached = result_cache.get_many([exact_key])
+        if exact_key in cached:
+            return self._cached_results(cached[exact_key]), 'exact', {}
         
-        catalog_features = np.array(catalog_features)
+        features, image_hash, timings = extract_upload(image_bytes)
+        max_distance = settings.VISUAL_CACHE_MAX_DISTANCE
+        band_keys = [f"{namespace}:phash:{band}" for band in hash_bands(image_hash, max_distance)]
+        near = [
+            (hash_distance(entry['hash'], image_hash), entry['results'])
+            for entry in result_cache.get_many(band_keys).values()
+        ]
+        near = [(distance, pairs) for distance, pairs in near if distance <= max_distance]
+        if near:
+            pairs = min(near, key=lambda entry: entry[0])[1]
+            result_cache.set_many({exact_key: pairs})
+            return self._cached_results(pairs), 'perceptual', timings
         
-        # Calculate cosine similarity
-        query_features = features.reshape(1, -1)
-        similarities = cosine_similarity(query_features, catalog_features)[0]
+        started = time.perf_counter()
+        product_ids, similarities = index.search(features, top_k, mask=mask)
+        timings['search_ms'] = (time.perf_counter() - started) * 1000
+        pairs = [[product_id, float(similarity)] for product_id, similarity in zip(product_ids.tolist(), similarities)]
+        result_cache.set_many({exact_key: pairs, **{key: {'hash': image_hash, 'results': pairs} for key in band_keys}})
+        return self._cached_results(pairs), None, timings
+    
+    def _cached_results(self, pairs: list) -> list:
+        return self.load_products([product_id for product_id, _ in pairs], [similarity for _, similarity in pairs])
+    
+    def find_similar_to_product(self, product_id: int, top_k: int = 5):
+        """Products closest to a product's stored image, None if its image is not indexed"""
+        index = get_visual_index()
+        row = index.row_of(product_id)
+        if row is None:
+            return None
         
-        # Get top-k most similar
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
+        product_ids, similarities = index.search(index.vectors[row], top_k + 1)
+        keep = product_ids != product_id
+        return self.load_products(product_ids[keep][:top_k].tolist(), similarities[keep][:top_k])
+    
+    @staticmethod
+    def load_products(product_ids: list, similarities) -> List[Tuple[Product, float]]:
+        """(product, similarity) pairs in the given order"""
+        # One query for all matched products, ones deleted since loading are skipped
+        products = Product.objects.select_related('category').in_bulk(product_ids)
         
         results = [
-            (products[idx], float(similarities[idx]))
-            for idx in top_indices
+            (products[product_id], float(similarity))
+            for product_id, similarity in zip(product_ids, similarities)
+            if product_id in products
         ]
         
         return results
@@ -122,22 +517,23 @@ class VisualSearchEngine:
         if not product.image_url:
             return None
         
-        features = self.process_image_from_url(product.image_url)
+        try:
+            image_bytes = fetch_image(product.image_url)
+        except Exception as e:
+            print(f"Error processing image: {e}")
+            return None
+        
+        features = features_from_bytes(image_bytes)
         
         if features is None:
             return None
         
         # Save features to database
-        import hashlib
-        image_hash = hashlib.sha256(
-            json.dumps(features.tolist()).encode()
-        ).hexdigest()
-        
         img_feat_obj, created = ImageFeatures.objects.get_or_create(
             product=product,
             defaults={
-                'features_vector': json.dumps(features.tolist()),
-                'image_hash': image_hash
+                'vector': pack_vector(features, settings.VISUAL_FEATURE_DTYPE),
+                'image_hash': image_digest(image_bytes)
             }
         )
         
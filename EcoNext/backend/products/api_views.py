@@ -1,6 +1,9 @@
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
+from django.db.models import F
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from datetime import timedelta
@@ -10,11 +13,18 @@ from products.serializers import (
     CategorySerializer, PriceHistorySerializer
 )
 from ml_engine.price_predictor import PricePredictor
-from ml_engine.intent_search import IntentBasedSearcher
+from ml_engine.intent_search import IntentBasedSearcher, RANKERS
+from ml_engine.suggest import get_suggest_index
 from ml_engine.visual_search import VisualSearchEngine
-from ml_engine.models import PricePrediction
+from ml_engine.extraction_pool import ExtractionPoolBusy
+from ml_engine.features import ImageTooLarge
+from ml_engine.models import CurrentPrediction, VisualNeighbours
 from accounts.models import ActivityLog
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 # ============ Product Endpoints ============
 
@@ -44,11 +54,23 @@ def product_list(request):
         )
 
 
+def current_prediction(product):
+    """Newest PricePrediction of a product fetched with select_related('current_prediction__prediction'), or None"""
+    try:
+        return product.current_prediction.prediction
+    except CurrentPrediction.DoesNotExist:
+        return None
+
+
 @api_view(['GET'])
 def product_detail(request, product_id):
     """Get single product with price prediction"""
     try:
-        product = get_object_or_404(Product, id=product_id)
+        # Product, category and newest price prediction in one query
+        product = get_object_or_404(
+            Product.objects.select_related('category', 'current_prediction__prediction'),
+            id=product_id
+        )
         
         # Log view activity
         if request.user.is_authenticated:
@@ -58,23 +80,13 @@ def product_detail(request, product_id):
                 product=product
             )
         
-        # Get latest price prediction
-        prediction = PricePrediction.objects.filter(product=product).latest('prediction_date')
-        prediction_serializer = PricePredictionSerializer(prediction)
-        
+        prediction = current_prediction(product)
         product_serializer = ProductSerializer(product)
         
         return Response({
             'status': 'success',
             'product': product_serializer.data,
-            'price_prediction': prediction_serializer.data
-        })
-    except PricePrediction.DoesNotExist:
-        product_serializer = ProductSerializer(product)
-        return Response({
-            'status': 'success',
-            'product': product_serializer.data,
-            'price_prediction': None
+            'price_prediction': PricePredictionSerializer(prediction).data if prediction else None
         })
     except Exception as e:
         return Response(
@@ -89,6 +101,7 @@ def product_detail(request, product_id):
 def intent_search(request):
     """Smart intent-based search"""
     query = request.GET.get('q', '').strip()
+    ranker = request.GET.get('ranker', settings.INTENT_SEARCH_RANKER)
     
     if not query:
         return Response(
@@ -96,13 +109,19 @@ def intent_search(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
+    if ranker not in RANKERS:
+        return Response(
+            {'error': f"Unknown ranker, use one of: {', '.join(RANKERS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
     try:
         # Log search
         ProductSearch.objects.create(query=query)
         
         # Perform search
         searcher = IntentBasedSearcher()
-        categories = searcher.get_category_recommendations(query)
+        categories = searcher.get_category_recommendations(query, ranker)
         
         results = {}
         for category, products_data in categories.items():
@@ -111,6 +130,8 @@ def intent_search(request):
         return Response({
             'status': 'success',
             'query': query,
+            'did_you_mean': searcher.did_you_mean(query),
+            'ranker': ranker,
             'results': results,
             'total_found': sum(len(v) for v in results.values())
         })
@@ -121,6 +142,105 @@ def intent_search(request):
         )
 
 
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def intent_search_batch(request):
+    """Intent search for many queries in one call, e.g. several carousels on a landing page"""
+    queries = request.data.get('queries')
+    ranker = request.data.get('ranker', settings.INTENT_SEARCH_RANKER)
+    
+    if not isinstance(queries, list) or not queries:
+        return Response(
+            {'error': 'A non-empty list of queries is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if not all(isinstance(query, str) for query in queries):
+        return Response(
+            {'error': 'Search queries must be strings'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    queries = [query.strip() for query in queries]
+    if not all(queries):
+        return Response(
+            {'error': 'Search queries must not be empty'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if len(queries) > settings.INTENT_BATCH_MAX_QUERIES:
+        return Response(
+            {'error': f'At most {settings.INTENT_BATCH_MAX_QUERIES} queries per batch'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if ranker not in RANKERS:
+        return Response(
+            {'error': f"Unknown ranker, use one of: {', '.join(RANKERS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        # Log searches
+        ProductSearch.objects.bulk_create([ProductSearch(query=query) for query in queries])
+        
+        # Perform all searches with one vectorizer call and one sparse product
+        searcher = IntentBasedSearcher()
+        recommendations = searcher.get_category_recommendations_batch(queries, ranker)
+        
+        corrections = searcher.did_you_mean_batch(queries)
+        
+        batch_results = []
+        for query, categories, correction in zip(queries, recommendations, corrections):
+            results = {}
+            for category, products_data in categories.items():
+                results[category] = SearchResultSerializer(products_data, many=True).data
+            
+            batch_results.append({
+                'query': query,
+                'did_you_mean': correction,
+                'results': results,
+                'total_found': sum(len(v) for v in results.values())
+            })
+        
+        return Response({
+            'status': 'success',
+            'results': batch_results
+        })
+    except Exception as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+@api_view(['GET'])
+def search_suggest(request):
+    """Autocomplete the search box from popular searches, product names and tags"""
+    query = request.GET.get('q', '').strip()
+    
+    if not query:
+        return Response(
+            {'error': 'Search query required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        limit = int(request.GET.get('limit', settings.SUGGEST_MAX_RESULTS))
+        
+        # Served from process memory, keystrokes are not logged as searches
+        return Response({
+            'status': 'success',
+            'query': query,
+            'suggestions': get_suggest_index().suggest(query, max(limit, 1))
+        })
+    except Exception as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+
 @api_view(['GET'])
 def category_browse(request):
     """Browse by category"""
@@ -152,10 +272,14 @@ def category_browse(request):
 def price_prediction(request, product_id):
     """Get 7-day price prediction for product"""
     try:
-        product = get_object_or_404(Product, id=product_id)
+        product = get_object_or_404(Product.objects.select_related('current_prediction__prediction'), id=product_id)
         
-        # Try to get existing prediction
-        prediction = PricePrediction.objects.filter(product=product).latest('prediction_date')
+        prediction = current_prediction(product)
+        if prediction is None:
+            return Response(
+                {'error': 'No prediction available yet', 'prediction': None},
+                status=status.HTTP_404_NOT_FOUND
+            )
         
         serializer = PricePredictionSerializer(prediction)
         
@@ -163,11 +287,6 @@ def price_prediction(request, product_id):
             'status': 'success',
             'prediction': serializer.data
         })
-    except PricePrediction.DoesNotExist:
-        return Response(
-            {'error': 'No prediction available yet', 'prediction': None},
-            status=status.HTTP_404_NOT_FOUND
-        )
     except Exception as e:
         return Response(
             {'error': str(e)},
@@ -175,9 +294,22 @@ def price_prediction(request, product_id):
         )
 
 
+def visual_search_filters(params) -> dict:
+    """category, min_price, max_price and in_stock filters of a visual search, raises ValueError on bad values"""
+    filters = {}
+    if params.get('category') not in (None, ''):
+        filters['category'] = int(params['category'])
+    for name in ('min_price', 'max_price'):
+        if params.get(name) not in (None, ''):
+            filters[name] = float(params[name])
+    if str(params.get('in_stock', '')).lower() in ('1', 'true', 'yes'):
+        filters['in_stock'] = True
+    return filters
+
+
 @api_view(['POST'])
 def visual_search(request):
-    """Search by image upload"""
+    """Search by image upload, optionally only among products of a category, price range or in stock"""
     try:
         if 'image' not in request.FILES:
             return Response(
@@ -186,19 +318,44 @@ def visual_search(request):
             )
         
         image_file = request.FILES['image']
-        
-        # Extract features
         engine = VisualSearchEngine()
-        features = engine.process_image_from_upload(image_file)
         
-        if features is None:
+        try:
+            filters = visual_search_filters(request.data)
+        except ValueError:
             return Response(
-                {'error': 'Could not process image'},
+                {'error': 'category must be an id, min_price and max_price numbers'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Find similar products
-        similar_products = engine.find_similar_products(features, top_k=10)
+        # Extract features in the extraction pool, decoded at reduced resolution, unless the results are cached
+        try:
+            similar_products, cache_match, timings = engine.find_similar_to_upload(
+                image_file.read(), top_k=10, filters=filters
+            )
+        except ExtractionPoolBusy:
+            return Response(
+                {'error': 'Visual search is busy, please retry shortly'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(settings.VISUAL_RETRY_AFTER_SECONDS)}
+            )
+        except ImageTooLarge as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        except FuturesTimeoutError:
+            return Response(
+                {'error': 'Image processing timed out'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(settings.VISUAL_RETRY_AFTER_SECONDS)}
+            )
+        except Exception:
+            logger.exception("Error processing image")
+            return Response(
+                {'error': 'Could not process image'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         results = [
             {
@@ -211,7 +368,61 @@ def visual_search(request):
         return Response({
             'status': 'success',
             'results': results,
-            'total_found': len(results)
+            'total_found': len(results),
+            'cache_hit': cache_match is not None,
+            'cache_match': cache_match,
+            'timings': {stage: round(ms, 2) for stage, ms in timings.items()}
+        })
+    except Exception as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+@api_view(['GET'])
+def similar_visual(request, product_id):
+    """Products that look like this one
+    
+    Served from the neighbours precomputed by precompute_visual_neighbours in
+    one indexed read; products indexed or re-indexed since that run are looked
+    up in the in-memory feature matrix instead.
+    """
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 10)), settings.VISUAL_NEIGHBOURS_K))
+        engine = VisualSearchEngine()
+        
+        neighbours = VisualNeighbours.objects.filter(product_id=product_id).annotate(
+            features_updated_at=F('product__image_features_model__updated_at')
+        ).first()
+        if (neighbours is not None and neighbours.features_updated_at is not None
+                and neighbours.features_updated_at <= neighbours.computed_at):
+            similar_products = engine.load_products(neighbours.product_ids[:limit], neighbours.scores[:limit])
+            source = 'precomputed'
+        else:
+            similar_products = engine.find_similar_to_product(product_id, top_k=limit)
+            source = 'live'
+        
+        if similar_products is None:
+            error = 'Product image is not indexed yet' if Product.objects.filter(id=product_id).exists() else 'Product not found'
+            return Response(
+                {'error': error},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        results = [
+            {
+                'product': ProductSerializer(product).data,
+                'similarity_score': score
+            }
+            for product, score in similar_products
+        ]
+        
+        return Response({
+            'status': 'success',
+            'results': results,
+            'total_found': len(results),
+            'source': source
         })
     except Exception as e:
         return Response(
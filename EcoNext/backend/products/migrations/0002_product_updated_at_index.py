@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-18 06:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updated_at'], name='products_pr_updated_150263_idx'),
+        ),
+    ]
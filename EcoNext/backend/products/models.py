@@ -34,6 +34,8 @@ class Product(models.Model):
         indexes = [
             models.Index(fields=['category', 'created_at']),
             models.Index(fields=['name']),
+            # Search index freshness checks: Max('updated_at') and updated_at >= watermark
+            models.Index(fields=['updated_at']),
         ]
 
 
@@ -1,3 +1,256 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from products.models import Category, Product, ProductSearch
+from ml_engine.price_predictor import PricePredictor
+from ml_engine.intent_search import invalidate_intent_index, query_cache
+from ml_engine.suggest import invalidate_suggest_index
+from ml_engine.extraction_pool import ExtractionPool
+from ml_engine.visual_search import invalidate_visual_index, result_cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from unittest import mock
+from PIL import Image
+import io
 
-# Create your tests here.
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class IntentSearchQueryCountTests(TestCase):
+    def setUp(self):
+        invalidate_intent_index()
+        query_cache.fallback.clear()
+        self.fitness = Category.objects.create(name='Fitness')
+        self.kitchen = Category.objects.create(name='Kitchen')
+    
+    def tearDown(self):
+        invalidate_intent_index()
+    
+    def create_products(self, count):
+        for i in range(count):
+            Product.objects.create(
+                name=f'Yoga Mat {i}',
+                description='Non-slip yoga mat',
+                category=self.fitness if i % 2 else self.kitchen,
+                current_price=20 + i,
+                tags=['yoga', 'gym', f'mat{i}'],
+            )
+        # Warm the process-wide index so only the search itself is counted
+        self.client.get('/api/products/search/intent/', {'q': 'warm up'})
+    
+    def search(self, query):
+        response = self.client.get('/api/products/search/intent/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+    
+    def test_query_count_does_not_grow_with_results(self):
+        # Log the search + fetch the matched products with their categories
+        self.create_products(3)
+        with self.assertNumQueries(2):
+            data = self.search('yoga')
+        self.assertEqual(data['total_found'], 3)
+    
+    def test_query_count_with_many_results(self):
+        self.create_products(20)
+        with self.assertNumQueries(2):
+            data = self.search('yoga mat')
+        self.assertEqual(data['total_found'], 20)
+        self.assertEqual(set(data['results']), {'Fitness', 'Kitchen'})
+    
+    def test_explanations_come_from_the_index(self):
+        self.create_products(2)
+        data = self.search('gym')
+        matches = [result['intent_match'] for results in data['results'].values() for result in results]
+        self.assertEqual(matches, ['Matches intent: gym', 'Matches intent: gym'])
+    
+    def test_bm25_ranker(self):
+        self.create_products(4)
+        response = self.client.get('/api/products/search/intent/', {'q': 'yoga', 'ranker': 'bm25'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['ranker'], 'bm25')
+        self.assertEqual(response.data['total_found'], 4)
+        
+        response = self.client.get('/api/products/search/intent/', {'q': 'yoga', 'ranker': 'nope'})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_misspelled_query_is_corrected(self):
+        self.create_products(3)
+        data = self.search('yoag mat')
+        self.assertEqual(data['did_you_mean'], 'yoga mat')
+        self.assertEqual(data['total_found'], 3)
+        self.assertIsNone(self.search('yoga')['did_you_mean'])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class IntentSearchBatchTests(TestCase):
+    def setUp(self):
+        invalidate_intent_index()
+        query_cache.fallback.clear()
+        fitness = Category.objects.create(name='Fitness')
+        kitchen = Category.objects.create(name='Kitchen')
+        for name, category, tags in [
+            ('Yoga Mat', fitness, ['yoga', 'gym']),
+            ('Dumbbells', fitness, ['gym', 'weights']),
+            ('Chef Knife', kitchen, ['cooking', 'knife']),
+        ]:
+            Product.objects.create(name=name, description='', category=category, current_price=20, tags=tags)
+    
+    def tearDown(self):
+        invalidate_intent_index()
+    
+    def batch(self, payload):
+        return self.client.post('/api/products/search/intent/batch/', payload, content_type='application/json')
+    
+    def test_matches_single_query_searches(self):
+        queries = ['gym', 'yoag', 'cooking knife', 'xylophone']
+        response = self.batch({'queries': queries})
+        self.assertEqual(response.status_code, 200)
+        
+        for query, result in zip(queries, response.data['results']):
+            single = self.client.get('/api/products/search/intent/', {'q': query}).data
+            self.assertEqual(result['query'], query)
+            self.assertEqual(result['results'], single['results'])
+            self.assertEqual(result['did_you_mean'], single['did_you_mean'])
+            self.assertEqual(result['total_found'], single['total_found'])
+        self.assertEqual(response.data['results'][1]['did_you_mean'], 'yoga')
+        self.assertEqual(response.data['results'][3]['total_found'], 0)
+    
+    @override_settings(INTENT_BATCH_MAX_QUERIES=3)
+    def test_rejects_oversized_batches(self):
+        self.assertEqual(self.batch({'queries': ['gym'] * 4}).status_code, 400)
+        self.assertEqual(self.batch({'queries': ['gym'] * 3}).status_code, 200)
+    
+    def test_rejects_malformed_payloads(self):
+        for queries in ([], 'gym', None, {'q': 'gym'}, ['gym', '  '], [{'a': 1}], ['gym', 7]):
+            with self.subTest(queries=queries):
+                self.assertEqual(self.batch({'queries': queries}).status_code, 400)
+        self.assertEqual(self.batch({}).status_code, 400)
+    
+    def test_rejects_unknown_ranker(self):
+        self.assertEqual(self.batch({'queries': ['gym'], 'ranker': 'nope'}).status_code, 400)
+        self.assertEqual(self.batch({'queries': ['gym'], 'ranker': 'bm25'}).status_code, 200)
+
+
+class SearchSuggestTests(TestCase):
+    def setUp(self):
+        invalidate_suggest_index()
+        category = Category.objects.create(name='Fitness')
+        Product.objects.create(name='Yoga Mat', category=category, current_price=20, tags=['yoga', 'gym'])
+        Product.objects.create(name='Yoga Block', category=category, current_price=10, tags=['yoga'])
+        ProductSearch.objects.bulk_create(
+            [ProductSearch(query='yoga for beginners')] * 3 + [ProductSearch(query='yoghurt maker')]
+        )
+    
+    def tearDown(self):
+        invalidate_suggest_index()
+    
+    def suggest(self, query):
+        response = self.client.get('/api/products/search/suggest/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [suggestion['text'] for suggestion in response.data['suggestions']]
+    
+    def test_popular_queries_rank_first(self):
+        # The one-off search is below SUGGEST_MIN_QUERY_COUNT
+        self.assertEqual(self.suggest('yo'), ['yoga for beginners', 'yoga', 'Yoga Block', 'Yoga Mat'])
+    
+    def test_matches_later_words(self):
+        self.assertEqual(self.suggest('MAT'), ['Yoga Mat'])
+        self.assertEqual(self.suggest('block'), ['Yoga Block'])
+        self.assertEqual(self.suggest('xyz'), [])
+
+
+class ProductDetailTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Fitness')
+        self.product = Product.objects.create(
+            name='Yoga Mat', description='Non-slip yoga mat', category=category, current_price=25
+        )
+    
+    def test_detail_reads_the_current_prediction_in_one_query(self):
+        predictor = PricePredictor()
+        results = [(self.product.id, {
+            'predictions': [24.5] * 7, 'recommendation': 'neutral', 'confidence': 0.5, 'price_change': -2.0
+        })]
+        predictor.save_results(results)
+        newest, = predictor.save_results(results)
+        
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/products/{self.product.id}/')
+        self.assertEqual(response.data['product']['category']['name'], 'Fitness')
+        self.assertEqual(response.data['price_prediction']['id'], newest.id)
+        
+        response = self.client.get(f'/api/products/{self.product.id}/prediction/')
+        self.assertEqual(response.data['prediction']['id'], newest.id)
+    
+    def test_product_without_prediction(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/products/{self.product.id}/')
+        self.assertIsNone(response.data['price_prediction'])
+        
+        response = self.client.get(f'/api/products/{self.product.id}/prediction/')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(
+    VISUAL_EXTRACTION_PROCESSES=0, VISUAL_MAX_IMAGE_PIXELS=1_000_000,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class VisualSearchUploadTests(TestCase):
+    def setUp(self):
+        invalidate_visual_index()
+        result_cache.fallback.clear()
+        caches['default'].clear()
+        self.client.force_login(get_user_model().objects.create_user(username='shopper', password='secret'))
+    
+    def upload(self, size, image_format='JPEG', color='teal'):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, color).save(buffer, image_format)
+        image = SimpleUploadedFile(f'query.{image_format.lower()}', buffer.getvalue())
+        return self.client.post('/api/products/search/visual/', {'image': image})
+    
+    @mock.patch('ml_engine.extraction_pool._pool', ExtractionPool(0, 8))
+    def test_reports_stage_timings(self):
+        # 4000x3000 is over the pixel limit but JPEG decodes at 1/8 scale
+        response = self.upload((4000, 3000))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['timings']), {'queue_ms', 'decode_ms', 'extract_ms', 'search_ms'})
+    
+    @mock.patch('ml_engine.extraction_pool._pool', ExtractionPool(0, 8))
+    def test_rejects_oversized_images_that_cannot_be_reduced(self):
+        response = self.upload((1200, 1000), 'PNG')
+        self.assertEqual(response.status_code, 413)
+    
+    @mock.patch('ml_engine.extraction_pool._pool', ExtractionPool(0, 0))
+    def test_busy_pool_answers_503(self):
+        response = self.upload((300, 300))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '2')
+    
+    def test_repeated_uploads_are_served_from_the_cache(self):
+        with mock.patch('ml_engine.extraction_pool._pool', ExtractionPool(0, 8)):
+            first = self.upload((300, 300))
+            resized = self.upload((400, 400), 'PNG')
+            other_color = self.upload((300, 300), color='orange')
+        self.assertEqual((first.data['cache_hit'], first.data['cache_match']), (False, None))
+        self.assertEqual(resized.data['cache_match'], 'perceptual')
+        self.assertFalse(other_color.data['cache_hit'])
+        
+        # Same bytes again: served without decoding, even with the extraction pool full
+        with mock.patch('ml_engine.extraction_pool._pool', ExtractionPool(0, 0)):
+            again = self.upload((300, 300))
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.data['cache_match'], 'exact')
+        self.assertEqual(again.data['timings'], {})
+    
+    @mock.patch('ml_engine.extraction_pool._pool', ExtractionPool(0, 8))
+    def test_unreadable_images_are_logged_with_their_traceback(self):
+        image = SimpleUploadedFile('query.jpeg', b'not an image')
+        with self.assertLogs('products.api_views', 'ERROR') as logs:
+            response = self.client.post('/api/products/search/visual/', {'image': image})
+        self.assertEqual(response.status_code, 400)
+        self.assertIsNotNone(logs.records[0].exc_info)
+    
+    def test_rejects_malformed_filters(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (50, 50), 'teal').save(buffer, 'JPEG')
+        image = SimpleUploadedFile('query.jpeg', buffer.getvalue())
+        response = self.client.post('/api/products/search/visual/', {'image': image, 'min_price': 'cheap'})
+        self.assertEqual(response.status_code, 400)
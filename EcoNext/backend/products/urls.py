@@ -12,7 +12,10 @@ urlpatterns = [
     
     # Search endpoints
     path("search/intent/", api_views.intent_search, name="intent_search"),
+    path("search/intent/batch/", api_views.intent_search_batch, name="intent_search_batch"),
+    path("search/suggest/", api_views.search_suggest, name="search_suggest"),
     path("search/visual/", api_views.visual_search, name="visual_search"),
+    path("<int:product_id>/similar/visual/", api_views.similar_visual, name="similar_visual"),
     path("categories/", api_views.category_browse, name="category_browse"),
     
     # ML endpoints